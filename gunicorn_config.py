@@ -0,0 +1,43 @@
+""" Gunicorn Settings
+
+Usage:
+    gunicorn shopping_list:app -c gunicorn_config.py
+"""
+
+import os
+import logging
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+
+# Load and warm the application once in the master, shared by all workers
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def on_starting(server):
+    """ Master: write application logs (shopping_list.*) through gunicorn's error log """
+    app_logger = logging.getLogger("shopping_list")
+    app_logger.handlers = list(logging.getLogger("gunicorn.error").handlers)
+    app_logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    app_logger.propagate = False
+
+
+def when_ready(server):
+    """ Master: warm up the preloaded application before forking workers """
+    if preload_app:
+        from shopping_list import warmup
+        warmup.warm_up()
+
+
+def post_fork(server, worker):
+    """ Worker: replace connection pool and metrics inherited from master """
+    if preload_app:
+        from shopping_list import warmup
+        warmup.after_fork()
+
+
+def post_worker_init(worker):
+    """ Worker: warm up when the application is loaded per worker """
+    if not preload_app:
+        from shopping_list import warmup
+        warmup.warm_up()
+        warmup.after_fork()
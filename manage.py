@@ -7,9 +7,12 @@ from flask.ext.script import Manager
 
 from shopping_list import app
 
-from shopping_list.database import Base, engine
+from shopping_list.database import Base, engine, session
 from shopping_list import models
-from tests import test_data
+from shopping_list import cache
+from shopping_list import migrations
+from shopping_list import loader
+from shopping_list import export
 
 manager = Manager(app)
 
@@ -27,6 +30,8 @@ def resetdb():
     """ Drop and create development database """
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        migrations.stamp(connection, migrations.latest_version())
     table_count = len([x for x in engine.table_names()])
     print("Database reset. {} tables added.".format(table_count))
 
@@ -34,10 +39,86 @@ def resetdb():
 @manager.command
 def seed_data():
     """ Add all test data to development database """
+    from tests import test_data
     resetdb()
     test_data.add_all()
     print("Seed data added.")
 
+@manager.command
+def migrate():
+    """ Create or upgrade database schema to latest version """
+    applied = migrations.upgrade()
+    for version, name in applied:
+        print("Applied migration {}: {}".format(version, name))
+    print("Database schema at version {}.".format(migrations.latest_version()))
+
+
+@manager.option("-u", "--users", dest="users", type=int, default=100, help="Number of users")
+@manager.option("-s", "--stores", dest="stores", type=int, default=2, help="Maximum stores per user")
+@manager.option("-w", "--weeks", dest="weeks", type=int, default=52, help="Weeks of list history")
+@manager.option("--seed", dest="seed", type=int, default=1, help="Random seed")
+def generate_data(users, stores, weeks, seed):
+    """ Add synthetic benchmark data to development database (after preload_data) """
+    from tests import generate_data as synthetic_data
+    counts = synthetic_data.generate(users=users, stores_per_user=stores, weeks=weeks, seed=seed)
+    for table_name, count in sorted(counts.items()):
+        print("{} {} rows added.".format(count, table_name))
+
+
+@manager.option("-n", "--iterations", dest="iterations", type=int, default=200, help="Measured requests per view")
+@manager.option("-l", "--lists", dest="lists", type=int, default=50, help="Lists sampled")
+@manager.option("--warmup", dest="warmup", type=int, default=10, help="Unmeasured requests per view")
+@manager.option("--seed", dest="seed", type=int, default=1, help="Random seed")
+@manager.option("-o", "--output", dest="output", default="benchmark.json", help="JSON results file")
+def benchmark(iterations, lists, warmup, seed, output):
+    """ Benchmark views against generated data, write results JSON """
+    from tests import benchmark as view_benchmark
+    results = view_benchmark.run(iterations=iterations, lists=lists, warmup=warmup, seed=seed, output=output)
+    for name, view in sorted(results["views"].items()):
+        print("{:<18} p50 {:>9.2f} ms  p99 {:>9.2f} ms  queries {:>6.1f}".format(
+            name, view["latency_ms"]["p50"], view["latency_ms"]["p99"], view["queries"]["mean"]))
+    print("Results written to {}.".format(output))
+
+
+@manager.option("-m", "--model", dest="model", required=True, help="Model class name, e.g. Store")
+@manager.option("-p", "--path", dest="path", required=True, help="JSON Lines (.jsonl) or CSV (.csv) file")
+@manager.option("-f", "--format", dest="input_format", default=None, help="jsonl or csv, default from extension")
+@manager.option("-c", "--chunk-size", dest="chunk_size", type=int, default=5000, help="Records per transaction")
+@manager.option("--restart", dest="restart", action="store_true", default=False, help="Ignore checkpoint")
+def load_data(model, path, input_format, chunk_size, restart):
+    """ Stream large JSON Lines or CSV file into a table, resumable """
+    def progress(records, rate):
+        print("{} records loaded ({:.0f} records/s)".format(records, rate))
+
+    loaded, skipped = loader.load_file(model, path, input_format=input_format, chunk_size=chunk_size,
+                                       resume=not restart, progress=progress)
+    cache.invalidate_all()
+    if skipped:
+        print("Resumed after {} records loaded previously.".format(skipped))
+    print("{} {} records loaded.".format(loaded, model))
+
+
+@manager.option("-u", "--user-id", dest="user_id", type=int, required=True, help="User id")
+@manager.option("-f", "--format", dest="export_format", default="csv", choices=sorted(export.FORMATS),
+                help="csv or jsonl")
+@manager.option("-o", "--output", dest="output", required=True, help="Output file path")
+def export_lists(user_id, export_format, output):
+    """ Export all Lists and List Items of a User as CSV or JSON Lines """
+    lines, _ = export.FORMATS[export_format]
+    with open(output, "w", newline="") as output_file:
+        for chunk in lines(user_id):
+            output_file.write(chunk)
+    print("Lists exported to {}.".format(output))
+
+
+@manager.command
+def compact_changes():
+    """ Compact List change log (schedule periodically) """
+    deleted = models.ListChange.compact(app.config["CHANGE_LOG_RETENTION_DAYS"])
+    session.commit()
+    print("List change log compacted. {} rows deleted.".format(deleted))
+
+
 @manager.command
 def preload_data():
     """ Add all preloaded default data to production database
@@ -52,10 +133,10 @@ def preload_data():
         data = json.load(data_file)
 
     for model_name, values_list in sorted(data.items()):
-        table = getattr(getattr(models, model_name),"__table__")
-        ins = getattr(table, "insert")().values(values_list)
-        engine.execute(ins)
+        loader.BulkLoader(getattr(models, model_name)).load(values_list)
         print("{} data added.".format(model_name))
 
+    cache.invalidate_all()
+
 if __name__ == "__main__":
     manager.run()
\ No newline at end of file
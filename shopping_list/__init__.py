@@ -14,11 +14,26 @@ else:
 
 app.config.from_object(config_path)
 
+# Client address from the trusted proxy hop (login throttling, logs)
+if app.config["PROXY_COUNT"]:
+    from werkzeug.contrib.fixers import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, num_proxies=app.config["PROXY_COUNT"])
+
 # Import modules
+from . import metrics
 from . import login
+from . import instrumentation
 from . import views
 from . import utils
+from .api import api
+app.register_blueprint(api)
+
+# Opt-in request profiling
+if app.config["PROFILE_ENABLED"]:
+    from . import profiling
+    profiling.install()
 
-# Database initialization
-from .database import Base, engine
-Base.metadata.create_all(engine)
\ No newline at end of file
+# Schema is created and migrated by manage.py migrate, optionally checked once per worker
+if app.config["SCHEMA_CHECK"]:
+    from . import migrations
+    app.before_first_request(migrations.check_schema)
@@ -0,0 +1,539 @@
+""" JSON REST API (version 1)
+
+Same resources as the HTML views: Stores, Routes, Route Groups, Lists and List Items
+"""
+
+import json
+import datetime
+from decimal import Decimal
+from collections import OrderedDict
+
+from flask import Blueprint, request, Response
+from flask.ext.login import current_user
+
+from . import cache
+from .classifier import classifier, learn_on_commit, route_item_group_ids
+from .database import session
+from .decorators import accept, require
+from .login import current_user_id
+from .models import Store, UserStore, Route, RouteGroup, List, ListItem, ListChange
+from .pages import ListPageData
+from .suggest import suggester, learn_names_on_commit
+from .utils import column_map, parse_item_lines
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+# Columns clients may set per model
+WRITABLE_COLUMNS = {
+    Store: ("name", "street_address", "city", "state", "postal_code", "country"),
+    UserStore: ("nickname", "default"),
+    Route: ("name", "default"),
+    RouteGroup: ("item_group_id", "route_order"),
+    List: ("shop_date", "name", "route_id"),
+    ListItem: ("item_name", "item_notes", "item_quantity", "item_measurement_id", "item_group_id"),
+}
+
+# Reference columns checked against the reference caches
+REFERENCE_COLUMNS = {
+    "item_group_id": cache.item_groups,
+    "item_measurement_id": cache.item_measurements,
+}
+
+
+class APIError(Exception):
+    """ Error returned to client as JSON message
+
+    Attributes:
+        message (str): Error message
+        status (int): HTTP status code
+    """
+
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status = status
+
+
+def _json_default(value):
+    """ Serialize values json does not handle natively """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def json_response(data, status=200):
+    """ Compact JSON response """
+    return Response(json.dumps(data, default=_json_default, separators=(",", ":")),
+                    status, mimetype="application/json")
+
+
+def user_id():
+    """ Current User id """
+    return current_user_id()
+
+
+def request_values(model):
+    """ Writable column values from request JSON, coerced by column type
+
+    Return:
+        Dictionary of column name: value
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise APIError("Request must contain a JSON object", 422)
+
+    columns = column_map(model)
+    values = {}
+    for key, value in data.items():
+        if key in WRITABLE_COLUMNS[model]:
+            try:
+                values[key] = columns[key](value)
+            except (TypeError, ValueError, ArithmeticError):
+                raise APIError("Invalid value for {}: {!r}".format(key, value), 422)
+    check_references(values)
+    return values
+
+
+def check_references(values):
+    """ Test referenced Item Groups and Item Measurements exist and Routes belong to current User
+
+    Raise:
+        APIError: 400 for an unknown or foreign reference
+    """
+    for key, reference_cache in REFERENCE_COLUMNS.items():
+        value = values.get(key)
+        if value is not None and value not in set(row.id for row in reference_cache.all()):
+            raise APIError("Invalid {}: {}".format(key, value), 400)
+
+    route_id = values.get("route_id")
+    if route_id is not None and not session.query(Route.id)\
+            .filter(Route.id == route_id, Route.user_id == user_id()).first():
+        raise APIError("Invalid route_id: {}".format(route_id), 400)
+
+
+def set_values(row, values):
+    """ Set column values on model row """
+    for key, value in values.items():
+        setattr(row, key, value)
+
+
+# Ownership lookups, 404 if not found for current User
+
+def get_user_store(store_id):
+    """ UserStore for current User and Store """
+    user_store = session.query(UserStore).filter(UserStore.user_id == user_id(),
+                                                 UserStore.store_id == store_id).first()
+    if not user_store:
+        raise APIError("Could not find store with id {}".format(store_id), 404)
+    return user_store
+
+
+def get_route(route_id):
+    """ Route owned by current User """
+    route = session.query(Route).filter(Route.id == route_id, Route.user_id == user_id()).first()
+    if not route:
+        raise APIError("Could not find route with id {}".format(route_id), 404)
+    return route
+
+
+def get_list(list_id):
+    """ List owned by current User """
+    list = session.query(List).filter(List.id == list_id, List.user_id == user_id()).first()
+    if not list:
+        raise APIError("Could not find list with id {}".format(list_id), 404)
+    return list
+
+
+def store_dict(store, user_store):
+    """ Store with User nickname and default flag """
+    data = store.as_dict_base()
+    data.update(nickname=user_store.nickname, default=user_store.default)
+    return data
+
+
+def route_dict(route):
+    """ Route with ordered Route Groups """
+    data = route.as_dict_base()
+    data["route_groups"] = [row._asdict() for row in ListPageData.load_route_groups(route.id)]
+    return data
+
+
+def list_dict(list):
+    """ List with List Items in route order """
+    data = list.as_dict_base()
+    data["list_items"] = [row._asdict() for row in ListPageData.load_list_items(list.id, list.route_id)]
+    return data
+
+
+@api.errorhandler(APIError)
+def handle_api_error(error):
+    """ Roll back and return APIError as JSON message """
+    session.rollback()
+    return json_response({"message": error.message}, error.status)
+
+
+@api.before_request
+def require_login():
+    """ All API resources require an authenticated User """
+    if current_user.is_anonymous():
+        return json_response({"message": "Authentication required"}, 401)
+
+
+# Stores
+
+@api.route("/stores", methods=["GET"])
+@accept("application/json")
+def stores_get():
+    """ All Stores for current User """
+    rows = session.query(Store, UserStore).join(UserStore, UserStore.store_id == Store.id)\
+        .filter(UserStore.user_id == user_id()).order_by(Store.id)
+    return json_response([store_dict(store, user_store) for store, user_store in rows])
+
+
+@api.route("/stores", methods=["POST"])
+@accept("application/json")
+@require("application/json")
+def stores_post():
+    """ Create Store with cloned default Route for current User """
+    store = Store(name="New Store")
+    set_values(store, request_values(Store))
+    session.add(store)
+    session.flush()
+
+    # Clone default Route to associate with new Store and User
+    default_route = session.query(Route).filter(Route.default == True).first()
+    if default_route:
+        default_route.clone("Default Route", user_id=user_id(), store=[store])
+
+    user_store = UserStore(store_id=store.id, user_id=user_id())
+    set_values(user_store, request_values(UserStore))
+    session.add(user_store)
+    session.commit()
+
+    return json_response(store_dict(store, user_store), 201)
+
+
+@api.route("/stores/<int:store_id>", methods=["GET"])
+@accept("application/json")
+def store_get(store_id):
+    """ Single Store """
+    user_store = get_user_store(store_id)
+    return json_response(store_dict(user_store.store, user_store))
+
+
+@api.route("/stores/<int:store_id>", methods=["PUT"])
+@accept("application/json")
+@require("application/json")
+def store_put(store_id):
+    """ Edit Store and UserStore nickname/default """
+    user_store = get_user_store(store_id)
+    set_values(user_store.store, request_values(Store))
+    set_values(user_store, request_values(UserStore))
+    session.commit()
+    return json_response(store_dict(user_store.store, user_store))
+
+
+@api.route("/stores/<int:store_id>", methods=["DELETE"])
+@accept("application/json")
+def store_delete(store_id):
+    """ Remove Store from current User """
+    session.delete(get_user_store(store_id))
+    session.commit()
+    return json_response({"message": "Successfully deleted store"})
+
+
+# Routes
+
+@api.route("/stores/<int:store_id>/routes", methods=["GET"])
+@accept("application/json")
+def routes_get(store_id):
+    """ All Routes for current User and Store """
+    store = get_user_store(store_id).store
+    routes = session.query(Route).filter(Route.user_id == user_id(), Route.store.contains(store))\
+        .order_by(Route.id)
+    return json_response([route.as_dict_base() for route in routes])
+
+
+@api.route("/stores/<int:store_id>/routes", methods=["POST"])
+@accept("application/json")
+@require("application/json")
+def routes_post(store_id):
+    """ Create Route for Store """
+    store = get_user_store(store_id).store
+    route = Route(name="New Route", user_id=user_id(), store=[store])
+    set_values(route, request_values(Route))
+    session.add(route)
+    session.commit()
+    return json_response(route_dict(route), 201)
+
+
+@api.route("/routes/<int:route_id>", methods=["GET"])
+@accept("application/json")
+def route_get(route_id):
+    """ Single Route with Route Groups """
+    return json_response(route_dict(get_route(route_id)))
+
+
+@api.route("/routes/<int:route_id>", methods=["PUT"])
+@accept("application/json")
+@require("application/json")
+def route_put(route_id):
+    """ Edit Route """
+    route = get_route(route_id)
+    set_values(route, request_values(Route))
+    session.commit()
+    return json_response(route_dict(route))
+
+
+@api.route("/routes/<int:route_id>", methods=["DELETE"])
+@accept("application/json")
+def route_delete(route_id):
+    """ Delete Route """
+    session.delete(get_route(route_id))
+    session.commit()
+    return json_response({"message": "Successfully deleted route"})
+
+
+@api.route("/routes/<int:route_id>/routegroups", methods=["POST"])
+@accept("application/json")
+@require("application/json")
+def route_groups_post(route_id):
+    """ Append Route Group to Route """
+    route = get_route(route_id)
+    values = request_values(RouteGroup)
+    route.add_route_group(values.get("item_group_id"))
+    session.commit()
+    return json_response(route_dict(route), 201)
+
+
+@api.route("/routes/<int:route_id>/routegroups/<int:route_group_id>", methods=["PUT", "DELETE"])
+@accept("application/json")
+def route_group_update(route_id, route_group_id):
+    """ Edit or delete Route Group """
+    route = get_route(route_id)
+    route_group = session.query(RouteGroup).filter(RouteGroup.id == route_group_id,
+                                                   RouteGroup.route_id == route.id).first()
+    if not route_group:
+        raise APIError("Could not find route group with id {}".format(route_group_id), 404)
+
+    if request.method == "DELETE":
+        session.delete(route_group)
+    else:
+        set_values(route_group, request_values(RouteGroup))
+    session.commit()
+    return json_response(route_dict(route))
+
+
+# Lists
+
+@api.route("/stores/<int:store_id>/lists", methods=["GET"])
+@accept("application/json")
+def lists_get(store_id):
+    """ All Lists for current User and Store, latest first """
+    get_user_store(store_id)
+    lists = session.query(List).filter(List.user_id == user_id(), List.store_id == store_id)\
+        .order_by(List.shop_date.desc(), List.id.desc())
+    return json_response([list.as_dict_base() for list in lists])
+
+
+@api.route("/stores/<int:store_id>/lists", methods=["POST"])
+@accept("application/json")
+@require("application/json")
+def lists_post(store_id):
+    """ Create List for Store """
+    get_user_store(store_id)
+    list = List(user_id=user_id(), store_id=store_id)
+    set_values(list, request_values(List))
+    session.add(list)
+    session.commit()
+    return json_response(list_dict(list), 201)
+
+
+@api.route("/lists/<int:list_id>", methods=["GET"])
+@accept("application/json")
+def list_get(list_id):
+    """ Single List with List Items """
+    return json_response(list_dict(get_list(list_id)))
+
+
+@api.route("/lists/<int:list_id>", methods=["PUT"])
+@accept("application/json")
+@require("application/json")
+def list_put(list_id):
+    """ Edit List """
+    list = get_list(list_id)
+    set_values(list, request_values(List))
+    session.commit()
+    return json_response(list_dict(list))
+
+
+@api.route("/lists/<int:list_id>", methods=["DELETE"])
+@accept("application/json")
+def list_delete(list_id):
+    """ Delete List and its List Items """
+    list = get_list(list_id)
+    session.query(ListItem).filter(ListItem.list_id == list.id).delete()
+    session.delete(list)
+    session.commit()
+    return json_response({"message": "Successfully deleted list"})
+
+
+# List Items
+
+@api.route("/lists/<int:list_id>/items", methods=["GET"])
+@accept("application/json")
+def list_items_get(list_id):
+    """ List Items in route order """
+    list = get_list(list_id)
+    rows = ListPageData.load_list_items(list.id, list.route_id)
+    return json_response([row._asdict() for row in rows])
+
+
+@api.route("/lists/<int:list_id>/items", methods=["POST"])
+@accept("application/json")
+@require("application/json")
+def list_items_post(list_id):
+    """ Add List Item """
+    list = get_list(list_id)
+    list_item = ListItem(item_name="New Item", list_id=list.id)
+    set_values(list_item, request_values(ListItem))
+    session.add(list_item)
+    session.commit()
+    return json_response(list_item.as_dict_base(), 201)
+
+
+@api.route("/lists/<int:list_id>/items/import", methods=["POST"])
+@accept("application/json")
+@require("application/json")
+def list_items_import(list_id):
+    """ Add List Items parsed from pasted text (JSON text), one item per line """
+    list = get_list(list_id)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("text"), str):
+        raise APIError("Request must contain text", 422)
+
+    items = parse_item_lines(data["text"])
+    classifier.assign_groups(items, list.user_id, route_item_group_ids(session, list.id))
+    ids = ListItem.insert_many(list.id, items)
+    learn_on_commit(items)
+    learn_names_on_commit(items)
+    session.commit()
+
+    items = session.query(ListItem).filter(ListItem.id.in_(ids)).order_by(ListItem.id) if ids else []
+    return json_response([item.as_dict_base() for item in items], 201)
+
+
+@api.route("/lists/<int:list_id>/items/<int:list_item_id>", methods=["PUT", "DELETE"])
+@accept("application/json")
+def list_item_update(list_id, list_item_id):
+    """ Edit or delete List Item """
+    list = get_list(list_id)
+    list_item = session.query(ListItem).filter(ListItem.id == list_item_id,
+                                               ListItem.list_id == list.id).first()
+    if not list_item:
+        raise APIError("Could not find list item with id {}".format(list_item_id), 404)
+
+    if request.method == "DELETE":
+        session.delete(list_item)
+        session.commit()
+        return json_response({"message": "Successfully deleted list item"})
+
+    set_values(list_item, request_values(ListItem))
+    session.commit()
+    return json_response(list_item.as_dict_base())
+
+
+# Autocomplete
+
+@api.route("/suggest", methods=["GET"])
+@accept("application/json")
+def suggest_get():
+    """ Ranked item name completions from current User's past List Items
+
+    Query parameters:
+        q (str): Typed prefix
+        limit (int): Maximum completions, default 10
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 50)
+    except ValueError:
+        raise APIError("limit must be an integer", 422)
+    return json_response(suggester.suggest(user_id(), request.args.get("q", ""), limit))
+
+
+# Delta sync
+
+def fold_changes(changes, since=0):
+    """ Fold change rows into the final operation per List Item
+
+    Updates after an insert stay an insert, a delete after an insert cancels both
+
+    Args:
+        changes (iterable): (id, entity, entity_id, operation) rows in id order
+        since (int): Cursor the changes follow
+
+    Return:
+        Tuple of cursor after the last change, List changed flag
+            and ordered dictionary of List Item id: operation
+    """
+    cursor = since
+    list_changed = False
+    operations = OrderedDict()
+    for change_id, entity, entity_id, operation in changes:
+        cursor = change_id
+        if entity == "List":
+            list_changed = True
+            continue
+        previous = operations.get(entity_id)
+        if operation == "update" and previous == "insert":
+            continue
+        if operation == "delete" and previous == "insert":
+            operations.pop(entity_id)
+            continue
+        operations[entity_id] = operation
+    return cursor, list_changed, operations
+
+
+@api.route("/lists/<int:list_id>/changes", methods=["GET"])
+@accept("application/json")
+def list_changes_get(list_id):
+    """ List and List Item changes since cursor
+
+    Query parameters:
+        since (int): Cursor from previous response, 0 for all changes
+
+    Return:
+        cursor: Cursor for next request
+        list: List data if List changed, else null
+        inserted/updated: List Item data (apply as upserts)
+        deleted: Deleted List Item ids
+    """
+    list = get_list(list_id)
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        raise APIError("since must be an integer cursor", 422)
+
+    changes = session.query(ListChange.id, ListChange.entity, ListChange.entity_id, ListChange.operation)\
+        .filter(ListChange.list_id == list.id, ListChange.id > since)\
+        .order_by(ListChange.id)
+
+    cursor, list_changed, operations = fold_changes(changes, since)
+
+    # Current data for inserted and updated List Items
+    item_ids = [entity_id for entity_id, operation in operations.items() if operation != "delete"]
+    items = {}
+    if item_ids:
+        items = {item.id: item.as_dict_base()
+                 for item in session.query(ListItem).filter(ListItem.id.in_(item_ids))}
+
+    return json_response({
+        "cursor": cursor,
+        "list": list.as_dict_base() if list_changed else None,
+        "inserted": [items[i] for i, operation in operations.items() if operation == "insert" and i in items],
+        "updated": [items[i] for i, operation in operations.items() if operation == "update" and i in items],
+        "deleted": [i for i, operation in operations.items() if operation == "delete"],
+    })
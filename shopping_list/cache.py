@@ -0,0 +1,230 @@
+""" In-process Caches """
+
+import time
+import threading
+from collections import namedtuple, OrderedDict
+
+from sqlalchemy import event, select
+
+from . import app
+from .database import engine, session, Session
+from .metrics import registry
+from .models import ItemGroup, ItemMeasurements, reference_version_table
+
+
+class ReferenceCache(object):
+    """ Snapshot of a rarely changing reference table
+
+    Rows are held as an immutable tuple of lightweight records and
+        reloaded only when the table's version in reference_version changes.
+        Writers bump the version in their transaction (bump_reference_versions),
+        so writes from other workers or manage.py are seen within check_interval.
+        Writes in this process are seen on the next read.
+
+    Attributes:
+        model (class): SQLAlchemy model class
+        record (class): Named tuple class for snapshot rows
+        version (int): Table version of the snapshot
+        check_interval (float): Seconds between version checks
+    """
+
+    def __init__(self, model, fields, order_by=None, check_interval=5):
+        self.model = model
+        self.name = model.__tablename__
+        self.record = namedtuple("{}Record".format(model.__name__), fields)
+        self.columns = [getattr(model, field) for field in fields]
+        self.order_by = order_by if order_by is not None else model.id
+        self.check_interval = check_interval
+        self.version = None
+        self._checked_at = None
+        self._snapshot = ()
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """ Check version on next read """
+        self._checked_at = None
+
+    def _stale(self, now):
+        return self._checked_at is None or now - self._checked_at >= self.check_interval
+
+    def current_version(self):
+        """ Table version, reloading the snapshot when it changed
+
+        Return:
+            Version of the current snapshot
+        """
+        if self._stale(time.time()):
+            with self._lock:
+                now = time.time()
+                if self._stale(now):
+                    table = reference_version_table
+                    version = session.execute(select([table.c.version])
+                                              .where(table.c.name == self.name)).scalar() or 0
+                    if version != self.version:
+                        rows = session.query(*self.columns).order_by(self.order_by).all()
+                        self._snapshot = tuple(self.record(*row) for row in rows)
+                        self.version = version
+                    self._checked_at = now
+        return self.version
+
+    def all(self):
+        """ Retrieve snapshot of all rows
+
+        Return:
+            Tuple of records
+        """
+        self.current_version()
+        return self._snapshot
+
+
+class RenderedCache(object):
+    """ Bounded LRU of rendered pages
+
+    Keys embed entity versions, so changed data is never served
+        and stale entries age out of the LRU.
+
+    Attributes:
+        max_bytes (int): Byte budget for cached bodies
+        hits (int): Lookups answered from cache
+        misses (int): Lookups not in cache
+        evictions (int): Entries evicted to stay within byte budget
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Retrieve cached body, or None """
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key, body):
+        """ Cache body (bytes), evicting least recently used entries over budget """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """ Remove all entries, keeping counters """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_or_render(self, key, render):
+        """ Retrieve cached body or render (str) and cache it """
+        body = self.get(key)
+        if body is None:
+            body = render().encode("utf-8")
+            self.set(key, body)
+        return body
+
+    def stats(self):
+        """ Cache counters and usage
+
+        Return:
+            Dictionary of hits, misses, evictions, entries, bytes and max_bytes
+        """
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self._entries),
+                    "bytes": self._bytes,
+                    "max_bytes": self.max_bytes}
+
+
+# Rendered printable Lists, keyed by List/Route/Store versions
+print_pages = RenderedCache(app.config["PRINT_CACHE_MAX_BYTES"])
+
+
+@registry.collector
+def print_cache_gauges():
+    """ Printable List cache statistics as metrics gauges """
+    return [("print_cache_{}".format(name), {}, value) for name, value in sorted(print_pages.stats().items())]
+
+
+registry.describe("print_cache_hits", "gauge", "Printable List cache hits")
+registry.describe("print_cache_misses", "gauge", "Printable List cache misses")
+registry.describe("print_cache_evictions", "gauge", "Printable List cache evictions")
+registry.describe("print_cache_entries", "gauge", "Printable List cache entries")
+registry.describe("print_cache_bytes", "gauge", "Printable List cache bytes used")
+registry.describe("print_cache_max_bytes", "gauge", "Printable List cache byte budget")
+
+
+# Reference table caches
+item_groups = ReferenceCache(ItemGroup, ["id", "name", "description"],
+                             check_interval=app.config["REFERENCE_CACHE_CHECK_INTERVAL"])
+item_measurements = ReferenceCache(ItemMeasurements, ["id", "name", "abbreviation"],
+                                   check_interval=app.config["REFERENCE_CACHE_CHECK_INTERVAL"])
+
+reference_caches = {cache.model: cache for cache in [item_groups, item_measurements]}
+
+
+def bump_reference_versions(connection, models):
+    """ Increment reference_version rows of models
+
+    Rows are seeded with the table (models.seed_reference_versions), so concurrent
+        first writes never race on inserting a row
+
+    Does not commit
+
+    Args:
+        connection: Connection or Session in the writing transaction
+        models (iterable[class]): Reference models written
+    """
+    table = reference_version_table
+    for model in models:
+        connection.execute(table.update().where(table.c.name == model.__tablename__)
+                           .values(version=table.c.version + 1))
+
+
+def invalidate_all():
+    """ Invalidate all reference caches in all workers, e.g. after bulk loading data """
+    with engine.begin() as connection:
+        bump_reference_versions(connection, reference_caches)
+    for cache in reference_caches.values():
+        cache.invalidate()
+
+
+@event.listens_for(Session, "after_flush")
+def track_reference_writes(db_session, flush_context):
+    """ Bump versions of reference models written in this flush, in the same transaction """
+    written = set(type(instance) for instance in
+                  list(db_session.new) + list(db_session.dirty) + list(db_session.deleted)
+                  if type(instance) in reference_caches)
+    if written:
+        bump_reference_versions(db_session, written)
+        db_session.info.setdefault("reference_writes", set()).update(written)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_reference_writes(db_session):
+    """ Invalidate caches for reference models written in committed transaction """
+    for model in db_session.info.pop("reference_writes", ()):
+        reference_caches[model].invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_reference_writes(db_session):
+    """ Discard reference writes for rolled back transaction """
+    db_session.info.pop("reference_writes", None)
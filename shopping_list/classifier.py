@@ -0,0 +1,326 @@
+""" Item Group Classifier
+
+Assign List Items to Item Groups (store sections) from List Item history.
+    Built once from an aggregate query, then updated incrementally as items are saved.
+    Lookups read only in-memory token indexes, in time proportional to the name length.
+    The global index is loaded at worker start (warmup.py) or in a background thread,
+    never inside a write request, and holds at most CLASSIFIER_MAX_GLOBAL_NAMES names.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from flask import has_request_context
+from sqlalchemy import select, func, event, inspect
+
+from . import app
+from .database import engine, session, Session
+from .login import current_user_id
+from .models import List, ListItem, RouteGroup
+
+
+# Weight of the User's own history against global history
+USER_WEIGHT = 5
+
+_token_pattern = re.compile(r"[a-z0-9]+")
+
+
+def singular(token):
+    """ Singular form of a lowercase token, the same for both forms
+
+    Example:
+        "berries" -> "berry", "tomatoes" -> "tomato", "peaches" -> "peach", "apples" -> "apple"
+    """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("oes"):
+        return token[:-2]
+    if len(token) > 4 and token.endswith(("sses", "xes", "zzes", "ches", "shes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def tokenize(name):
+    """ Split item name into lowercase singular tokens
+
+    Example:
+        "Roma Tomatoes" -> ["roma", "tomato"]
+    """
+    return [singular(token) for token in _token_pattern.findall(name.lower())]
+
+
+class GroupIndex(object):
+    """ Item name and token index of Item Group frequencies
+
+    Attributes:
+        names (dict): Normalized item name: {item_group_id: count}
+        tokens (dict): Name token: {item_group_id: count}
+        max_names (int): Names kept, None for no limit
+    """
+
+    def __init__(self, max_names=None):
+        self.names = {}
+        self.tokens = {}
+        self.max_names = max_names
+
+    def add(self, name, item_group_id, count=1):
+        """ Count item name in Item Group, new names are ignored when full """
+        tokens = tokenize(name)
+        if not tokens:
+            return
+        key = " ".join(tokens)
+        if self.max_names is not None and key not in self.names and len(self.names) >= self.max_names:
+            return
+        groups = self.names.setdefault(key, {})
+        groups[item_group_id] = groups.get(item_group_id, 0) + count
+        for token in tokens:
+            groups = self.tokens.setdefault(token, {})
+            groups[item_group_id] = groups.get(item_group_id, 0) + count
+
+    def scores(self, tokens, item_group_ids=None):
+        """ Item Group scores for name tokens
+
+        Exact name matches score above any token match
+
+        Args:
+            item_group_ids (set[int]): Candidate Item Groups, None for any
+        """
+        scores = {}
+        for item_group_id, count in self.names.get(" ".join(tokens), {}).items():
+            if item_group_ids is None or item_group_id in item_group_ids:
+                scores[item_group_id] = count * 1000
+        if scores:
+            return scores
+        for token in tokens:
+            for item_group_id, count in self.tokens.get(token, {}).items():
+                if item_group_ids is None or item_group_id in item_group_ids:
+                    scores[item_group_id] = scores.get(item_group_id, 0) + count
+        return scores
+
+
+class ItemClassifier(object):
+    """ Global and per User Item Group indexes
+
+    Per User indexes are loaded lazily and evicted least recently used
+
+    Attributes:
+        max_users (int): Per User indexes kept in memory
+        max_global_names (int): Most frequent names kept in the global index
+    """
+
+    def __init__(self, max_users, max_global_names):
+        self.max_users = max_users
+        self.max_global_names = max_global_names
+        self._global = None
+        self._loading = False
+        self._users = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _load(user_id=None, max_names=None, connection=None):
+        """ Build index from List Item history with one aggregate query
+
+        Args:
+            max_names (int): Keep only the most frequent names
+            connection: Connection to query, default the request session
+        """
+        table = ListItem.__table__
+        query = select([table.c.item_name, table.c.item_group_id, func.count()])\
+            .where(table.c.item_group_id.isnot(None))\
+            .group_by(table.c.item_name, table.c.item_group_id)
+        if user_id is not None:
+            lists = List.__table__
+            query = query.select_from(table.join(lists, lists.c.id == table.c.list_id))\
+                .where(lists.c.user_id == user_id)
+        if max_names is not None:
+            query = query.order_by(func.count().desc()).limit(max_names)
+
+        index = GroupIndex(max_names)
+        for item_name, item_group_id, count in (connection or session).execute(query):
+            index.add(item_name, item_group_id, count)
+        return index
+
+    def _load_global(self):
+        """ Load global index on its own connection (background thread) """
+        try:
+            with engine.connect() as connection:
+                index = self._load(max_names=self.max_global_names, connection=connection)
+            with self._lock:
+                self._global = index
+        except Exception:
+            app.logger.exception("Item Group classifier global index failed to load")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def global_index(self, wait=True):
+        """ Global index, loaded on first use
+
+        Args:
+            wait (bool): Load before returning, else start a background load
+
+        Return:
+            GroupIndex, or None while loading in the background
+        """
+        with self._lock:
+            if self._global is None and not self._loading:
+                if wait:
+                    self._global = self._load(max_names=self.max_global_names)
+                else:
+                    self._loading = True
+                    threading.Thread(target=self._load_global, daemon=True).start()
+            return self._global
+
+    def user_index(self, user_id, load=True):
+        """ User index, loaded on first use
+
+        Return:
+            GroupIndex, or None if not loaded and load is False
+        """
+        user_id = int(user_id)
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+            elif load:
+                index = self._users[user_id] = self._load(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            return index
+
+    def classify(self, name, user_id=None, item_group_ids=None):
+        """ Most likely Item Group for item name
+
+        Args:
+            item_group_ids (set[int]): Candidate Item Groups (the List's Route Groups), None for any
+
+        Return:
+            Item Group id or None
+        """
+        tokens = tokenize(name or "")
+        if not tokens or item_group_ids is not None and not item_group_ids:
+            return None
+
+        global_index = self.global_index(wait=False)
+        scores = global_index.scores(tokens, item_group_ids) if global_index is not None else {}
+        if user_id is not None:
+            for item_group_id, score in self.user_index(user_id).scores(tokens, item_group_ids).items():
+                scores[item_group_id] = scores.get(item_group_id, 0) + score * USER_WEIGHT
+        if not scores:
+            return None
+        return max(sorted(scores), key=scores.get)
+
+    def assign_groups(self, items, user_id=None, item_group_ids=None):
+        """ Set item_group_id on List Item values without one
+
+        Args:
+            items (list[dict]): List Item column values, e.g. from parse_item_lines
+            item_group_ids (set[int]): Candidate Item Groups, see classify
+        """
+        for item in items:
+            if not item.get("item_group_id"):
+                item["item_group_id"] = self.classify(item["item_name"], user_id, item_group_ids)
+
+    def learn(self, name, item_group_id, user_id=None):
+        """ Add saved List Item to loaded indexes """
+        with self._lock:
+            if self._global is not None:
+                self._global.add(name, item_group_id)
+            if user_id is not None:
+                index = self.user_index(user_id, load=False)
+                if index is not None:
+                    index.add(name, item_group_id)
+
+
+classifier = ItemClassifier(app.config["CLASSIFIER_MAX_USERS"], app.config["CLASSIFIER_MAX_GLOBAL_NAMES"])
+
+
+def route_item_group_ids(db_session, list_id):
+    """ Item Groups of the List's Route, the only groups its page can show
+
+    Return:
+        Set of Item Group ids, empty if the List has no Route
+    """
+    route_groups = RouteGroup.__table__
+    lists = List.__table__
+    query = select([route_groups.c.item_group_id])\
+        .select_from(route_groups.join(lists, lists.c.route_id == route_groups.c.route_id))\
+        .where(lists.c.id == int(list_id))
+    return set(row[0] for row in db_session.execute(query) if row[0] is not None)
+
+
+def request_user_id():
+    """ Current User id within a request, else None """
+    if has_request_context():
+        return current_user_id()
+    return None
+
+
+def learn_on_commit(items):
+    """ Queue List Item values inserted without a flush (ListItem.insert_many) for the indexes
+
+    Learned when the transaction commits, discarded on rollback
+    """
+    session().info.setdefault("classified_items", []).extend(
+        (item["item_name"], int(item["item_group_id"])) for item in items if item.get("item_group_id"))
+
+
+def _named_from_placeholder(instance):
+    """ Test whether List Item is first named in this flush, from the "New Item" placeholder
+
+    Its Item Group must not have been changed in this flush (cleared on purpose)
+    """
+    attrs = inspect(instance).attrs
+    return "New Item" in attrs.item_name.history.deleted and not attrs.item_group_id.history.has_changes()
+
+
+@event.listens_for(Session, "before_flush")
+def assign_item_groups(db_session, flush_context, instances):
+    """ Classify new List Items saved without an Item Group
+
+    Includes items added as "New Item" and named in a later save.
+        Existing items are never reclassified, so a cleared Item Group stays empty.
+    """
+    user_id = request_user_id()
+    list_groups = {}
+    for instance in list(db_session.new) + list(db_session.dirty):
+        if not isinstance(instance, ListItem) or instance.item_group_id or instance.list_id is None \
+                or not instance.item_name or instance.item_name == "New Item":
+            continue
+        if instance in db_session.new or _named_from_placeholder(instance):
+            list_id = int(instance.list_id)
+            if list_id not in list_groups:
+                list_groups[list_id] = route_item_group_ids(db_session, list_id)
+            instance.item_group_id = classifier.classify(instance.item_name, user_id, list_groups[list_id])
+
+
+@event.listens_for(Session, "after_flush")
+def record_item_groups(db_session, flush_context):
+    """ Collect new or reclassified List Item names and Item Groups for the indexes """
+    for instance in list(db_session.new) + list(db_session.dirty):
+        if not isinstance(instance, ListItem) or not instance.item_group_id or not instance.item_name:
+            continue
+        attrs = inspect(instance).attrs
+        if instance in db_session.new or attrs.item_name.history.has_changes() \
+                or attrs.item_group_id.history.has_changes():
+            db_session.info.setdefault("classified_items", []).append(
+                (instance.item_name, int(instance.item_group_id)))
+
+
+@event.listens_for(Session, "after_commit")
+def learn_item_groups(db_session):
+    """ Add committed List Items to the indexes """
+    items = db_session.info.pop("classified_items", ())
+    if items:
+        user_id = request_user_id()
+        for name, item_group_id in items:
+            classifier.learn(name, item_group_id, user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_item_groups(db_session):
+    """ Discard List Items from rolled back transaction """
+    db_session.info.pop("classified_items", None)
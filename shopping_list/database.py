@@ -1,16 +1,34 @@
 """ Database Connection using SQLAlchemy """
 
-from sqlalchemy import create_engine
+import time
+
+from flask import _app_ctx_stack
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 from . import app
+from .metrics import registry
 
 
 class Base(object):
     """ Extend SQLAlchemy Base object """
 
-    def as_dict_base(self, excluded_columns=[]):
+    @classmethod
+    def column_names(cls):
+        """ Retrieve precomputed tuple of table column names for model
+
+        Return:
+            Tuple of column names
+        """
+        names = cls.__dict__.get("_column_names")
+        if names is None:
+            names = tuple(column.name for column in cls.__table__.columns)
+            cls._column_names = names
+        return names
+
+    def as_dict_base(self, excluded_columns=()):
         """ Convert model data into dictionary
 
         Args:
@@ -19,18 +37,77 @@ class Base(object):
         Return:
             SQLAlchemy model as dictionary
         """
-        data_dict = {}
-        for column in self.__table__.columns:
-            if column.name not in excluded_columns:
-                data_dict.update({column.name: getattr(self, column.name)})
+        return {name: getattr(self, name) for name in self.column_names()
+                if name not in excluded_columns}
 
-        return data_dict
 
-        # TODO: Try self.__mapper__.columns to retrieve all related columns
+class TimedQueuePool(QueuePool):
+    """ Queue pool recording connection checkout wait time """
 
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            registry.observe("db_pool_checkout_wait_seconds", time.perf_counter() - start)
 
-# Database URI from config.py
-engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+
+# Database URI and connection pool settings from config.py
+engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"],
+                       poolclass=TimedQueuePool,
+                       pool_size=app.config["SQLALCHEMY_POOL_SIZE"],
+                       max_overflow=app.config["SQLALCHEMY_MAX_OVERFLOW"],
+                       pool_timeout=app.config["SQLALCHEMY_POOL_TIMEOUT"],
+                       pool_recycle=app.config["SQLALCHEMY_POOL_RECYCLE"])
 Base = declarative_base(cls=Base)
 Session = sessionmaker(bind=engine)
-session = Session()
\ No newline at end of file
+# Session registry scoped to the current thread/greenlet
+session = scoped_session(Session, scopefunc=_app_ctx_stack.__ident_func__)
+
+
+@event.listens_for(engine.pool, "checkout")
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """ Test pooled connection on checkout (pre-ping)
+
+    Stale connections raise DisconnectionError, so the pool
+        discards them and retries with a fresh connection
+    """
+    if not app.config["SQLALCHEMY_POOL_PRE_PING"]:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+    except Exception:
+        raise exc.DisconnectionError()
+    cursor.close()
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    """ Close request session and return its connection to the pool """
+    session.remove()
+
+
+def pool_status():
+    """ Report connection pool statistics
+
+    Return:
+        Dictionary of pool size, checked in/out connections and overflow
+    """
+    pool = engine.pool
+    return {"size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow()}
+
+
+@registry.collector
+def pool_gauges():
+    """ Connection pool statistics as metrics gauges """
+    return [("db_pool_{}".format(name), {}, value) for name, value in sorted(pool_status().items())]
+
+
+registry.describe("db_pool_size", "gauge", "Connection pool size")
+registry.describe("db_pool_checked_in", "gauge", "Idle pooled connections")
+registry.describe("db_pool_checked_out", "gauge", "Connections in use")
+registry.describe("db_pool_overflow", "gauge", "Overflow connections beyond pool size")
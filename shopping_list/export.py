@@ -0,0 +1,100 @@
+""" List History Export
+
+Stream all of a User's Lists and List Items as CSV or JSON Lines.
+    Rows are read with a server-side cursor in fixed size batches and written
+    as they are read, so memory does not grow with the history size.
+    List Items are in the Route order of the printable List.
+"""
+
+import io
+import csv
+import json
+import datetime
+from decimal import Decimal
+
+from sqlalchemy import select, and_
+
+from .database import engine
+from .models import Store, List, ListItem, ItemGroup, ItemMeasurements, RouteGroup
+
+
+# Rows per server-side cursor fetch
+BATCH_SIZE = 1000
+
+COLUMNS = ("list_id", "shop_date", "list_name", "store_name", "list_item_id", "item_name",
+           "item_notes", "item_quantity", "item_measurement", "item_group")
+
+
+def export_query(user_id):
+    """ User's List Items with List, Store, Item Measurement and Item Group names
+
+    Ordered by shop date, List and Route order
+    """
+    lists = List.__table__
+    stores = Store.__table__
+    items = ListItem.__table__
+    measurements = ItemMeasurements.__table__
+    groups = ItemGroup.__table__
+    route_groups = RouteGroup.__table__
+
+    return select([lists.c.id, lists.c.shop_date, lists.c.name, stores.c.name,
+                   items.c.id, items.c.item_name, items.c.item_notes, items.c.item_quantity,
+                   measurements.c.name, groups.c.name])\
+        .select_from(lists
+                     .join(stores, stores.c.id == lists.c.store_id)
+                     .join(items, items.c.list_id == lists.c.id)
+                     .outerjoin(measurements, measurements.c.id == items.c.item_measurement_id)
+                     .outerjoin(groups, groups.c.id == items.c.item_group_id)
+                     .outerjoin(route_groups, and_(route_groups.c.route_id == lists.c.route_id,
+                                                   route_groups.c.item_group_id == items.c.item_group_id)))\
+        .where(lists.c.user_id == user_id)\
+        .order_by(lists.c.shop_date, lists.c.id, route_groups.c.route_order, items.c.id)
+
+
+def stream_rows(user_id):
+    """ Batches of export rows from a server-side cursor """
+    connection = engine.connect().execution_options(stream_results=True)
+    try:
+        result = connection.execute(export_query(user_id))
+        while True:
+            rows = result.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        connection.close()
+
+
+def _json_value(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def csv_lines(user_id):
+    """ Generator of CSV text, header first, one chunk per batch """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for rows in stream_rows(user_id):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def jsonl_lines(user_id):
+    """ Generator of JSON Lines text, one chunk per batch """
+    for rows in stream_rows(user_id):
+        yield "".join(json.dumps(dict(zip(COLUMNS, map(_json_value, row))), separators=(",", ":")) + "\n"
+                      for row in rows)
+
+
+# Generator and mimetype by export format
+FORMATS = {
+    "csv": (csv_lines, "text/csv"),
+    "jsonl": (jsonl_lines, "application/x-ndjson"),
+}
@@ -0,0 +1,186 @@
+""" SQL Instrumentation
+
+Per request statement count, database time and repeated statement fingerprints (N+1),
+    from engine cursor execute events. Reported as response headers in development
+    and structured log records in production. Strict mode raises when a view
+    exceeds its query budget, so tests fail on query count regressions.
+"""
+
+import re
+import json
+import time
+import logging
+import threading
+from functools import wraps
+from collections import Counter
+
+from flask import g, request, has_app_context
+from sqlalchemy import event
+
+from . import app
+from .database import engine
+
+
+# Handlers and level are set by the server configuration (gunicorn_config.py)
+logger = logging.getLogger("shopping_list.sql")
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|\?")
+_in_lists = re.compile(r"\bIN \((?:\?(?:, )?)+\)", re.IGNORECASE)
+_whitespace = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """ View issued more statements than its query budget (strict mode) """
+
+
+def fingerprint(statement):
+    """ Normalize statement text so executions differing only in parameters match
+
+    Example:
+        "SELECT ... WHERE id = %(param_1)s" -> "SELECT ... WHERE id = ?"
+    """
+    statement = _whitespace.sub(" ", statement).strip()
+    statement = _literals.sub("?", statement)
+    return _in_lists.sub("IN (?)", statement)
+
+
+class QueryStats(object):
+    """ Statements executed in one request or collection block
+
+    Attributes:
+        count (int): Statements executed
+        duration (float): Total database time in seconds
+        fingerprints (Counter): Executions per statement fingerprint
+        budget (int): Query budget of the view, or None
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.budget = None
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        """ Fingerprints executed at least threshold times, most repeated first """
+        return [(statement, count) for statement, count in self.fingerprints.most_common()
+                if count >= threshold]
+
+    def as_dict(self, threshold):
+        return {"queries": self.count,
+                "db_ms": round(self.duration * 1000, 3),
+                "budget": self.budget,
+                "repeated": [{"statement": statement, "count": count}
+                             for statement, count in self.repeated(threshold)]}
+
+
+_local = threading.local()
+
+
+def current_stats():
+    """ QueryStats of the current request, or None outside a request """
+    if has_app_context():
+        return getattr(g, "query_stats", None)
+    return None
+
+
+class collect(object):
+    """ Collect QueryStats for all statements executed in this thread within the block
+
+    Example:
+        with collect() as stats:
+            client.get(url)
+        stats.count
+    """
+
+    def __enter__(self):
+        self.stats = QueryStats()
+        if not hasattr(_local, "collectors"):
+            _local.collectors = []
+        _local.collectors.append(self.stats)
+        return self.stats
+
+    def __exit__(self, *exc):
+        _local.collectors.remove(self.stats)
+
+
+def query_budget(max_queries):
+    """ Set maximum statements for a view
+
+    Exceeding the budget logs a warning, or raises QueryBudgetExceeded in strict mode
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = current_stats()
+            if stats is not None:
+                stats.budget = max_queries
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "handle_error")
+def discard_query_timer(context):
+    """ Drop start time of a failed statement, which has no after_cursor_execute """
+    if context.connection is not None and context.cursor is not None:
+        start_times = context.connection.info.get("query_start_time")
+        if start_times:
+            start_times.pop()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    """ Record statement against current request and active collectors """
+    duration = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, duration)
+    for collector in getattr(_local, "collectors", ()):
+        collector.record(statement, duration)
+
+
+@app.before_request
+def start_query_stats():
+    if app.config["SQL_INSTRUMENTATION"]:
+        g.query_stats = QueryStats()
+
+
+@app.after_request
+def report_query_stats(response):
+    """ Add query stats headers (development) or log a structured record (production) """
+    stats = current_stats()
+    if stats is None:
+        return response
+    threshold = app.config["QUERY_REPEAT_THRESHOLD"]
+    repeated = stats.repeated(threshold)
+
+    if app.config["SQL_STATS_HEADERS"]:
+        response.headers["X-Query-Count"] = str(stats.count)
+        response.headers["X-Query-Time-Ms"] = "{:.3f}".format(stats.duration * 1000)
+        response.headers["X-Query-Repeated"] = str(sum(count for _, count in repeated))
+    else:
+        record = stats.as_dict(threshold)
+        record.update(method=request.method, endpoint=request.endpoint, status=response.status_code)
+        logger.info(json.dumps(record, sort_keys=True))
+
+    if repeated:
+        logger.warning("Repeated statements in %s (possible N+1): %s", request.endpoint,
+                       "; ".join("{} x{}".format(statement, count) for statement, count in repeated))
+
+    if stats.budget is not None and stats.count > stats.budget:
+        message = "{} issued {} queries, budget {}".format(request.endpoint, stats.count, stats.budget)
+        if app.config["QUERY_BUDGET_STRICT"]:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    return response
@@ -0,0 +1,209 @@
+""" Streaming Bulk Loader
+
+Load JSON Lines or CSV records into a model's table in bounded chunks,
+    so memory use does not grow with the input size.
+    PostgreSQL chunks are loaded with COPY FROM STDIN, other databases with executemany.
+
+Each chunk is committed on its own and recorded in a checkpoint file next to the input.
+    A failed load resumes after the last committed chunk when run again.
+"""
+
+import io
+import os
+import csv
+import json
+import time
+import itertools
+
+from sqlalchemy import func, select
+
+from . import models
+from .database import engine
+from .utils import column_map
+
+
+def read_records(path, input_format=None):
+    """ Stream records from a JSON Lines or CSV file
+
+    Arguments:
+        path (str): Input file path
+        input_format (str): "jsonl" or "csv", default from file extension
+
+    Return:
+        Generator of dictionaries of column name: value
+    """
+    input_format = input_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="") as input_file:
+        if input_format == "csv":
+            for record in csv.DictReader(input_file):
+                yield record
+        else:
+            for line in input_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(records, size):
+    """ Group records into lists of at most size """
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy_field(value):
+    """ Format value as a COPY csv field, None as NULL """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    return '"{}"'.format(str(value).replace('"', '""'))
+
+
+class Checkpoint(object):
+    """ Count of committed input records, stored next to the input file """
+
+    def __init__(self, input_path, model_name):
+        self.path = "{}.{}.checkpoint".format(input_path, model_name)
+
+    def read(self):
+        try:
+            with open(self.path) as checkpoint_file:
+                return json.load(checkpoint_file)["records"]
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def write(self, records):
+        temp_path = "{}.tmp".format(self.path)
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump({"records": records}, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkLoader(object):
+    """ Chunked loader for one model
+
+    Attributes:
+        model (class): SQLAlchemy model class
+        chunk_size (int): Records per transaction
+        progress (function): Called with loaded record count and records per second
+    """
+
+    def __init__(self, model, chunk_size=5000, progress=None):
+        self.model = model
+        self.table = model.__table__
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.coercers = column_map(model)
+        # Python side column defaults, which COPY does not apply
+        self.defaults = {column.name: column.default for column in self.table.columns
+                         if column.default is not None and (column.default.is_scalar or column.default.is_callable)}
+
+    def prepare(self, chunk):
+        """ Coerce input values and fill column defaults
+
+        Raise:
+            KeyError: Input field is not a column of the table
+        """
+        rows = []
+        for record in chunk:
+            row = {}
+            for name, value in record.items():
+                if name not in self.coercers:
+                    raise KeyError("{} has no column {}".format(self.table.name, name))
+                row[name] = self.coercers[name](value)
+            for name, default in self.defaults.items():
+                if name not in row:
+                    row[name] = default.arg if default.is_scalar else default.arg(None)
+            rows.append(row)
+        return rows
+
+    def copy(self, connection, columns, rows):
+        """ Load rows with COPY FROM STDIN (PostgreSQL) """
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(",".join(_copy_field(row.get(name)) for name in columns))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert('COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                self.table.name, ", ".join('"{}"'.format(name) for name in columns)), buffer)
+        finally:
+            cursor.close()
+
+    def load_chunk(self, rows):
+        """ Insert rows in one transaction, missing fields as null
+
+        List Items bump the version of their Lists in the same transaction
+        """
+        columns = sorted(set().union(*rows))
+        with engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                self.copy(connection, columns, rows)
+            else:
+                connection.execute(self.table.insert(), [{name: row.get(name) for name in columns}
+                                                         for row in rows])
+            if self.model is models.ListItem:
+                # Cached pages and autocomplete indexes follow the List version
+                models.bump_version(models.List, models.List.id.in_(set(row["list_id"] for row in rows)),
+                                    connection=connection)
+
+    def load(self, records, skip=0, checkpoint=None):
+        """ Load records in chunks, committing each
+
+        Arguments:
+            records (iterable): Record dictionaries
+            skip (int): Leading records already loaded
+            checkpoint (Checkpoint): Records committed count, updated per chunk
+
+        Return:
+            Number of records loaded
+        """
+        start = time.time()
+        loaded = 0
+        explicit_ids = False
+        for chunk in chunked(itertools.islice(records, skip, None), self.chunk_size):
+            rows = self.prepare(chunk)
+            explicit_ids = explicit_ids or "id" in rows[0]
+            self.load_chunk(rows)
+            loaded += len(rows)
+            if checkpoint is not None:
+                checkpoint.write(skip + loaded)
+            if self.progress:
+                self.progress(skip + loaded, loaded / max(time.time() - start, 1e-6))
+
+        if explicit_ids:
+            self.reset_sequence()
+        return loaded
+
+    def reset_sequence(self):
+        """ Move id sequence past loaded ids (PostgreSQL) """
+        with engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                max_id = connection.execute(select([func.max(self.table.c.id)])).scalar() or 0
+                connection.execute(select([func.setval(func.pg_get_serial_sequence(self.table.name, "id"),
+                                                       max(max_id, 1))]))
+
+
+def load_file(model_name, path, input_format=None, chunk_size=5000, resume=True, progress=None):
+    """ Stream file into model's table, resuming from its checkpoint
+
+    Return:
+        Tuple of records loaded in this run and records skipped from a previous run
+    """
+    model = getattr(models, model_name)
+    checkpoint = Checkpoint(path, model_name)
+    skip = checkpoint.read() if resume else 0
+    loader = BulkLoader(model, chunk_size, progress)
+    loaded = loader.load(read_records(path, input_format), skip=skip, checkpoint=checkpoint)
+    checkpoint.clear()
+    return loaded, skip
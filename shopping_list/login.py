@@ -1,6 +1,10 @@
 """ User Session Management: Flask-Login """
 
-from flask.ext.login import LoginManager
+import time
+import threading
+
+from flask import g
+from flask.ext.login import LoginManager, UserMixin, current_user
 
 from . import app
 from .models import User
@@ -16,12 +20,87 @@ login_manager.login_message = "Sorry about that, but you'll need to login to acc
 login_manager.login_message_category = "info"
 
 
+class UserIdentity(UserMixin):
+    """ Lightweight, detached User for current_user
+
+    Attributes:
+        id (int): User id
+        name (str): User name
+        email (str): User email address
+    """
+
+    def __init__(self, id, name, email):
+        self.id = id
+        self.name = name
+        self.email = email
+
+
+class IdentityCache(object):
+    """ Per worker User identities, expiring after ttl seconds
+
+    Attributes:
+        ttl (int): Seconds an identity is reused without a query
+        max_entries (int): Identities kept, expired entries dropped first
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """ Cached identity, or None if missing or expired """
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def set(self, identity):
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                for user_id, (expires, _) in list(self._entries.items()):
+                    if expires < now:
+                        del self._entries[user_id]
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[identity.id] = (now + self.ttl, identity)
+
+    def invalidate(self, user_id):
+        """ Drop identity after User changes """
+        with self._lock:
+            self._entries.pop(int(user_id), None)
+
+
+identities = IdentityCache(app.config["USER_CACHE_TTL"], app.config["USER_CACHE_MAX_ENTRIES"])
+
+
 @login_manager.user_loader
 def load_user(userid):
     """ Re/load user from session
 
+    Identity is read from the per worker cache, or queried and cached,
+        once per request and kept in flask.g
+
     Returns:
-        User exists: User object
+        User exists: UserIdentity object
         User no exists: None
     """
-    return session.query(User).get(int(userid))
\ No newline at end of file
+    user_id = int(userid)
+    identity = identities.get(user_id)
+    if identity is None:
+        row = session.query(User.id, User.name, User.email).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        identity = UserIdentity(*row)
+        identities.set(identity)
+    g.user_identity = identity
+    return identity
+
+
+def current_user_id():
+    """ Current User id (int), or None for anonymous users """
+    if current_user.is_anonymous():
+        return None
+    return int(current_user.id)
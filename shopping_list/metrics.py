@@ -0,0 +1,259 @@
+""" Application Metrics
+
+In-process registry of counters, histograms and gauges with a /metrics endpoint
+    in the Prometheus text exposition format.
+    Records request latency, status counts and response bytes per endpoint.
+    Other modules add observations (pool checkout wait) and gauge collectors (pool, caches).
+
+With METRICS_DIR set, each worker process writes its snapshot to its own file in the
+    directory and /metrics merges the files of all workers: counters and histograms
+    are summed, gauges are summed over live workers only.
+"""
+
+import os
+import hmac
+import json
+import time
+import bisect
+import threading
+
+from flask import g, request, Response, abort
+
+from . import app
+
+
+# Latency buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry(object):
+    """ Thread safe metric values keyed by metric name and labels
+
+    Attributes:
+        descriptions (dict): Metric name: (type, help text)
+    """
+
+    def __init__(self):
+        self.descriptions = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, metric_type, help_text):
+        self.descriptions[name] = (metric_type, help_text)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ Add value to histogram buckets, sum and count """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def reset(self):
+        """ Clear counters and histograms, e.g. in a worker forked from a preloaded master """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def collector(self, func):
+        """ Register function returning gauges at collection time
+
+        The function returns a list of (name, labels dict, value)
+        """
+        self._collectors.append(func)
+        return func
+
+    def snapshot(self):
+        """ Current values of this process, JSON serializable """
+        gauges = []
+        for func in self._collectors:
+            gauges.extend([name, sorted(labels.items()), value] for name, labels, value in func())
+        with self._lock:
+            return {"pid": os.getpid(),
+                    "counters": [[name, list(labels), value]
+                                 for (name, labels), value in self._counters.items()],
+                    "histograms": [[name, list(labels), list(buckets), total, count]
+                                   for (name, labels), (buckets, total, count) in self._histograms.items()],
+                    "gauges": gauges}
+
+
+registry = Registry()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileStore(object):
+    """ Per worker snapshot files in a shared directory
+
+    Attributes:
+        directory (str): Directory shared by all workers
+        interval (float): Minimum seconds between snapshot writes
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, force=False):
+        """ Write this worker's snapshot, at most once per interval unless forced """
+        now = time.time()
+        if not force and now - self._written < self.interval:
+            return
+        self._written = now
+        snapshot = registry.snapshot()
+        path = os.path.join(self.directory, "metrics-{}.json".format(snapshot["pid"]))
+        temp_path = "{}.tmp".format(path)
+        with open(temp_path, "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(temp_path, path)
+
+    def read(self):
+        """ Snapshots of all workers, including exited workers """
+        snapshots = []
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith("metrics-") and file_name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, file_name)) as snapshot_file:
+                        snapshots.append(json.load(snapshot_file))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+
+store = FileStore(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"]) \
+    if app.config["METRICS_DIR"] else None
+
+
+def merge(snapshots):
+    """ Sum counters and histograms of all snapshots, gauges of live processes """
+    counters, histograms, gauges = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+        if snapshot["pid"] == os.getpid() or _pid_alive(snapshot["pid"]):
+            for name, labels, value in snapshot["gauges"]:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+    return counters, histograms, gauges
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for key, value in pairs) + "}"
+
+
+def exposition(snapshots):
+    """ Render merged snapshots in the Prometheus text format """
+    counters, histograms, gauges = merge(snapshots)
+    samples = {}
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, []).append("{}{} {}".format(name, _labels(labels), value))
+    for (name, labels), value in gauges.items():
+        samples.setdefault(name, []).append("{}{} {}".format(name, _labels(labels), value))
+    for (name, labels), (buckets, total, count) in histograms.items():
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket in zip(list(BUCKETS) + ["+Inf"], buckets):
+            cumulative += bucket
+            lines.append("{}_bucket{} {}".format(name, _labels(labels, le=bound), cumulative))
+        lines.append("{}_sum{} {}".format(name, _labels(labels), total))
+        lines.append("{}_count{} {}".format(name, _labels(labels), count))
+
+    output = []
+    for name in sorted(samples):
+        metric_type, help_text = registry.descriptions.get(name, ("untyped", ""))
+        output.append("# HELP {} {}".format(name, help_text))
+        output.append("# TYPE {} {}".format(name, metric_type))
+        output.extend(sorted(samples[name]))
+    return "\n".join(output) + "\n"
+
+
+registry.describe("http_request_duration_seconds", "histogram", "Request latency by endpoint")
+registry.describe("http_requests_total", "counter", "Requests by endpoint and status code")
+registry.describe("http_response_bytes_total", "counter", "Response body bytes by endpoint")
+registry.describe("db_pool_checkout_wait_seconds", "histogram", "Time waiting for a pooled connection")
+
+
+@app.before_request
+def start_request_timer():
+    g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """ Record latency, status and response bytes for the request endpoint """
+    start = getattr(g, "metrics_start", None)
+    if start is None:
+        return response
+    endpoint = request.endpoint or "unmatched"
+    registry.observe("http_request_duration_seconds", time.perf_counter() - start, endpoint=endpoint)
+    registry.increment("http_requests_total", endpoint=endpoint, status=response.status_code)
+    length = response.calculate_content_length()
+    if length:
+        registry.increment("http_response_bytes_total", length, endpoint=endpoint)
+    g.metrics_start = None
+    if store is not None:
+        store.write()
+    return response
+
+
+@app.teardown_request
+def record_failed_request(exception=None):
+    """ Record requests ended by an unhandled exception as status 500 """
+    start = getattr(g, "metrics_start", None)
+    if exception is not None and start is not None:
+        endpoint = request.endpoint or "unmatched"
+        registry.observe("http_request_duration_seconds", time.perf_counter() - start, endpoint=endpoint)
+        registry.increment("http_requests_total", endpoint=endpoint, status=500)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """ Metrics of all workers in the Prometheus text format
+
+    Requires Authorization: Bearer METRICS_TOKEN when a token is configured.
+        Not served without a token when METRICS_TOKEN_REQUIRED (production).
+    """
+    token = app.config["METRICS_TOKEN"]
+    if not token and app.config["METRICS_TOKEN_REQUIRED"]:
+        abort(404)
+    if token and not hmac.compare_digest(request.headers.get("Authorization", "").encode("utf-8"),
+                                         "Bearer {}".format(token).encode("utf-8")):
+        abort(403)
+
+    if store is not None:
+        store.write(force=True)
+        snapshots = store.read()
+    else:
+        snapshots = [registry.snapshot()]
+    return Response(exposition(snapshots), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,155 @@
+""" Schema Migrations
+
+Ordered schema changes recorded in the schema_version table and applied by
+    manage.py migrate. Workers never create or reflect tables at import,
+    at most they compare the recorded version with the latest (SCHEMA_CHECK).
+
+New database: all tables are created from the models and stamped with the latest version.
+Existing database without schema_version: assumed at version 1 (original tables).
+    Databases created from the models before migrations existed may already have
+    later columns and indexes, so migrations skip objects that exist.
+"""
+
+import datetime
+
+from sqlalchemy import Table, Column, Integer, String, DateTime, select, func, inspect, text
+
+from . import app
+from .database import Base, engine
+from .models import ListChange, list_sidebar_index, reference_version_table, seed_reference_versions
+
+
+schema_version_table = Table("schema_version", Base.metadata,
+                             Column("version", Integer, primary_key=True),
+                             Column("name", String(100), nullable=False),
+                             Column("applied_at", DateTime, default=datetime.datetime.utcnow))
+
+# Ordered (version, name, function(connection))
+MIGRATIONS = []
+
+# Serializes concurrent migrate commands on PostgreSQL
+MIGRATION_LOCK_ID = 721504
+
+
+def has_column(connection, table_name, column_name):
+    """ Test whether table has column """
+    return column_name in [column["name"] for column in inspect(connection).get_columns(table_name)]
+
+
+def has_index(connection, table_name, index_name):
+    """ Test whether index exists, including expression indexes (not reflected) """
+    if connection.dialect.name == "postgresql":
+        return connection.execute(text("SELECT 1 FROM pg_class WHERE relname = :name AND relkind = 'i'"),
+                                  name=index_name).first() is not None
+    return index_name in [index["name"] for index in inspect(connection).get_indexes(table_name)]
+
+
+def migration(version, name):
+    """ Register function as schema migration version """
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return decorator
+
+
+@migration(1, "Original tables")
+def original_tables(connection):
+    Base.metadata.create_all(connection)
+
+
+@migration(2, "Version and updated_at columns on List, Route and User Store")
+def version_columns(connection):
+    for table_name in ["list", "route", "user_store"]:
+        if not has_column(connection, table_name, "version"):
+            connection.execute("ALTER TABLE {} ADD COLUMN version INTEGER NOT NULL DEFAULT 1".format(table_name))
+        if not has_column(connection, table_name, "updated_at"):
+            connection.execute("ALTER TABLE {} ADD COLUMN updated_at TIMESTAMP WITHOUT TIME ZONE".format(table_name))
+
+
+@migration(3, "List change log")
+def list_change_table(connection):
+    ListChange.__table__.create(connection, checkfirst=True)
+
+
+@migration(4, "List Item name prefix index")
+def item_name_prefix_index(connection):
+    if connection.dialect.name == "postgresql" and not has_index(connection, "list_item",
+                                                                 "ix_list_item_item_name_prefix"):
+        connection.execute("CREATE INDEX ix_list_item_item_name_prefix "
+                           "ON list_item (lower(item_name) text_pattern_ops)")
+
+
+@migration(5, "Lists sidebar keyset index")
+def list_sidebar_keyset_index(connection):
+    if not has_index(connection, "list", list_sidebar_index.name):
+        list_sidebar_index.create(connection)
+
+
+@migration(6, "Reference table versions")
+def reference_versions(connection):
+    reference_version_table.create(connection, checkfirst=True)
+
+
+@migration(7, "Seed reference table versions")
+def reference_version_rows(connection):
+    seed_reference_versions(connection)
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def current_version(connection):
+    """ Recorded schema version, None if no schema_version table """
+    if not engine.dialect.has_table(connection, "schema_version"):
+        return None
+    return connection.execute(select([func.max(schema_version_table.c.version)])).scalar() or 0
+
+
+def stamp(connection, version):
+    """ Record all migrations up to version as applied """
+    recorded = set(row[0] for row in connection.execute(select([schema_version_table.c.version])))
+    rows = [{"version": number, "name": name, "applied_at": datetime.datetime.utcnow()}
+            for number, name, _ in MIGRATIONS if number <= version and number not in recorded]
+    if rows:
+        connection.execute(schema_version_table.insert(), rows)
+
+
+def upgrade():
+    """ Apply pending migrations in one transaction
+
+    Return:
+        List of applied (version, name)
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(select([func.pg_advisory_xact_lock(MIGRATION_LOCK_ID)]))
+
+        version = current_version(connection)
+        if version is None:
+            new_database = not engine.dialect.has_table(connection, "user")
+            schema_version_table.create(connection)
+            if new_database:
+                Base.metadata.create_all(connection)
+                stamp(connection, latest_version())
+                return [(number, name) for number, name, _ in MIGRATIONS]
+            stamp(connection, 1)
+            version = 1
+
+        applied = []
+        for number, name, apply_migration in MIGRATIONS:
+            if number > version:
+                apply_migration(connection)
+                stamp(connection, number)
+                applied.append((number, name))
+        return applied
+
+
+def check_schema():
+    """ Warn when the database schema is behind the application """
+    with engine.connect() as connection:
+        version = current_version(connection)
+    if version is None or version < latest_version():
+        app.logger.warning("Database schema version %s, application expects %s. Run manage.py migrate.",
+                           version, latest_version())
@@ -2,12 +2,18 @@
 
 import datetime
 
-from sqlalchemy import Table, Column, Integer, String, Boolean, Date, Numeric, ForeignKey
+from sqlalchemy import Table, Column, Index, Integer, String, Boolean, Date, DateTime, Numeric, ForeignKey
+from sqlalchemy import select, func, case, literal, tuple_, and_, exists, event, DDL
 from sqlalchemy.orm import relationship
 
 from flask.ext.login import UserMixin
 
-from .database import Base, engine, session
+from .database import Base, engine, session, Session
+
+
+# Spacing between Route Group route_order keys
+# Leaves room to insert or move a group by writing a single row
+ROUTE_ORDER_GAP = 10
 
 
 class User(Base, UserMixin):
@@ -71,6 +77,8 @@ class UserStore(Base):
         user_id (fk, primary key): User
         store_id (fk, primary key): Store
         nickname (str): User defined store name different from place name
+        version (int): Incremented when the User's Stores, Routes or Lists change
+        updated_at (datetime): Time of last version increment
     """
     __tablename__ = "user_store"
 
@@ -78,6 +86,8 @@ class UserStore(Base):
     store_id = Column(Integer, ForeignKey("store.id"), primary_key=True)
     nickname = Column(String(50), default="")
     default = Column(Boolean, default=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
 
 
 class Route(Base):
@@ -91,6 +101,8 @@ class Route(Base):
         default (bool): Default route for creating lists
         user_id (fk): User
         store_id (fk): Store
+        version (int): Incremented when Route or its Route Groups change
+        updated_at (datetime): Time of last version increment
 
     Examples:
         Full Shop - route used to shop in entire store
@@ -102,6 +114,8 @@ class Route(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(50), nullable=False)
     default = Column(Boolean, default=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     user_id = Column(Integer, ForeignKey("user.id"), index=True)
 
@@ -111,47 +125,95 @@ class Route(Base):
     item_group = relationship("RouteGroup", backref="route")
     list = relationship("List", backref="route")
 
-    def clone(self, new_name):
+    def clone(self, new_name, **kwargs):
         """ Clone Route and associated Route Groups
 
+        Route Groups are copied server side with INSERT ... SELECT
+            within the caller's transaction
+
+        Does not commit
+
+        Args:
+            new_name (str): New Route name
+            kwargs: Other attributes for new Route, e.g. user_id, store
+
         Return:
             New Route
         """
         # Create new Route
-        route = Route(name=new_name)
+        route = Route(name=new_name, **kwargs)
         session.add(route)
-        session.commit()
-
-        # Set Route Groups for current Route
-        route_groups = session.query(RouteGroup.item_group_id, RouteGroup.route_order)\
-            .filter(RouteGroup.route_id == self.id).all()
-        # Set values list of Route Groups for new Route
-        route_groups_list = []
-        for x in route_groups:
-            route_groups_list.append({"item_group_id": x[0], "route_order": x[1], "route_id": route.id})
-        # Insert values list into RouteGroup table
-        ins = RouteGroup.__table__.insert().values(route_groups_list)
-        engine.execute(ins)
+        session.flush()
+
+        # Copy Route Groups for current Route to new Route
+        table = RouteGroup.__table__
+        route_groups = select([literal(route.id), table.c.item_group_id, table.c.route_order])\
+            .where(table.c.route_id == self.id)
+        session.execute(table.insert().from_select(["route_id", "item_group_id", "route_order"],
+                                                   route_groups))
 
         return route
 
-    def renumber_route_order(self):
-        """ Renumber route order for Route Groups associated with Route
+    def add_route_group(self, item_group_id=None):
+        """ Append Route Group after last Route Group in one statement
+
+        Does not commit
+
+        Return:
+            Nothing
+        """
+        table = RouteGroup.__table__
+        next_order = select([func.coalesce(func.max(table.c.route_order), 0) + ROUTE_ORDER_GAP])\
+            .where(table.c.route_id == self.id).as_scalar()
+        session.execute(table.insert().values(route_id=self.id,
+                                              item_group_id=item_group_id,
+                                              route_order=next_order))
+        bump_version(Route, Route.id == self.id)
+
+    def set_route_order(self, route_group_ids):
+        """ Apply full Route Group order (e.g. drag and drop) in one statement
+
+        Route Groups not listed keep their current route order
+
+        Does not commit
+
+        Args:
+            route_group_ids (list[int]): Route Group ids in new order
 
         Return:
             Nothing
         """
-        # Set Route Groups using Route id
-        route_groups = session.query(RouteGroup).filter(RouteGroup.route_id == self.id)\
-            .order_by(RouteGroup.route_order)
+        if not route_group_ids:
+            return
+        table = RouteGroup.__table__
+        new_order = case([(table.c.id == route_group_id, (i + 1) * ROUTE_ORDER_GAP)
+                          for i, route_group_id in enumerate(route_group_ids)],
+                         else_=table.c.route_order)
+        session.execute(table.update()
+                        .where(table.c.route_id == self.id)
+                        .where(table.c.id.in_(route_group_ids))
+                        .values(route_order=new_order))
+        bump_version(Route, Route.id == self.id)
 
-        i = 1
-        # Loop through Groups in Route
-        for route_group in route_groups:
-            route_group.route_order = i
-            i += 1
+    def compact_route_order(self):
+        """ Respace route order for Route Groups associated with Route
 
-        return session.commit()
+        Set based update, keys become ROUTE_ORDER_GAP apart in current order
+
+        Does not commit
+
+        Return:
+            Nothing
+        """
+        table = RouteGroup.__table__
+        ranked = select([table.c.id.label("id"),
+                         (func.row_number().over(order_by=[table.c.route_order, table.c.id])
+                          * ROUTE_ORDER_GAP).label("route_order")])\
+            .where(table.c.route_id == self.id).alias("ranked")
+        session.execute(table.update()
+                        .where(table.c.id == ranked.c.id)
+                        .values(route_order=ranked.c.route_order))
+        bump_version(Route, Route.id == self.id)
 
 
 # Routes assigned to Stores
@@ -205,14 +267,15 @@ class RouteGroup(Base):
         route_id (fk, required): Route
         item_group_Id (fk, required): Item Group
         route_order (int, default=0): Sort order for Item Groups in Route
+            Sparse keys, ROUTE_ORDER_GAP apart after compaction
 
     Examples:
         Route: Full Shop
         Item Groups:
-            Vegetables - 1
-            Fruits - 2
-            International - 3
-            Meat - 4
+            Vegetables - 10
+            Fruits - 20
+            International - 30
+            Meat - 40
     """
     __tablename__ = "route_item_group"
 
@@ -230,6 +293,8 @@ class List(Base):
         name (str): List name
         user_id (fk): User
         route_id (fk): Route (with related Store)
+        version (int): Incremented when List or its List Items change
+        updated_at (datetime): Time of last version increment
 
     Example:
         2/17/05, Full Shop, Whole Foods Downtown
@@ -239,6 +304,8 @@ class List(Base):
     id = Column(Integer, primary_key=True)
     shop_date = Column(Date, nullable=False, default=datetime.date.today())
     name = Column(String(50), default="")
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     user_id = Column(Integer, ForeignKey("user.id"), index=True)
     store_id = Column(Integer, ForeignKey("store.id"), index=True)
@@ -262,6 +329,11 @@ class List(Base):
         return date_name
 
 
+# Lists sidebar keyset pagination: newest first per User and Store
+list_sidebar_index = Index("ix_list_user_store_shop_date",
+                           List.user_id, List.store_id, List.shop_date.desc(), List.id)
+
+
 class ItemMeasurements(Base):
     """ Predefined measurements
 
@@ -284,6 +356,33 @@ class ItemMeasurements(Base):
     list_item = relationship("ListItem", backref="item_measurement")
 
 
+# Versions of cached reference tables (cache.ReferenceCache), by table name
+# Bumped in the transaction that writes the table, so every worker sees the change
+reference_version_table = Table("reference_version", Base.metadata,
+                                Column("name", String(50), primary_key=True),
+                                Column("version", Integer, nullable=False, default=0))
+
+
+def seed_reference_versions(connection):
+    """ Insert missing reference_version rows, so version bumps only update
+
+    Does not commit
+
+    Args:
+        connection: Connection in the schema writing transaction
+    """
+    table = reference_version_table
+    names = set(model.__tablename__ for model in (ItemGroup, ItemMeasurements))
+    names -= set(row[0] for row in connection.execute(select([table.c.name])))
+    if names:
+        connection.execute(table.insert(), [{"name": name, "version": 0} for name in sorted(names)])
+
+
+# Seed with the table, e.g. create_all in manage.py resetdb
+event.listen(reference_version_table, "after_create",
+             lambda target, connection, **kw: seed_reference_versions(connection))
+
+
 class ListItem(Base):
     """ Items in List
 
@@ -314,3 +413,202 @@ class ListItem(Base):
     list_id = Column(Integer, ForeignKey("list.id"), nullable=False, index=True)
     item_measurement_id = Column(Integer, ForeignKey("item_measurement.id"))
     item_group_id = Column(Integer, ForeignKey("item_group.id"), index=True)
+
+    @staticmethod
+    def insert_many(list_id, items):
+        """ Insert List Items with one multi-row INSERT
+
+        Logs the inserts and bumps the List version in the same transaction
+
+        Does not commit
+
+        Args:
+            list_id (int): List
+            items (list[dict]): Column values for each List Item
+
+        Return:
+            List of new List Item ids
+        """
+        if not items:
+            return []
+        table = ListItem.__table__
+        rows = [dict(item, list_id=list_id) for item in items]
+        result = session.execute(table.insert().values(rows).returning(table.c.id))
+        ids = [row[0] for row in result]
+
+        # Lock the List row before taking change ids, as the flush path does
+        bump_version(List, List.id == list_id)
+        ListChange.log([{"list_id": list_id, "entity": "ListItem", "entity_id": i, "operation": "insert"}
+                        for i in ids])
+        return ids
+
+
+# Prefix index for item name autocomplete (LIKE 'prefix%' on lower(item_name))
+event.listen(ListItem.__table__, "after_create",
+             DDL("CREATE INDEX ix_list_item_item_name_prefix "
+                 "ON list_item (lower(item_name) text_pattern_ops)").execute_if(dialect="postgresql"))
+
+
+class ListChange(Base):
+    """ Append-only log of List and List Item changes for delta sync
+
+    Written in the same transaction as the change. Concurrent writers to a List
+        serialize on its version update, so cursors increase in commit order per List.
+
+    Attributes:
+        list_id (int, required): List changed (no foreign key, outlives deleted Lists)
+        entity (str, required): Changed model, List or ListItem
+        entity_id (int, required): Changed row id
+        operation (str, required): insert, update or delete
+        changed_at (datetime): Time of change
+
+    Example:
+        42, ListItem, 1001, update
+    """
+    __tablename__ = "list_change"
+    __table_args__ = (Index("ix_list_change_list_id_id", "list_id", "id"),)
+
+    id = Column(Integer, primary_key=True)
+    list_id = Column(Integer, nullable=False)
+    entity = Column(String(10), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String(6), nullable=False)
+    changed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    @staticmethod
+    def log(changes, connection=None):
+        """ Insert change rows in the current transaction
+
+        Used directly by set based writes that bypass the ORM flush
+
+        Does not commit
+
+        Args:
+            changes (list[dict]): list_id, entity, entity_id and operation values
+            connection: Connection or Session in the writing transaction, default the scoped session
+
+        Return:
+            Nothing
+        """
+        if not changes:
+            return
+        changed_at = datetime.datetime.utcnow()
+        for change in changes:
+            change.setdefault("changed_at", changed_at)
+        (connection or session).execute(ListChange.__table__.insert(), changes)
+
+    @staticmethod
+    def compact(retention_days=30):
+        """ Compact change log with set based deletes
+
+        Keeps only the latest change per row, which preserves the result for any cursor
+            (clients apply inserts and updates as upserts).
+            Drops all changes for Lists deleted more than retention_days ago.
+
+        Does not commit
+
+        Return:
+            Number of change rows deleted
+        """
+        table = ListChange.__table__
+        newer = table.alias("newer")
+        superseded = session.execute(table.delete().where(exists().where(and_(
+            newer.c.entity == table.c.entity,
+            newer.c.entity_id == table.c.entity_id,
+            newer.c.id > table.c.id))))
+
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+        live_lists = select([List.__table__.c.id])
+        recent = select([table.c.list_id]).where(table.c.changed_at >= cutoff)
+        deleted_lists = session.execute(table.delete().where(and_(
+            ~table.c.list_id.in_(live_lists),
+            ~table.c.list_id.in_(recent))))
+
+        return superseded.rowcount + deleted_lists.rowcount
+
+
+def bump_version(model, *criteria, connection=None):
+    """ Increment version and updated_at for model rows matching criteria
+
+    Used by set based writes that bypass the ORM flush
+
+    Does not commit
+
+    Args:
+        model (class): List, Route or UserStore
+        criteria: Filter expressions
+        connection: Connection or Session in the writing transaction, default the scoped session
+
+    Return:
+        Nothing
+    """
+    table = model.__table__
+    (connection or session).execute(table.update().where(and_(*criteria))
+                                    .values(version=table.c.version + 1, updated_at=datetime.datetime.utcnow()))
+
+
+@event.listens_for(Session, "before_flush")
+def bump_parent_versions(db_session, flush_context, instances):
+    """ Bump versions of Lists, Routes and UserStores whose pages change in this flush
+
+    List Items bump their List, Route Groups bump their Route,
+        and Lists, Routes and Stores bump the User's Stores (page sidebars)
+    """
+    list_ids, route_ids, user_ids, store_ids, user_stores = set(), set(), set(), set(), set()
+
+    changed = [(instance, True) for instance in list(db_session.new) + list(db_session.deleted)]
+    changed += [(instance, False) for instance in db_session.dirty if db_session.is_modified(instance)]
+
+    for instance, added_or_deleted in changed:
+        if isinstance(instance, ListItem):
+            list_ids.add(instance.list_id)
+        elif isinstance(instance, RouteGroup):
+            route_ids.add(instance.route_id)
+        elif isinstance(instance, List):
+            if not added_or_deleted:
+                list_ids.add(instance.id)
+            user_stores.add((instance.user_id, instance.store_id))
+        elif isinstance(instance, Route):
+            if not added_or_deleted:
+                route_ids.add(instance.id)
+            user_ids.add(instance.user_id)
+        elif isinstance(instance, Store):
+            store_ids.add(instance.id)
+        elif isinstance(instance, UserStore):
+            user_ids.add(instance.user_id)
+
+    # Drop unset keys, form values may be strings
+    list_ids, route_ids, user_ids, store_ids = [set(int(i) for i in ids if i is not None)
+                                                for ids in (list_ids, route_ids, user_ids, store_ids)]
+    user_stores = set((int(user_id), int(store_id)) for user_id, store_id in user_stores
+                      if user_id is not None and store_id is not None)
+
+    if list_ids:
+        bump_version(List, List.id.in_(list_ids), connection=db_session)
+    if route_ids:
+        bump_version(Route, Route.id.in_(route_ids), connection=db_session)
+    if user_ids:
+        bump_version(UserStore, UserStore.user_id.in_(user_ids), connection=db_session)
+    if store_ids:
+        bump_version(UserStore, UserStore.store_id.in_(store_ids), connection=db_session)
+    if user_stores:
+        bump_version(UserStore, tuple_(UserStore.user_id, UserStore.store_id).in_(user_stores),
+                     connection=db_session)
+
+
+@event.listens_for(Session, "after_flush")
+def log_list_changes(db_session, flush_context):
+    """ Log List and List Item inserts, updates and deletes written in this flush """
+    changes = []
+    for operation, instances in (("insert", db_session.new),
+                                 ("update", [instance for instance in db_session.dirty
+                                             if db_session.is_modified(instance)]),
+                                 ("delete", db_session.deleted)):
+        for instance in instances:
+            if isinstance(instance, List):
+                changes.append({"list_id": instance.id, "entity": "List",
+                                "entity_id": instance.id, "operation": operation})
+            elif isinstance(instance, ListItem):
+                changes.append({"list_id": int(instance.list_id), "entity": "ListItem",
+                                "entity_id": instance.id, "operation": operation})
+    ListChange.log(changes, connection=db_session)
@@ -0,0 +1,275 @@
+""" Page Data Builders
+
+Load everything a page template needs in a fixed number of queries
+    and hand plain data to the template, so rendering never lazy loads
+"""
+
+import datetime
+from collections import namedtuple
+
+from sqlalchemy import and_, or_, select, func
+from sqlalchemy.orm import joinedload
+
+from . import app
+from . import cache
+from .database import session
+from .models import UserStore, Store, Route, RouteGroup, ItemGroup, List, ListItem
+
+
+# Plain rows for template rendering
+ListItemRow = namedtuple("ListItemRow", ["id", "item_name", "item_notes", "item_quantity",
+                                         "item_measurement_id", "item_group_id"])
+RouteGroupRow = namedtuple("RouteGroupRow", ["id", "item_group_id", "item_group_name", "route_order"])
+PageVersion = namedtuple("PageVersion", ["tag", "last_modified"])
+ListsPage = namedtuple("ListsPage", ["lists", "next_cursor"])
+
+
+def _user_stores_version(*criteria):
+    """ Scalar subqueries for the version of User Store rows matching criteria
+
+    A sum of versions alone can repeat after a row is deleted, so the row count
+        and the last update time are part of the version
+
+    Return:
+        List of row count, version sum and last update time subqueries
+    """
+    criterion = and_(*criteria)
+    return [select([func.count(UserStore.user_id)]).where(criterion).as_scalar(),
+            select([func.coalesce(func.sum(UserStore.version), 0)]).where(criterion).as_scalar(),
+            select([func.max(UserStore.updated_at)]).where(criterion).as_scalar()]
+
+
+def _version_tag(prefix, values):
+    """ Join version values into a tag, datetimes at full precision """
+    return "-".join(str(value) if not isinstance(value, datetime.datetime) else value.isoformat()
+                    for value in [prefix] + list(values))
+
+
+def page_version(user_id, list_id=None, route_id=None):
+    """ Version of the data rendered on a List or Route page, in one query
+
+    Combines the List (with its Route) or Route version with the version
+        of the User's Stores (page sidebars) and the reference caches.
+        Item tables are not read.
+
+    Arguments:
+        user_id (int): Current User
+        list_id (int): List rendered on page
+        route_id (int): Route rendered on page (if no List)
+
+    Return:
+        PageVersion or None if List/Route not found
+    """
+    user_stores = _user_stores_version(UserStore.user_id == int(user_id))
+
+    if list_id:
+        row = session.query(List.version, Route.version, List.updated_at, Route.updated_at, *user_stores)\
+            .select_from(List).outerjoin(Route, List.route_id == Route.id)\
+            .filter(List.id == int(list_id), List.user_id == int(user_id)).first()
+    else:
+        row = session.query(Route.version, Route.updated_at, *user_stores)\
+            .filter(Route.id == int(route_id), Route.user_id == int(user_id)).first()
+    if row is None:
+        return None
+
+    updated = [value for value in row if isinstance(value, datetime.datetime)]
+    tag = _version_tag(user_id, [list_id, route_id, cache.item_groups.current_version(),
+                                  cache.item_measurements.current_version()]
+                       + list(row))
+
+    return PageVersion(tag, max(updated) if updated else None)
+
+
+def print_version(store_id, list_id):
+    """ Version of the data rendered on a printable List page, in one query
+
+    Printable Lists are shared (e.g. within a household), so the version
+        does not depend on the current User. Combines List, Route and Store versions
+        with the reference caches (Item Group and Item Measurement names are rendered).
+
+    Arguments:
+        store_id (int): Store rendered in page header
+        list_id (int): List rendered on page
+
+    Return:
+        PageVersion or None if List not found
+    """
+    user_stores = _user_stores_version(UserStore.store_id == int(store_id))
+
+    row = session.query(List.version, Route.version, List.updated_at, Route.updated_at, *user_stores)\
+        .select_from(List).outerjoin(Route, List.route_id == Route.id)\
+        .filter(List.id == int(list_id)).first()
+    if row is None:
+        return None
+
+    updated = [value for value in row if isinstance(value, datetime.datetime)]
+    tag = _version_tag("print", [store_id, list_id, cache.item_groups.current_version(),
+                                 cache.item_measurements.current_version()]
+                       + list(row))
+
+    return PageVersion(tag, max(updated) if updated else None)
+
+
+def encode_cursor(list):
+    """ Keyset cursor after List
+
+    Example:
+        "2015-02-26.42"
+    """
+    return "{}.{}".format(list.shop_date.isoformat(), list.id)
+
+
+def decode_cursor(cursor):
+    """ Shop date and id of keyset cursor
+
+    Raise:
+        ValueError: Malformed cursor
+    """
+    shop_date, list_id = cursor.split(".")
+    return datetime.datetime.strptime(shop_date, "%Y-%m-%d").date(), int(list_id)
+
+
+def load_lists_page(user_id, store_id, after=None, limit=None):
+    """ One page of a User's Lists for a Store, newest first
+
+    Keyset pagination on index ix_list_user_store_shop_date, so every page
+        costs the same however many Lists come before it
+
+    Arguments:
+        after (str): Cursor of the last List on the previous page
+        limit (int): Lists per page, default LIST_PAGE_SIZE
+
+    Return:
+        ListsPage of Lists and cursor of the next page (None on last page)
+    """
+    limit = limit or app.config["LIST_PAGE_SIZE"]
+    query = session.query(List).filter(List.user_id == user_id, List.store_id == store_id)
+    if after:
+        shop_date, list_id = decode_cursor(after)
+        query = query.filter(or_(List.shop_date < shop_date,
+                                 and_(List.shop_date == shop_date, List.id > list_id)))
+    lists = query.order_by(List.shop_date.desc(), List.id).limit(limit + 1).all()
+    if len(lists) > limit:
+        return ListsPage(lists[:limit], encode_cursor(lists[limit - 1]))
+    return ListsPage(lists, None)
+
+
+class ListPageData(object):
+    """ Data for the Lists page (lists.html)
+
+    Queries: User Stores (with Stores), List (if requested), Routes, Lists,
+        Route Groups (with Item Group names) and List Items.
+        Item Measurements are read from the reference cache.
+
+    Attributes:
+        user_id (int): Current User
+        store_id (int): Requested Store
+        list_id (int): Requested List
+        new (bool): New List requested
+    """
+
+    def __init__(self, user_id, store_id=None, list_id=None, new=False):
+        self.user_id = int(user_id)
+        self.store_id = int(store_id) if store_id else None
+        self.list_id = int(list_id) if list_id else None
+        self.new = new
+
+        self.stores = []
+        self.store = None
+        self.routes = []
+        self.lists = []
+        self.next_cursor = None
+        self.list = None
+        self.list_items = []
+        self.route_groups = []
+        self.item_measurements = ()
+
+    def build(self):
+        """ Load page data
+
+        Return:
+            self
+        """
+        # All Stores for User, with related Store rows in the identity map
+        self.stores = session.query(UserStore).options(joinedload(UserStore.store))\
+            .filter(UserStore.user_id == self.user_id)\
+            .order_by(UserStore.store_id).all()
+        if not self.stores:
+            return self
+
+        # Requested List sets Store if not provided
+        if self.list_id and not self.new and not self.store_id:
+            requested_list = session.query(List).get(self.list_id)
+            if requested_list is not None:
+                self.store_id = requested_list.store_id
+
+        # Selected Store, default first Store for User
+        if not self.store_id:
+            self.store_id = self.stores[0].store_id
+        self.store = session.query(Store).get(self.store_id)
+        if self.store is None:
+            return self
+
+        # All Routes for User and selected Store
+        self.routes = session.query(Route)\
+            .filter(Route.user_id == self.user_id, Route.store.contains(self.store))\
+            .order_by(Route.id).all()
+
+        # First page of Lists for User and selected Store
+        self.lists, self.next_cursor = load_lists_page(self.user_id, self.store.id)
+
+        # Selected List, default latest List for Store
+        # Requested List is read from the identity map when on the first page
+        if self.new:
+            self.list = "new"
+        elif self.list_id:
+            self.list = session.query(List).get(self.list_id)
+        elif self.lists:
+            self.list = self.lists[0]
+
+        if self.list and self.list != "new":
+            self.route_groups = self.load_route_groups(self.list.route_id)
+            self.list_items = self.load_list_items(self.list.id, self.list.route_id)
+
+        # Item Measurements for form input selection
+        self.item_measurements = cache.item_measurements.all()
+
+        return self
+
+    @staticmethod
+    def load_route_groups(route_id):
+        """ Route Groups with Item Group names ordered by route order """
+        if not route_id:
+            return []
+        rows = session.query(RouteGroup.id, RouteGroup.item_group_id,
+                             ItemGroup.name, RouteGroup.route_order)\
+            .outerjoin(ItemGroup, RouteGroup.item_group_id == ItemGroup.id)\
+            .filter(RouteGroup.route_id == route_id)\
+            .order_by(RouteGroup.route_order, RouteGroup.id)
+        return [RouteGroupRow(*row) for row in rows]
+
+    @staticmethod
+    def load_list_items(list_id, route_id=None):
+        """ List Items sorted by route order of their Item Group """
+        query = session.query(ListItem.id, ListItem.item_name, ListItem.item_notes,
+                              ListItem.item_quantity, ListItem.item_measurement_id,
+                              ListItem.item_group_id)\
+            .filter(ListItem.list_id == list_id)
+        if route_id:
+            query = query.outerjoin(RouteGroup, and_(RouteGroup.route_id == route_id,
+                                                     RouteGroup.item_group_id == ListItem.item_group_id))\
+                .order_by(RouteGroup.route_order, ListItem.id)
+        else:
+            query = query.order_by(ListItem.id)
+        return [ListItemRow(*row) for row in query]
+
+    def template_context(self):
+        """ Keyword arguments for render_template """
+        return dict(stores=self.stores, store=self.store,
+                    store_id=self.store.id if self.store else None,
+                    routes=self.routes,
+                    lists=self.lists, list=self.list,
+                    next_cursor=self.next_cursor,
+                    list_items=self.list_items,
+                    route_groups=self.route_groups,
+                    item_measurements=self.item_measurements)
@@ -0,0 +1,186 @@
+""" Password Hashing Service
+
+Hash and verify passwords on a bounded process pool, off the request threads,
+    with a configurable werkzeug method and iteration count (PASSWORD_HASH_METHOD).
+    Hashes made with an outdated method are replaced on the next successful login.
+
+Login attempts are throttled per client IP, and per account from each client IP,
+    with sliding windows.
+    Throttle state is per worker process.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from . import app
+
+
+# Iterations werkzeug used when the method omits them
+DEFAULT_ITERATIONS = 1000
+
+
+class HashingBusy(Exception):
+    """ Hashing pool queue full for longer than PASSWORD_HASH_TIMEOUT """
+
+
+class HashingPool(object):
+    """ Process pool with a bound on queued jobs
+
+    Created on first use in each process, so forked workers get their own pool
+
+    Attributes:
+        workers (int): Hashing processes
+        max_pending (int): Jobs submitted but not finished
+        timeout (float): Seconds to wait for a queue slot and for the result
+    """
+
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pid = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def run(self, func, *args):
+        """ Run func(*args) in the pool and return its result
+
+        Raise:
+            HashingBusy: No queue slot or no result within timeout
+        """
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=self.timeout):
+            raise HashingBusy("Password hashing queue full")
+        try:
+            future = executor.submit(func, *args)
+        except Exception:
+            slots.release()
+            raise
+        # Slot is held until the job finishes, also when the caller stops waiting
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy("Password hashing timed out")
+
+
+def default_workers():
+    """ Hashing processes per web worker, host CPUs shared by all web workers (WEB_CONCURRENCY) """
+    web_workers = max(int(os.environ.get("WEB_CONCURRENCY", 1)), 1)
+    return max((os.cpu_count() or 1) // web_workers, 1)
+
+
+pool = HashingPool(app.config["PASSWORD_HASH_WORKERS"] or default_workers(),
+                   app.config["PASSWORD_HASH_MAX_PENDING"],
+                   app.config["PASSWORD_HASH_TIMEOUT"])
+
+
+def hash_password(password):
+    """ Hash password with the configured method """
+    return pool.run(generate_password_hash, password, app.config["PASSWORD_HASH_METHOD"])
+
+
+def verify_password(password_hash, password):
+    """ Test password against stored hash """
+    if not password_hash:
+        return False
+    return pool.run(check_password_hash, password_hash, password)
+
+
+def _method_parts(method):
+    """ Method string as (algorithm, hash name, iterations)
+
+    Example:
+        "pbkdf2:sha256:50000" -> ("pbkdf2", "sha256", 50000)
+    """
+    parts = method.split(":")
+    iterations = int(parts[2]) if len(parts) > 2 else DEFAULT_ITERATIONS
+    return parts[0], parts[1] if len(parts) > 1 else "", iterations
+
+
+def needs_rehash(password_hash):
+    """ Test whether stored hash was made with another method or fewer iterations """
+    if not password_hash or "$" not in password_hash:
+        return True
+    return _method_parts(password_hash.split("$", 1)[0]) != _method_parts(app.config["PASSWORD_HASH_METHOD"])
+
+
+class Throttle(object):
+    """ Sliding window attempt limit per key
+
+    Attributes:
+        limit (int): Attempts allowed per window
+        window (int): Window in seconds
+        clock (function): Current time in seconds
+    """
+
+    def __init__(self, limit, window, clock=time.time):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return None
+        return attempts
+
+    def allow(self, key):
+        """ Record attempt and test whether it is within the limit """
+        now = self.clock()
+        with self._lock:
+            attempts = self._recent(key, now)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            if len(attempts) >= self.limit:
+                return False
+            attempts.append(now)
+            # Drop expired keys so memory stays bounded under many distinct keys
+            if len(self._attempts) > 10000:
+                for stale in list(self._attempts):
+                    self._recent(stale, now)
+            return True
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+ip_throttle = Throttle(app.config["LOGIN_ATTEMPTS_PER_IP"], app.config["LOGIN_THROTTLE_WINDOW"])
+account_throttle = Throttle(app.config["LOGIN_ATTEMPTS_PER_ACCOUNT"], app.config["LOGIN_THROTTLE_WINDOW"])
+
+
+def _account_key(remote_addr, email):
+    """ Account attempts are counted per client, so others cannot lock out a known email """
+    return (email or "").strip().lower(), remote_addr or ""
+
+
+def allow_login_attempt(remote_addr, email):
+    """ Test client IP, and account from that client, are within login attempt limits """
+    return ip_throttle.allow(remote_addr or "") and account_throttle.allow(_account_key(remote_addr, email))
+
+
+def login_succeeded(remote_addr, email):
+    """ Clear account attempts from client after successful login """
+    account_throttle.reset(_account_key(remote_addr, email))
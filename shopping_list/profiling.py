@@ -0,0 +1,171 @@
+""" Request Profiling
+
+Opt-in WSGI middleware capturing cProfile stats for the full request
+    (routing, view, form updates, template render and response iteration).
+    Only imported and installed when PROFILE_ENABLED is set, so disabled profiling
+    adds no per-request work.
+
+A request is profiled when:
+    PROFILE_ALL is set, or
+    the X-Profile request header matches PROFILE_TOKEN, or
+    PROFILE_SLOW_MS is set (every request is profiled, only slower requests are kept)
+
+Dumps are pstats files in a bounded ring in PROFILE_DIR, listed at /profiles.
+    The index and downloads also require the X-Profile header, e.g.
+    curl -H "X-Profile: $PROFILE_TOKEN" -OJ https://host/profiles/<file name>
+"""
+
+import os
+import hmac
+import re
+import time
+import cProfile
+import threading
+
+from flask import request, render_template, send_from_directory, abort
+
+from . import app
+
+
+_unsafe = re.compile(r"[^A-Za-z0-9_-]+")
+
+# Dump file names written by ProfileRing.save: time ms-method-path-elapsed ms
+_dump_name = re.compile(r"^(\d+)-[A-Z]+-[A-Za-z0-9_-]+-\d+ms\.prof$")
+
+
+def token_matches(value, token):
+    """ Constant time comparison of a supplied profile token """
+    return bool(value) and hmac.compare_digest(value.encode("utf-8"), token.encode("utf-8"))
+
+
+class ProfileRing(object):
+    """ Bounded directory of profile dumps, oldest removed first
+
+    Attributes:
+        directory (str): Dump directory
+        max_files (int): Dumps kept
+    """
+
+    def __init__(self, directory, max_files):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, profiler, method, path, elapsed_ms):
+        """ Dump profiler stats and remove dumps over the limit """
+        file_name = "{}-{}-{}-{}ms.prof".format(int(time.time() * 1000), method,
+                                                _unsafe.sub("_", path).strip("_")[:60] or "root",
+                                                int(elapsed_ms))
+        profiler.dump_stats(os.path.join(self.directory, file_name))
+        with self._lock:
+            for stale in self.files()[self.max_files:]:
+                try:
+                    os.remove(os.path.join(self.directory, stale))
+                except OSError:
+                    pass
+
+    def files(self):
+        """ Dump file names, newest first
+
+        Other files in the directory (PROFILE_DIR may be shared) are ignored
+        """
+        return sorted((name for name in os.listdir(self.directory) if _dump_name.match(name)),
+                      key=lambda name: int(_dump_name.match(name).group(1)), reverse=True)
+
+
+class ProfilerMiddleware(object):
+    """ Profile selected requests around the wrapped WSGI application """
+
+    def __init__(self, wsgi_app, ring, profile_all=False, token=None, slow_ms=0):
+        self.wsgi_app = wsgi_app
+        self.ring = ring
+        self.profile_all = profile_all
+        self.token = token
+        self.slow_ms = slow_ms
+
+    def __call__(self, environ, start_response):
+        requested = self.profile_all or \
+            (self.token and token_matches(environ.get("HTTP_X_PROFILE"), self.token))
+        if not (requested or self.slow_ms) or environ.get("PATH_INFO", "").startswith("/profiles"):
+            return self.wsgi_app(environ, start_response)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except Exception:
+            profiler.disable()
+            self.finish(profiler, environ, start, requested)
+            raise
+        profiler.disable()
+        return self.iterate(app_iter, profiler, environ, start, requested)
+
+    def iterate(self, app_iter, profiler, environ, start, requested):
+        """ Profile response iteration (streamed bodies), save on close """
+        try:
+            iterator = iter(app_iter)
+            while True:
+                profiler.enable()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    profiler.disable()
+                yield chunk
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+            self.finish(profiler, environ, start, requested)
+
+    def finish(self, profiler, environ, start, requested):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if requested or elapsed_ms >= self.slow_ms:
+            self.ring.save(profiler, environ.get("REQUEST_METHOD", "GET"),
+                           environ.get("PATH_INFO", ""), elapsed_ms)
+
+
+ring = ProfileRing(app.config["PROFILE_DIR"], app.config["PROFILE_MAX_FILES"])
+
+
+def install():
+    """ Wrap the application with the profiling middleware """
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, ring,
+                                      profile_all=app.config["PROFILE_ALL"],
+                                      token=app.config["PROFILE_TOKEN"],
+                                      slow_ms=app.config["PROFILE_SLOW_MS"])
+
+
+def authorize():
+    """ Profile views require PROFILE_TOKEN in the X-Profile header, or debug mode without a token
+
+    Never accepted as a query parameter, which would leak into logs, history and page links
+    """
+    token = app.config["PROFILE_TOKEN"]
+    if token:
+        if not token_matches(request.headers.get("X-Profile"), token):
+            abort(403)
+    elif not app.debug:
+        abort(404)
+
+
+@app.route("/profiles", methods=["GET"])
+def profiles_get():
+    """ Index of captured profiles
+
+    Return:
+        profiles.html template
+    """
+    authorize()
+    return render_template("profiles.html", profiles=ring.files())
+
+
+@app.route("/profiles/<file_name>", methods=["GET"])
+def profile_download(file_name):
+    """ Download pstats dump (load with pstats.Stats or snakeviz) """
+    authorize()
+    if file_name not in ring.files():
+        abort(404)
+    return send_from_directory(ring.directory, file_name, as_attachment=True)
@@ -21,3 +21,25 @@ function postFormData(url, formId, callback) {
 function responseRedirect (response) {
     location.assign(response);
 }
+
+function loadMoreLists() {
+    // Infinite scroll: replace visible "more" placeholder with next page of Lists
+    var more = document.querySelector(".lists-more");
+    if (!more || more.getAttribute("data-loading") || more.getBoundingClientRect().top > window.innerHeight + 200) {
+        return;
+    }
+    more.setAttribute("data-loading", "true");
+    var ajax = new XMLHttpRequest();
+    ajax.onload = function () {
+        if (ajax.status === 200) {
+            more.insertAdjacentHTML("afterend", ajax.responseText);
+            more.parentNode.removeChild(more);
+            loadMoreLists();
+        }
+    };
+    ajax.open("GET", more.getAttribute("data-url"));
+    ajax.send();
+}
+
+window.addEventListener("scroll", loadMoreLists);
+window.addEventListener("load", loadMoreLists);
@@ -0,0 +1,248 @@
+""" Item Name Autocomplete
+
+Per User prefix structures of past List Item names, ranked by frequency and recency.
+    Loaded lazily per User with one aggregate query and evicted least recently used
+    under a memory cap. Users with very large histories use an indexed prefix query.
+    A loaded index is checked against the User's List version at most every
+    check_interval seconds and reloaded when Lists were written elsewhere
+    (other workers, import, manage.py).
+"""
+
+import bisect
+import datetime
+import heapq
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+from flask import has_request_context
+from sqlalchemy import func, event, inspect
+
+from . import app
+from .database import session, Session
+from .login import current_user_id
+from .models import List, ListItem
+
+
+# Days for a name's recency weight to halve
+RECENCY_HALF_LIFE = 60
+
+
+def score(count, last_used, today):
+    """ Rank by use count, decayed by days since last use """
+    if last_used is None:
+        return count
+    age = max((today - last_used).days, 0)
+    return count * 0.5 ** (age / RECENCY_HALF_LIFE)
+
+
+class PrefixIndex(object):
+    """ Sorted lowercase names for prefix range lookups
+
+    Attributes:
+        keys (list[str]): Sorted lowercase names
+        entries (list[list]): Display name, use count and last use date per key
+        size (int): Approximate memory use in bytes
+        version (tuple): User List version the index was loaded at (Suggester)
+        checked_at (float): Time of the last version check (Suggester)
+    """
+
+    def __init__(self, rows=()):
+        merged = {}
+        for name, count, last_used in rows:
+            key = name.strip().lower()
+            if not key:
+                continue
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [name.strip(), count, last_used]
+            else:
+                if count > entry[1]:
+                    entry[0] = name.strip()
+                entry[1] += count
+                entry[2] = max(filter(None, [entry[2], last_used]), default=None)
+        self.keys = sorted(merged)
+        self.entries = [merged[key] for key in self.keys]
+        self.size = sum(sys.getsizeof(key) * 2 + 150 for key in self.keys)
+        self.version = None
+        self.checked_at = 0
+
+    def add(self, name, last_used):
+        """ Count a saved name """
+        key = name.strip().lower()
+        if not key:
+            return
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self.entries[i][1] += 1
+            self.entries[i][2] = max(filter(None, [self.entries[i][2], last_used]), default=None)
+        else:
+            self.keys.insert(i, key)
+            self.entries.insert(i, [name.strip(), 1, last_used])
+            self.size += sys.getsizeof(key) * 2 + 150
+
+    def suggest(self, prefix, limit):
+        """ Ranked names starting with prefix """
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\uffff", lo=start)
+        today = datetime.date.today()
+        best = heapq.nlargest(limit, self.entries[start:end],
+                              key=lambda entry: score(entry[1], entry[2], today))
+        return [entry[0] for entry in best]
+
+
+class Suggester(object):
+    """ Per User prefix indexes with LRU eviction under a byte budget
+
+    Attributes:
+        max_bytes (int): Memory budget for all loaded indexes
+        max_names (int): Larger User histories use the database query
+        check_interval (float): Seconds between User List version checks of a loaded index
+    """
+
+    def __init__(self, max_bytes, max_names, check_interval=30):
+        self.max_bytes = max_bytes
+        self.max_names = max_names
+        self.check_interval = check_interval
+        self._bytes = 0
+        self._users = OrderedDict()
+        self._too_large = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _history(user_id):
+        """ Aggregate query of User's past item names """
+        return session.query(ListItem.item_name, func.count(), func.max(List.shop_date))\
+            .join(List, List.id == ListItem.list_id)\
+            .filter(List.user_id == user_id)\
+            .group_by(ListItem.item_name)
+
+    @staticmethod
+    def query_suggest(user_id, prefix, limit):
+        """ Indexed prefix query on lower(item_name) """
+        pattern = prefix.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = Suggester._history(user_id)\
+            .filter(func.lower(ListItem.item_name).like(pattern, escape="\\"))\
+            .order_by(func.count().desc())\
+            .limit(limit * 4)
+        return PrefixIndex(rows).suggest(prefix, limit)
+
+    @staticmethod
+    def _version(user_id):
+        """ Version of User's Lists: latest List version time and List count
+
+        List Item writes bump their List's updated_at (bump_version), deletes change the count
+        """
+        return tuple(session.query(func.max(List.updated_at), func.count(List.id))
+                     .filter(List.user_id == user_id).one())
+
+    def _rows(self, user_id):
+        """ History rows of User, at most max_names + 1 """
+        return self._history(user_id).limit(self.max_names + 1).all()
+
+    def _index(self, user_id):
+        """ Current loaded index for User, or None if history too large to hold """
+        now = time.time()
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+                if now - index.checked_at < self.check_interval:
+                    return index
+            elif user_id in self._too_large:
+                return None
+
+        version = self._version(user_id)
+        if index is not None and index.version == version:
+            index.checked_at = now
+            return index
+
+        rows = self._rows(user_id)
+        if len(rows) > self.max_names:
+            with self._lock:
+                self._too_large.add(user_id)
+                self._discard(user_id)
+            return None
+        index = PrefixIndex(rows)
+        index.version = version
+        index.checked_at = now
+
+        with self._lock:
+            self._discard(user_id)
+            self._users[user_id] = index
+            self._bytes += index.size
+            while self._bytes > self.max_bytes and len(self._users) > 1:
+                _, evicted = self._users.popitem(last=False)
+                self._bytes -= evicted.size
+            return self._users.get(user_id, index)
+
+    def _discard(self, user_id):
+        """ Remove User's loaded index, lock held """
+        index = self._users.pop(user_id, None)
+        if index is not None:
+            self._bytes -= index.size
+
+    def suggest(self, user_id, prefix, limit=10):
+        """ Ranked completions of prefix from User's past item names
+
+        Return:
+            List of item names
+        """
+        prefix = prefix.strip()
+        if not prefix:
+            return []
+        index = self._index(int(user_id))
+        if index is None:
+            return self.query_suggest(int(user_id), prefix, limit)
+        return index.suggest(prefix, limit)
+
+    def learn(self, user_id, names):
+        """ Add saved names to User's index if loaded """
+        today = datetime.date.today()
+        with self._lock:
+            index = self._users.get(int(user_id))
+            if index is None:
+                return
+            self._bytes -= index.size
+            for name in names:
+                index.add(name, today)
+            self._bytes += index.size
+
+
+suggester = Suggester(app.config["SUGGEST_CACHE_MAX_BYTES"], app.config["SUGGEST_MAX_NAMES_PER_USER"],
+                      app.config["SUGGEST_CHECK_INTERVAL"])
+
+
+def learn_names_on_commit(items):
+    """ Queue List Item names inserted without a flush (ListItem.insert_many) for autocomplete
+
+    Learned when the transaction commits, discarded on rollback
+    """
+    session().info.setdefault("suggest_names", []).extend(item["item_name"] for item in items)
+
+
+@event.listens_for(Session, "after_flush")
+def record_item_names(db_session, flush_context):
+    """ Collect new or renamed List Item names for autocomplete """
+    for instance in list(db_session.new) + list(db_session.dirty):
+        if not isinstance(instance, ListItem) or not instance.item_name or instance.item_name == "New Item":
+            continue
+        if instance in db_session.new or inspect(instance).attrs.item_name.history.has_changes():
+            db_session.info.setdefault("suggest_names", []).append(instance.item_name)
+
+
+@event.listens_for(Session, "after_commit")
+def learn_item_names(db_session):
+    """ Add committed List Item names to current User's index """
+    names = db_session.info.pop("suggest_names", ())
+    user_id = current_user_id() if names and has_request_context() else None
+    if user_id is not None:
+        suggester.learn(user_id, names)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_item_names(db_session):
+    """ Discard names from rolled back transaction """
+    db_session.info.pop("suggest_names", None)
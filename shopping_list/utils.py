@@ -1,7 +1,171 @@
 """ Custom Utility Functions """
 
+import re
+import datetime
+import hashlib
+from decimal import Decimal, InvalidOperation
+from fractions import Fraction
+
+from flask import request, make_response, session as http_session
+from sqlalchemy import inspect, tuple_
+
 from .database import session
 from . import models
+from . import cache
+
+
+# Cached column coercion maps by model class
+_column_maps = {}
+
+
+def _to_integer(value):
+    """ Convert form value to integer, empty value to null """
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def _to_numeric(value):
+    """ Convert form value to decimal, empty value to null """
+    if value is None or value == "":
+        return None
+    return Decimal(str(value))
+
+
+def _to_boolean(value):
+    """ Convert form value to boolean """
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "on", "yes", "y")
+
+
+def _to_date(value):
+    """ Convert form value (YYYY-MM-DD) to date, empty value to null """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _to_string(value):
+    """ Pass through form value as string """
+    if value is None:
+        return None
+    return str(value)
+
+
+# Coercion functions by SQLAlchemy type visit name
+_coercers = {
+    "integer": _to_integer,
+    "big_integer": _to_integer,
+    "small_integer": _to_integer,
+    "numeric": _to_numeric,
+    "boolean": _to_boolean,
+    "date": _to_date,
+}
+
+
+def column_map(model):
+    """ Retrieve cached mapping of column names to coercion functions
+
+    Arguments:
+        model (class): SQLAlchemy model class
+
+    Return:
+        Dictionary of column name: coercion function
+    """
+    try:
+        return _column_maps[model]
+    except KeyError:
+        columns = {}
+        for column in model.__table__.columns:
+            columns[column.name] = _coercers.get(column.type.__visit_name__, _to_string)
+        _column_maps[model] = columns
+        return columns
+
+
+def parse_form(data, **new_primary_keys):
+    """ Parse HTML form data into updates grouped by model and primary key
+
+    Arguments:
+        data (dict): Dictionary of html form data, see update_from_form
+        new_primary_keys (dict): Dictionary of new primary keys by model class name
+
+    Return:
+        Dictionary of updates
+            key: Model class
+            value: Dictionary of primary key tuple: {column name: coerced value}
+
+    Raises:
+        KeyError, ValueError: Form input name or value does not match schema
+    """
+    updates = {}
+
+    for key, value in data.items():
+        # Set key parameters per Form input name schema
+        param = str(key).split(".", 2)
+        if len(param) != 3:
+            raise ValueError("Form input name not in schema Model.ID.Column: {}".format(key))
+        key_model, key_primary_key, key_column = param
+
+        # Primary Key - return from new_primary_keys if not provided
+        if not key_primary_key or key_primary_key.isspace():
+            key_primary_key = new_primary_keys[key_model]
+        # Convert Primary Keys to tuple
+        key_primary_key = tuple(int(i) for i in str(key_primary_key).split())
+
+        # Set SQLAlchemy model class and coerce value using column type
+        model = getattr(models, key_model)
+        value = column_map(model)[key_column](value)
+
+        updates.setdefault(model, {}).setdefault(key_primary_key, {})[key_column] = value
+
+    return updates
+
+
+def load_rows(model, primary_keys):
+    """ Load model rows for multiple primary keys with one query
+
+    Arguments:
+        model (class): SQLAlchemy model class
+        primary_keys (iterable[tuple]): Primary key tuples
+
+    Return:
+        Dictionary of primary key tuple: model instance
+    """
+    primary_keys = list(primary_keys)
+    key_columns = inspect(model).primary_key
+
+    if len(key_columns) == 1:
+        criterion = key_columns[0].in_([key[0] for key in primary_keys])
+    else:
+        criterion = tuple_(*key_columns).in_(primary_keys)
+
+    return {inspect(row).identity: row for row in session.query(model).filter(criterion)}
+
+
+def apply_updates(updates, commit=True):
+    """ Apply grouped updates in a single transaction
+
+    Arguments:
+        updates (dict): Updates by model and primary key, as returned by parse_form
+        commit (bool): Commit transaction after applying updates
+
+    Raises:
+        LookupError: Row for primary key does not exist
+    """
+    for model, rows_data in updates.items():
+        rows = load_rows(model, rows_data.keys())
+        for primary_key, columns in rows_data.items():
+            row = rows.get(primary_key)
+            if row is None:
+                raise LookupError("{} with primary key {} not found".format(model.__name__, primary_key))
+            for column, value in columns.items():
+                setattr(row, column, value)
+
+    if commit:
+        session.commit()
 
 
 def update_from_form(data, **new_primary_keys):
@@ -10,11 +174,14 @@ def update_from_form(data, **new_primary_keys):
     If primary_key not provided in dictionary key, then assume
         new record and use new_primary_keys object
 
+    All form fields are parsed up front, rows are loaded with one query per model
+    and the changes are committed once. Any failure rolls back the whole form.
+
     Arguments:
         data (dict): Dictionary of html form data
             key: Form input name in schema ModelClass.ID.ColumnName
                 ModelClass: SQLAlchemy model class name defined in models.py
-                ID: Primary Key ID, multiple keys comma separated
+                ID: Primary Key ID, multiple keys space separated
                 ColumnName: Column name
             value: Form input value
         new_primary_keys (dict): Dictionary of new primary keys for post
@@ -24,44 +191,143 @@ def update_from_form(data, **new_primary_keys):
     Return:
         Boolean indicating success
     """
+    try:
+        updates = parse_form(data, **new_primary_keys)
+        apply_updates(updates)
 
-    # Loop through sorted dictionary
-    for key, value in sorted(data.items()):
-        try:
-            # Set key parameters per Form input name schema
-            param = str(key).split(".", 2)
-            # SQLAlchemy model table name
-            key_model = param[0]
-            # Primary Key - return from new_primary_keys if not provided
-            if not param[1] or param[1].isspace():
-                key_primary_key = new_primary_keys[key_model]
-            else:
-                key_primary_key = param[1]
-            # Convert Primary Keys to tuple
-            key_primary_key = tuple(int(i) for i in str(key_primary_key).split(" "))
-            # Column name
-            key_column = param[2]
-
-            # Set SQLAlchemy model class
-            model = getattr(models, key_model)
-            # Set row to update
-            row = session.query(model).get(key_primary_key)
-
-            # For empty value, set to null if column type is integer
-            if value == "" and str(model.__table__.columns[key_column].type) == "INTEGER":
-                value = None
-
-            # Perform record update with dict value
-            setattr(row, key_column, value)
-            session.commit()
-
-        except Exception as e:
-            print("ERROR = {}".format(e))
-            print("Submitted Key = {}".format(key))
-            print("Model = {}".format(param[0]))
-            print("Primary_Key = {}".format(param[1]))
-            print("Column = {}".format(param[2]))
-            print("Value = {}".format(value))
-            return False
+    except Exception as e:
+        session.rollback()
+        print("ERROR = {}".format(e))
+        print("Submitted Keys = {}".format(sorted(data.keys())))
+        return False
 
     return True
+
+
+def conditional_response(version, render):
+    """ Answer conditional GET from entity versions before rendering
+
+    Arguments:
+        version (PageVersion): Page version tag and last modified time
+        render (function): Renders response body when client copy is stale
+
+    Return:
+        304 Not Modified or rendered response with ETag/Last-Modified headers
+    """
+    etag = hashlib.sha1(version.tag.encode("utf-8")).hexdigest()
+
+    # Pending flashed messages are shown on the next render
+    if "_flashes" not in http_session:
+        if request.if_none_match:
+            not_modified = etag in request.if_none_match
+        else:
+            not_modified = (version.last_modified is not None and request.if_modified_since is not None
+                            and version.last_modified.replace(microsecond=0) <= request.if_modified_since)
+        if not_modified:
+            response = make_response("", 304)
+            response.set_etag(etag)
+            return response
+
+    response = make_response(render())
+    response.set_etag(etag)
+    if version.last_modified is not None:
+        response.last_modified = version.last_modified
+    # Browsers revalidate on every load
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+# Pasted item line: [numbering] [quantity [measurement]] name[, notes]
+# Numbering: "3." or "3)" list numbers and "-", "*" or bullet markers
+# Quantity: 2, 1.5, 1/2 or 1 1/2, followed by whitespace ("2% milk" and "7up" have none)
+_item_line = re.compile(r"""^\s*(?:\d+[.)](?:\s+|$)|[-*\u2022]\s*)?
+                            (?:(?P<quantity>\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+)(?=\s|$))?\s*
+                            (?P<rest>.*?)\s*$""", re.VERBOSE)
+
+
+def measurement_lookup():
+    """ Map lowercase measurement names and abbreviations (singular/plural) to ids
+
+    The singular of a plural name ("can" of "cans") is part of the item name after a
+        quantity above 1, e.g. "2 can openers". Abbreviations always match ("2 lb steak").
+
+    Return:
+        Dictionary of measurement token: (Item Measurement id, matches after a quantity above 1)
+    """
+    lookup = {}
+    for measurement in cache.item_measurements.all():
+        name = measurement.name.lower().rstrip(".")
+        abbreviation = measurement.abbreviation.lower().rstrip(".")
+        for token in (name, name + "s", abbreviation, abbreviation.rstrip("s"), abbreviation + "s"):
+            lookup.setdefault(token, (measurement.id, True))
+        lookup.setdefault(name.rstrip("s"), (measurement.id, not name.endswith("s")))
+    return lookup
+
+
+def parse_quantity(text):
+    """ Convert quantity text (2, 1.5, 1/2, 1 1/2) to decimal """
+    whole, _, fraction = text.partition(" ")
+    if "/" in whole:
+        whole, fraction = "0", whole
+    quantity = Decimal(whole)
+    if fraction:
+        fraction = Fraction(fraction)
+        quantity += (Decimal(fraction.numerator) / Decimal(fraction.denominator)).quantize(Decimal("0.001"))
+    return quantity
+
+
+def parse_item_lines(text, measurements=None):
+    """ Parse pasted free text into List Item values, one item per line
+
+    A measurement is only recognized directly after a quantity.
+        Lines without a valid quantity get quantity 0.
+
+    Example:
+        "2 lbs flank steak, organic" -> quantity 2, measurement lbs,
+            name flank steak, notes organic
+
+    Arguments:
+        text (str): Pasted lines
+        measurements (dict): Measurement token: (Item Measurement id, matches after a quantity above 1),
+            default from measurement_lookup
+
+    Return:
+        List of dictionaries of List Item column values
+    """
+    if measurements is None:
+        measurements = measurement_lookup()
+    items = []
+
+    for line in text.splitlines():
+        match = _item_line.match(line)
+        rest = match.group("rest")
+        if not rest:
+            continue
+
+        quantity = None
+        if match.group("quantity"):
+            try:
+                quantity = parse_quantity(match.group("quantity"))
+            except (ZeroDivisionError, InvalidOperation):
+                quantity = None
+
+        measurement_id = None
+        first, _, remainder = rest.partition(" ")
+        measurement = measurements.get(first.lower().rstrip(".")) if match.group("quantity") else None
+        if measurement and remainder and (measurement[1] or quantity is None or quantity <= 1):
+            measurement_id = measurement[0]
+            rest = remainder.strip()
+
+        name, _, notes = rest.partition(",")
+        name = name.strip()[:50]
+        if not name:
+            continue
+
+        items.append({"item_name": name,
+                      "item_notes": notes.strip()[:100],
+                      "item_quantity": quantity if quantity is not None else Decimal(0),
+                      "item_measurement_id": measurement_id,
+                      "item_group_id": None})
+
+    return items
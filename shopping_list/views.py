@@ -1,13 +1,23 @@
 """ Application Views """
 
-from flask import render_template, redirect, url_for, request, send_file
+import json
+
+from flask import render_template, redirect, url_for, request, send_file, Response, stream_with_context, abort
 from flask.ext.login import current_user, login_user, logout_user, flash, login_required
-from werkzeug.security import check_password_hash, generate_password_hash
 
 from . import app
+from . import cache
+from . import export
+from . import passwords
+from .classifier import classifier, learn_on_commit, route_item_group_ids
 from .database import session
+from .decorators import require
+from .instrumentation import query_budget
+from .login import current_user_id, identities
 from .models import *
-from .utils import update_from_form
+from .pages import ListPageData, page_version, print_version, load_lists_page
+from .suggest import learn_names_on_commit
+from .utils import update_from_form, conditional_response, parse_item_lines
 
 
 @app.route("/")
@@ -21,7 +31,7 @@ def index():
     if current_user.is_anonymous():
         return redirect(url_for("login"))
 
-    user_id = int(current_user.get_id())
+    user_id = current_user_id()
 
     # Redirect to Lists if exist
     if session.query(List.id).filter(List.user_id == user_id).first() is not None:
@@ -47,11 +57,23 @@ def login():
     if request.method == "POST":
         email = request.form["email"]
         password = request.form["password"]
+        # Throttle login bursts per client and per account from that client
+        if not passwords.allow_login_attempt(request.remote_addr, email):
+            flash("Too many login attempts. Please wait a few minutes and try again.", "danger")
+            return redirect(url_for("login"))
         # Set user
         user = session.query(User).filter_by(email=email).first()
         # Test user exists and password correct
-        if user and check_password_hash(user.password, password):
+        if user and passwords.verify_password(user.password, password):
+            # Replace hash made with an outdated method, retried next login if busy
+            if passwords.needs_rehash(user.password):
+                try:
+                    user.password = passwords.hash_password(password)
+                    session.commit()
+                except passwords.HashingBusy:
+                    pass
             # Successful login
+            passwords.login_succeeded(request.remote_addr, email)
             login_user(user)
             flash("Logged in successfully.", "success")
             return redirect(request.args.get("next") or url_for("index"))
@@ -67,6 +89,18 @@ def login():
         return redirect(url_for("index"))
 
 
+@app.errorhandler(passwords.HashingBusy)
+def hashing_busy(error):
+    """ Password hashing queue full
+
+    Return:
+        Redirect to requesting page
+    """
+    session.rollback()
+    flash("Server busy. Please try again.", "danger")
+    return redirect(request.referrer or url_for("login"))
+
+
 @app.route("/logout")
 def logout():
     """ Logout
@@ -92,8 +126,11 @@ def profile_get():
     if current_user.is_anonymous():
         return render_template("profile.html")
 
-    # Return existing User profile data
-    user = session.query(User).get(int(current_user.get_id()))
+    # Return existing User profile data, read fresh (the identity cache
+    # may still hold values from before an update in another worker)
+    user = session.query(User.name, User.email).filter(User.id == current_user_id()).first()
+    if not user:
+        abort(404)
     return render_template("profile.html",
                            name=user.name,
                            email=user.email)
@@ -119,7 +156,7 @@ def profile_add():
         # Test whether new password entry matches
         if data["password-new"] == data["password-new2"]:
             # Update password
-            user.password = generate_password_hash(data["password-new"])
+            user.password = passwords.hash_password(data["password-new"])
         else:
             flash("New passwords do not match", "danger")
             return redirect(url_for("profile_get"))
@@ -155,7 +192,7 @@ def profile_update(user_id):
         return redirect(url_for("index"))
 
     # Test current password match
-    if not check_password_hash(user.password, data["password-current"]):
+    if not passwords.verify_password(user.password, data["password-current"]):
         flash("Current password is incorrect", "danger")
         return redirect(url_for("profile_get"))
 
@@ -164,7 +201,7 @@ def profile_update(user_id):
         # Test whether new password entry matches
         if data["password-new"] == data["password-new2"]:
             # Update password
-            user.password = generate_password_hash(data["password-new"])
+            user.password = passwords.hash_password(data["password-new"])
         else:
             flash("New passwords do not match", "danger")
             return redirect(url_for("profile_get"))
@@ -174,6 +211,7 @@ def profile_update(user_id):
     user.email = data["email"]
 
     session.commit()
+    identities.invalidate(user.id)
 
     flash("Successfully updated user profile", "success")
     return redirect(url_for("profile_get"))
@@ -198,7 +236,7 @@ def store_get(store_id=None):
             Existing Store: Store detail form for single Store
     """
     # Set all Stores for current User
-    stores = session.query(UserStore).filter(UserStore.user_id == current_user.get_id())\
+    stores = session.query(UserStore).filter(UserStore.user_id == current_user_id())\
         .order_by(UserStore.store_id).all()
 
     # If no stores, then return empty template
@@ -212,7 +250,7 @@ def store_get(store_id=None):
         store = "new"
     # If no Store, select first store associated with current user
     elif not store_id:
-        store_id = session.query(UserStore.store_id).filter(UserStore.user_id == current_user.get_id())\
+        store_id = session.query(UserStore.store_id).filter(UserStore.user_id == current_user_id())\
             .order_by(UserStore.store_id).first()
         store = session.query(Store).get(store_id)
     else:
@@ -237,28 +275,25 @@ def store_add():
     # Create new Store
     store = Store(name="New Store")
     session.add(store)
-    session.commit()
+    session.flush()
 
     # Clone default Route to associate with new Store and User
     # Set default Route
     default_route = session.query(Route).filter(Route.default == True).first()
-    new_route = default_route.clone("Default Route")
-    new_route.store = [store]
-    new_route.user_id = current_user.get_id()
+    default_route.clone("Default Route",
+                        user_id=current_user_id(),
+                        store=[store])
 
     # Associate new Store with current User
     user_store = UserStore(store_id=store.id,
-                           user_id=current_user.get_id())
-
-
+                           user_id=current_user_id())
     session.add(user_store)
-    session.commit()
 
     # Create joined UserStore primary keys
     user_store_keys = [str(user_store.user_id), str(user_store.store_id)]
     user_store_keys = " ".join(user_store_keys)
 
-    # Update from html form data
+    # Update from html form data, commits Store, Route and UserStore together
     if not update_from_form(data, Store=store.id, UserStore=user_store_keys):
         flash("Server error in creating store", "danger")
         return redirect(request.url)
@@ -278,7 +313,7 @@ def store_update(store_id):
     data = request.form
 
     # Set UserStore record
-    user_store = session.query(UserStore).filter(UserStore.user_id == int(current_user.get_id()),
+    user_store = session.query(UserStore).filter(UserStore.user_id == current_user_id(),
                                                  UserStore.store_id == store_id).first()
     # Test whether UserStore record exists
     if not user_store:
@@ -304,7 +339,7 @@ def store_delete(store_id):
     """
 
     # Set UserStore record
-    user_store = session.query(UserStore).filter(UserStore.user_id == int(current_user.get_id()),
+    user_store = session.query(UserStore).filter(UserStore.user_id == current_user_id(),
                                                  UserStore.store_id == store_id).first()
     # Test whether UserStore exists
     if not user_store:
@@ -323,6 +358,7 @@ def store_delete(store_id):
 @app.route("/stores/<int:store_id>/routes/<int:route_id>", methods=["GET"])
 @app.route("/stores/<int:store_id>/routes", methods=["GET"])
 @login_required
+@query_budget(20)
 def route_get(store_id=None, route_id=None):
     """ Retrieve all Stores/Routes list and single Route detail form
 
@@ -331,8 +367,21 @@ def route_get(store_id=None, route_id=None):
             New Route: Empty Route detail form
             Existing Route: Route detail form for single Route
     """
+    new = request.path.find("/routes/new") > -1
+
+    # Existing Route: answer conditional GET from Route/Store versions
+    if route_id and not new:
+        version = page_version(current_user_id(), route_id=route_id)
+        if version:
+            return conditional_response(version, lambda: render_route_page(store_id, route_id))
+
+    return render_route_page(store_id, route_id)
+
+
+def render_route_page(store_id=None, route_id=None):
+    """ Render Routes template routes.html """
     # Set all Stores for current User
-    stores = session.query(UserStore).filter(UserStore.user_id == current_user.get_id()) \
+    stores = session.query(UserStore).filter(UserStore.user_id == current_user_id()) \
         .order_by(UserStore.store_id).all()
 
     # If no Stores, then redirect to Stores page
@@ -343,7 +392,7 @@ def route_get(store_id=None, route_id=None):
     # Set selected Store
     # If no selected Store or Route, set to first Store for user
     if not store_id and not route_id:
-        store_id = session.query(UserStore.store_id).filter(UserStore.user_id == current_user.get_id())\
+        store_id = session.query(UserStore.store_id).filter(UserStore.user_id == current_user_id())\
             .order_by(UserStore.store_id).first()
         store = session.query(Store).get(store_id)
     # If Route provided, but no Store, lookup Store associated with Route
@@ -354,7 +403,7 @@ def route_get(store_id=None, route_id=None):
         store = session.query(Store).get(store_id)
 
     # Set all Routes for current User and selected Store
-    routes = session.query(Route).filter(Route.user_id == current_user.get_id(), Route.store.contains(store)) \
+    routes = session.query(Route).filter(Route.user_id == current_user_id(), Route.store.contains(store)) \
         .order_by(Route.id).all()
 
     # Set selected Route
@@ -373,10 +422,11 @@ def route_get(store_id=None, route_id=None):
     route_groups = {}
     if route and route != "new":
         # Retrieve related Item Groups ordered by Route Order
-        route_groups = session.query(RouteGroup).filter(RouteGroup.route_id == route.id).order_by(RouteGroup.route_order)
+        route_groups = session.query(RouteGroup).filter(RouteGroup.route_id == route.id)\
+            .order_by(RouteGroup.route_order, RouteGroup.id)
 
     # Set Item Groups list for form input selection
-    item_groups = session.query(ItemGroup).all()
+    item_groups = cache.item_groups.all()
 
     return render_template("routes.html", view="route",
                            stores=stores, store=store,
@@ -401,7 +451,7 @@ def route_add(store_id):
 
     # Create new Route
     route = Route(name="New Route",
-                  user_id=current_user.get_id(),
+                  user_id=current_user_id(),
                   store=[store])
 
     session.add(route)
@@ -444,10 +494,8 @@ def route_update(store_id, route_id, route_group_id=None):
 
     # Add or Delete Route Groups
     if request.path.find("/routegroups/new") > -1:
-        route_group = RouteGroup(route_id=route_id, route_order=99)
-        session.add(route_group)
+        route.add_route_group()
         session.commit()
-        route.renumber_route_order()
         flash("Successfully created route group", "success")
         return url_for("route_get",
                        store_id=route.store[0].id, route_id=route.id), 201
@@ -459,18 +507,55 @@ def route_update(store_id, route_id, route_group_id=None):
             return route_get(route_id=route_id)
         session.delete(route_group)
         session.commit()
-        route.renumber_route_order()
         flash("Successfully deleted route group", "success")
         return url_for("route_get",
                        store_id=route.store[0].id, route_id=route.id), 200
 
-    route.renumber_route_order()
+    # Respace route order only when submitted sort orders collide
+    route_orders = [value for key, value in data.items()
+                    if key.startswith("RouteGroup.") and key.endswith(".route_order")]
+    if len(set(route_orders)) < len(route_orders):
+        route.compact_route_order()
+        session.commit()
 
     flash("Successfully updated route", "success")
     return redirect(url_for("route_get",
                             store_id=route.store[0].id, route_id=route.id))
 
 
+@app.route("/stores/<int:store_id>/routes/<int:route_id>/routegroups/order", methods=["PUT", "POST"])
+@login_required
+@require("application/json")
+def route_group_order(store_id, route_id):
+    """ Set full Route Group order for Route (drag and drop)
+
+    Request JSON:
+        route_group_ids (list[int]): Route Group ids in new order
+
+    Return:
+        JSON message
+    """
+    data = request.get_json()
+
+    # Set Route record for current User
+    route = session.query(Route).filter(Route.id == route_id,
+                                        Route.user_id == current_user_id()).first()
+    if not route:
+        message = "Could not find route with id {}".format(route_id)
+        return Response(json.dumps({"message": message}), 404, mimetype="application/json")
+
+    try:
+        route_group_ids = [int(i) for i in data["route_group_ids"]]
+    except (KeyError, TypeError, ValueError):
+        message = "Request must contain list of route_group_ids"
+        return Response(json.dumps({"message": message}), 422, mimetype="application/json")
+
+    route.set_route_order(route_group_ids)
+    session.commit()
+
+    return Response(json.dumps({"message": "Successfully updated route order"}), 200, mimetype="application/json")
+
+
 @app.route("/stores/<int:store_id>/routes/<int:route_id>/delete", methods=["POST", "DELETE"])
 @login_required
 def route_delete(store_id, route_id):
@@ -499,6 +584,7 @@ def route_delete(store_id, route_id):
 @app.route("/stores/<int:store_id>/lists/<list_id>", methods=["GET"])
 @app.route("/stores/<int:store_id>/lists", methods=["GET"])
 @login_required
+@query_budget(12)
 def list_get(store_id=None, list_id=None):
     """ Retrieve all Lists and single List detail form
 
@@ -507,88 +593,52 @@ def list_get(store_id=None, list_id=None):
             New List: Empty List detail form
             Existing List: List detail form for single List
     """
-    # Set all Stores for current User
-    stores = session.query(UserStore).filter(UserStore.user_id == current_user.get_id()) \
-        .order_by(UserStore.store_id).all()
-
-    # If no Stores, then redirect to Stores page
-    if not stores:
-        flash("You do not have any stores setup. Please setup a store first.", "warning")
-        return redirect(url_for("store_get"))
-
-    # Set selected Store
-    # If no selected Store or List, set to first Store and first List for user
-    if not store_id and not list_id:
-        store_id = session.query(UserStore.store_id).filter(UserStore.user_id == current_user.get_id())\
-            .order_by(UserStore.store_id).first()
-        store = session.query(Store).get(store_id)
-    # If List provided, but no Store, lookup Store associated with List
-    elif list_id and not store_id:
-        store = session.query(Store).filter(Store.list.contains(session.query(List).get(list_id))).first()
-    else:
-        # Set Store object using provided id
-        store = session.query(Store).get(store_id)
-
-    # Set all Routes for current User and selected Store
-    routes = session.query(Route).filter(Route.user_id == current_user.get_id(), Route.store.contains(store)) \
-        .order_by(Route.id).all()
-
-    # Set all Lists for current User and selected Store
-    lists = session.query(List).filter(List.user_id == current_user.get_id(), List.store == store)\
-        .order_by(List.shop_date.desc()).all()
-
-    # Set selected List
-    # New List requested
-    if request.path.find("/lists/new") > -1:
-        # Set as new List entry
-        list = "new"
-    # If Store provided, but no List, lookup first List associated with Store
-    elif store_id and not list_id:
-        list = session.query(List).filter(List.user_id == current_user.get_id(), List.store == store)\
-            .order_by(List.shop_date.desc()).first()
-    else:
-        # Set List object using provided id
-        list = session.query(List).get(list_id)
+    new = request.path.find("/lists/new") > -1
 
+    # Existing List: answer conditional GET from List/Route/Store versions
+    if list_id and not new:
+        version = page_version(current_user_id(), list_id=list_id)
+        if version:
+            return conditional_response(version, lambda: render_list_page(store_id, list_id))
 
-    # Set List Items and Route data
-    list_items = {}
-    route_groups = {}
-    if list and list != "new":
+    return render_list_page(store_id, list_id, new)
 
-        # Retrieve List Items associated with List (query object)
-        list_items_q = session.query(ListItem).filter(ListItem.list_id == list.id)
 
-        # If List has associated Route
-        if list.route_id:
+def render_list_page(store_id=None, list_id=None, new=False):
+    """ Render Lists template lists.html """
+    # Load page data in a fixed number of queries
+    page = ListPageData(current_user_id(),
+                        store_id=store_id,
+                        list_id=list_id,
+                        new=new).build()
 
-            # Retrieve related Route Groups for form input selection and List Item ordering (query object)
-            route_groups_q = session.query(RouteGroup).filter(RouteGroup.route_id == list.route_id) \
-                .order_by(RouteGroup.route_order)
+    # If no Stores, then redirect to Stores page
+    if not page.stores:
+        flash("You do not have any stores setup. Please setup a store first.", "warning")
+        return redirect(url_for("store_get"))
 
-            # Retrieve related List Items with route group order
-            list_items_sq = list_items_q.subquery()
-            route_groups_sq = route_groups_q.subquery()
-            list_items_q = session.query(list_items_sq) \
-                .outerjoin(route_groups_sq, list_items_sq.c.item_group_id == route_groups_sq.c.item_group_id) \
-                .order_by(route_groups_sq.c.route_order)
+    return render_template("lists.html", view="list", **page.template_context())
 
-            # Return Route Group rows for template
-            route_groups = route_groups_q.all()
 
-        # Return List Item rows for template
-        list_items = list_items_q.all()
+@app.route("/stores/<int:store_id>/lists/sidebar", methods=["GET"])
+@login_required
+def list_sidebar_get(store_id):
+    """ Retrieve next page of Lists sidebar (infinite scroll)
 
-    # Set Item Measurements for form input selection
-    item_measurements = session.query(ItemMeasurements).order_by(ItemMeasurements.id).all()
+    Query parameters:
+        after (str): Cursor of the last List shown
+        list (int): List shown on the page, highlighted when on this page
 
-    return render_template("lists.html", view="list",
-                           stores=stores, store=store,
-                           routes=routes,
-                           lists=lists, list=list,
-                           list_items=list_items,
-                           route_groups=route_groups,
-                           item_measurements=item_measurements)
+    Return:
+        Lists sidebar fragment list_sidebar.html
+    """
+    try:
+        page = load_lists_page(current_user_id(), store_id, after=request.args.get("after"))
+    except ValueError:
+        abort(400)
+    return render_template("list_sidebar.html", store_id=store_id, list=None,
+                           active_list_id=request.args.get("list", type=int),
+                           lists=page.lists, next_cursor=page.next_cursor)
 
 
 @app.route("/stores/<int:store_id>/lists/new", methods=["POST"])
@@ -604,7 +654,7 @@ def list_add(store_id):
     data = request.form
 
     # Create new List
-    list = List(user_id=current_user.get_id(),
+    list = List(user_id=current_user_id(),
                 store_id=store_id)
 
     session.add(list)
@@ -670,6 +720,37 @@ def list_update(store_id, list_id, list_item_id=None):
                             list_id=list.id))
 
 
+@app.route("/stores/<int:store_id>/lists/<list_id>/listitems/import", methods=["POST"])
+@login_required
+def list_item_import(store_id, list_id):
+    """ Add List Items from pasted text, one item per line
+
+    Example line:
+        2 lbs flank steak, organic
+
+    Return:
+        Redirect to List page
+    """
+    # Set List record for current User
+    list = session.query(List).filter(List.id == list_id,
+                                      List.user_id == current_user_id()).first()
+
+    # Test whether List exists
+    if not list:
+        flash("Could not find list with id {}".format(list_id), "danger")
+        return redirect(url_for("list_get"))
+
+    items = parse_item_lines(request.form.get("items-import", ""))
+    classifier.assign_groups(items, list.user_id, route_item_group_ids(session, list.id))
+    ListItem.insert_many(list.id, items)
+    learn_on_commit(items)
+    learn_names_on_commit(items)
+    session.commit()
+
+    flash("Successfully added {} list items".format(len(items)), "success")
+    return redirect(url_for("list_get", store_id=list.store_id, list_id=list.id))
+
+
 @app.route("/stores/<int:store_id>/lists/<list_id>/delete", methods=["POST", "DELETE"])
 @login_required
 def list_delete(store_id, list_id):
@@ -696,12 +777,25 @@ def list_delete(store_id, list_id):
 
 @app.route("/stores/<int:store_id>/lists/<list_id>/print", methods=["GET"])
 @login_required
+@query_budget(10)
 def list_print_get(store_id, list_id):
     """ Retrieve viewable/printable List
 
     Return:
         list_print.html template
     """
+    # Answer conditional GET from List/Route/Store versions,
+    # serve rendered page from cache keyed by the same versions
+    version = print_version(store_id, list_id)
+    if version:
+        return conditional_response(version, lambda: cache.print_pages.get_or_render(
+            version.tag, lambda: render_list_print(store_id, list_id)))
+
+    return render_list_print(store_id, list_id)
+
+
+def render_list_print(store_id, list_id):
+    """ Render printable List template list_print.html """
     # Set Store object using provided id
     store = session.query(Store).get(store_id)
 
@@ -738,4 +832,21 @@ def list_print_get(store_id, list_id):
     return render_template("list_print.html", view="list",
                            store=store,
                            list=list,
-                           list_items=list_items)
\ No newline at end of file
+                           list_items=list_items)
+
+
+@app.route("/export/lists.<export_format>", methods=["GET"])
+@login_required
+def lists_export(export_format):
+    """ Download all Lists and List Items of current User
+
+    Streamed as rows are read, in constant memory
+
+    Return:
+        CSV (lists.csv) or JSON Lines (lists.jsonl) attachment
+    """
+    if export_format not in export.FORMATS:
+        abort(404)
+    lines, mimetype = export.FORMATS[export_format]
+    return Response(stream_with_context(lines(current_user_id())), mimetype=mimetype,
+                    headers={"Content-Disposition": "attachment; filename=lists.{}".format(export_format)})
@@ -0,0 +1,42 @@
+""" Worker Warm-up
+
+Load and compile everything a first request needs before serving traffic.
+    With gunicorn preload_app this runs once in the master and workers share
+    the result copy-on-write. The engine pool is emptied before forking and
+    replaced in each worker, so no database connection is shared across processes.
+"""
+
+from . import app
+from . import cache
+from .classifier import classifier
+from .database import engine, session
+from .metrics import registry
+
+
+def warm_up():
+    """ Compile all templates and load reference data and indexes """
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+    with app.app_context():
+        for reference_cache in cache.reference_caches.values():
+            reference_cache.all()
+        classifier.global_index()
+        session.remove()
+
+    # Close connections opened while warming up, before any fork
+    engine.dispose()
+
+
+def after_fork():
+    """ Give the worker its own connection pool and metrics
+
+    Metrics recorded in the master (warm-up) would otherwise be reported again
+        by every worker. Pre-open DB_POOL_PREWARM connections so the first
+        requests do not connect.
+    """
+    registry.reset()
+    engine.dispose()
+    connections = [engine.connect() for _ in range(app.config["SQLALCHEMY_POOL_PREWARM"])]
+    for connection in connections:
+        connection.close()
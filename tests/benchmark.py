@@ -0,0 +1,144 @@
+""" View Benchmarks
+
+Drive list_get, route_get, list_print_get and update_from_form (list_update)
+    through the Flask test client against generated data (generate_data.py)
+    and record latency percentiles and query counts to JSON for comparison across commits.
+    list_print_get is measured cold (print page cache cleared) and warm (repeated request).
+"""
+
+import json
+import math
+import time
+import random
+import datetime
+import subprocess
+
+from sqlalchemy import select
+
+from shopping_list import app
+from shopping_list import cache
+from shopping_list.database import engine
+from shopping_list.instrumentation import collect
+from shopping_list.models import *
+
+
+def percentile(values, pct):
+    """ Nearest rank percentile of sorted values """
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[rank]
+
+
+def summarize(latencies, db_times, queries, statuses):
+    """ Latency and database time (ms) percentiles, query counts and status codes for one scenario """
+    latencies = sorted(latencies)
+    db_times = sorted(db_times)
+    queries = sorted(queries)
+    return {"requests": len(latencies),
+            "status": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+            "latency_ms": {"min": round(latencies[0], 3),
+                           "p50": round(percentile(latencies, 50), 3),
+                           "p90": round(percentile(latencies, 90), 3),
+                           "p95": round(percentile(latencies, 95), 3),
+                           "p99": round(percentile(latencies, 99), 3),
+                           "max": round(latencies[-1], 3),
+                           "mean": round(sum(latencies) / len(latencies), 3)},
+            "db_ms": {"p50": round(percentile(db_times, 50), 3),
+                      "p99": round(percentile(db_times, 99), 3),
+                      "mean": round(sum(db_times) / len(db_times), 3)},
+            "queries": {"min": queries[0],
+                        "p50": percentile(queries, 50),
+                        "max": queries[-1],
+                        "mean": round(sum(queries) / float(len(queries)), 2)}}
+
+
+def sample_lists(count, seed):
+    """ Random sample of generated Lists with their User, Store and Route ids """
+    table = List.__table__
+    rows = engine.execute(select([table.c.id, table.c.user_id, table.c.store_id, table.c.route_id])
+                          .where(table.c.route_id.isnot(None))
+                          .order_by(table.c.id)).fetchall()
+    if not rows:
+        raise RuntimeError("Generate data first: manage.py generate_data")
+    return random.Random(seed).sample(rows, min(count, len(rows)))
+
+
+def list_form(list_id, iteration):
+    """ list_update form data for all List Items, with changed quantities """
+    table = ListItem.__table__
+    items = engine.execute(select([table.c.id, table.c.item_name, table.c.item_notes])
+                           .where(table.c.list_id == list_id)).fetchall()
+    data = {"List.{}.name".format(list_id): "Benchmark {}".format(iteration)}
+    for item_id, item_name, item_notes in items:
+        data["ListItem.{}.item_name".format(item_id)] = item_name
+        data["ListItem.{}.item_notes".format(item_id)] = item_notes or ""
+        data["ListItem.{}.item_quantity".format(item_id)] = str(iteration % 5 + 1)
+    return data
+
+
+def scenarios(row, iteration):
+    """ Request method, url, form data and unmeasured setup function per view for one sampled List """
+    list_id, user_id, store_id, route_id = row
+    print_url = "/stores/{}/lists/{}/print".format(store_id, list_id)
+    return [("list_get", "GET", "/stores/{}/lists/{}".format(store_id, list_id), None, None),
+            ("route_get", "GET", "/stores/{}/routes/{}".format(store_id, route_id), None, None),
+            ("list_print_get_cold", "GET", print_url, None, cache.print_pages.clear),
+            ("list_print_get_warm", "GET", print_url, None, None),
+            ("update_from_form", "POST", "/stores/{}/lists/{}".format(store_id, list_id),
+             list_form(list_id, iteration), None)]
+
+
+def run(iterations=200, lists=50, warmup=10, seed=1, output=None):
+    """ Run all view benchmarks
+
+    Requests rotate over the sampled Lists, each logged in as the List's User
+
+    Arguments:
+        iterations (int): Measured requests per view
+        lists (int): Lists sampled from the database
+        warmup (int): Unmeasured requests per view
+        seed (int): Random seed for List sample
+        output (str): JSON results file path, None to skip writing
+
+    Return:
+        Results dictionary
+    """
+    rows = sample_lists(lists, seed)
+    client = app.test_client()
+    measured = {}
+
+    for iteration in range(warmup + iterations):
+        row = rows[iteration % len(rows)]
+        with client.session_transaction() as http_session:
+            http_session["user_id"] = str(row[1])
+            http_session["_fresh"] = True
+
+        for name, method, url, data, setup in scenarios(row, iteration):
+            if setup:
+                setup()
+            with collect() as stats:
+                start = time.perf_counter()
+                response = client.open(url, method=method, data=data)
+                elapsed = (time.perf_counter() - start) * 1000
+            if iteration >= warmup:
+                latencies, db_times, queries, statuses = measured.setdefault(name, ([], [], [], []))
+                latencies.append(elapsed)
+                db_times.append(stats.duration * 1000)
+                queries.append(stats.count)
+                statuses.append(response.status_code)
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"]).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    results = {"commit": commit,
+               "timestamp": datetime.datetime.utcnow().isoformat(),
+               "parameters": {"iterations": iterations, "lists": len(rows), "warmup": warmup, "seed": seed},
+               "views": {name: summarize(*values) for name, values in sorted(measured.items())}}
+
+    if output:
+        with open(output, "w") as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+    return results
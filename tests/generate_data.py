@@ -0,0 +1,148 @@
+""" Generate Synthetic Data at Scale
+
+Reproducible (seeded) Users, Stores, Routes, Lists and List Items
+    with realistic item count distributions, for benchmarks.
+    Requires preloaded Item Groups, Item Measurements and default Route.
+"""
+
+import math
+import random
+import datetime
+
+from werkzeug.security import generate_password_hash
+
+from shopping_list.database import engine
+from shopping_list.models import *
+
+
+# Item names by Item Group name (preload_data.json)
+ITEM_NAMES = {
+    "vegetables": ["onion", "carrots", "broccoli", "spinach", "bell pepper", "zucchini", "garlic",
+                   "potatoes", "kale", "tomatoes", "celery", "cucumber", "mushrooms"],
+    "fruit": ["apples", "bananas", "lemons", "limes", "strawberries", "blueberries", "oranges",
+              "avocado", "grapes", "pears"],
+    "herbs": ["basil", "cilantro", "parsley", "mint", "rosemary", "thyme", "dill"],
+    "dairy/eggs": ["eggs", "milk", "butter", "yogurt", "cheddar cheese", "parmesan", "cream cheese",
+                   "sour cream", "heavy cream"],
+    "meat": ["flank steak", "chicken breast", "ground beef", "pork chops", "bacon", "salmon",
+             "chicken thighs", "sausage"],
+    "sundry": ["tomato sauce", "pasta", "rice", "olive oil", "peanut butter", "cereal", "coffee",
+               "canned beans", "chicken stock", "ketchup"],
+    "international": ["soy sauce", "tortillas", "salsa", "coconut milk", "curry paste", "rice noodles"],
+    "frozen": ["frozen peas", "ice cream", "frozen pizza", "frozen berries", "frozen corn"],
+    "bulk": ["almonds", "oats", "lentils", "quinoa", "walnuts"],
+    "baking": ["flour", "sugar", "baking soda", "yeast", "chocolate chips", "vanilla extract"],
+    "spices": ["cumin", "paprika", "black pepper", "cinnamon", "oregano", "chili powder"],
+    "prepared foods": ["hummus", "rotisserie chicken", "sushi", "potato salad"],
+    "gourmet": ["truffle oil", "prosciutto", "brie", "olives"],
+    "alcohol": ["red wine", "beer", "white wine"],
+    "paper/kitchen": ["paper towels", "aluminum foil", "trash bags", "napkins"],
+    "cleaning": ["dish soap", "laundry detergent", "sponges", "bleach"],
+    "toiletries": ["toothpaste", "shampoo", "soap", "toilet paper"],
+}
+
+NOTES = ["", "", "", "organic", "large", "low sodium", "store brand", "ripe", "whole"]
+
+# Rows per multi-row insert
+CHUNK_SIZE = 1000
+
+
+def item_count(rng):
+    """ Items per List: log-normal, median ~15, long tail capped at 120 """
+    return max(1, min(120, int(rng.lognormvariate(math.log(15), 0.6))))
+
+
+def insert_returning(connection, table, rows):
+    """ Multi-row insert in chunks, return new ids in row order """
+    ids = []
+    for i in range(0, len(rows), CHUNK_SIZE):
+        result = connection.execute(table.insert().values(rows[i:i + CHUNK_SIZE]).returning(table.c.id))
+        ids.extend(row[0] for row in result)
+    return ids
+
+
+def insert_many(connection, table, rows):
+    """ Executemany insert in chunks """
+    for i in range(0, len(rows), CHUNK_SIZE):
+        connection.execute(table.insert(), rows[i:i + CHUNK_SIZE])
+
+
+def generate(users=100, stores_per_user=2, weeks=52, seed=1):
+    """ Add synthetic Users and their Stores, Routes, Lists and List Items
+
+    Arguments:
+        users (int): Number of Users
+        stores_per_user (int): Maximum Stores per User
+        weeks (int): Weeks of weekly List history per User and Store
+        seed (int): Random seed, same seed generates same data
+
+    Return:
+        Dictionary of row counts by table name
+    """
+    rng = random.Random(seed)
+    counts = {}
+
+    with engine.begin() as connection:
+        item_groups = dict(connection.execute(select([ItemGroup.__table__.c.name, ItemGroup.__table__.c.id])).fetchall())
+        measurement_ids = [row[0] for row in connection.execute(select([ItemMeasurements.__table__.c.id]))]
+        default_route_id = connection.execute(select([Route.__table__.c.id])
+                                              .where(Route.__table__.c.default == True)).scalar()
+        default_groups = connection.execute(select([RouteGroup.__table__.c.item_group_id,
+                                                    RouteGroup.__table__.c.route_order])
+                                            .where(RouteGroup.__table__.c.route_id == default_route_id)).fetchall()
+        if not item_groups or default_route_id is None:
+            raise RuntimeError("Preload data first: manage.py preload_data")
+        vocabulary = [(name, item_groups[group]) for group, names in sorted(ITEM_NAMES.items())
+                      if group in item_groups for name in names]
+
+        # Users, sharing one password hash
+        password = generate_password_hash("bench")
+        user_ids = insert_returning(connection, User.__table__,
+                                    [{"name": "Bench {}".format(n), "email": "bench{}-{}@example.com".format(n, seed),
+                                      "password": password} for n in range(users)])
+
+        # Stores, one Route per User Store cloned from default Route
+        store_ids = insert_returning(connection, Store.__table__,
+                                     [{"name": "Bench Store {}".format(n), "city": "Springfield"}
+                                      for n in range(max(1, users * stores_per_user // 2))])
+        user_stores = sorted(set((user_id, rng.choice(store_ids))
+                                 for user_id in user_ids for _ in range(rng.randint(1, stores_per_user))))
+        insert_many(connection, UserStore.__table__,
+                    [{"user_id": user_id, "store_id": store_id, "nickname": "", "default": False}
+                     for user_id, store_id in user_stores])
+        route_ids = insert_returning(connection, Route.__table__,
+                                     [{"name": "Default Route", "default": False, "user_id": user_id}
+                                      for user_id, _ in user_stores])
+        insert_many(connection, route_store_table,
+                    [{"route_id": route_id, "store_id": store_id}
+                     for route_id, (_, store_id) in zip(route_ids, user_stores)])
+        insert_many(connection, RouteGroup.__table__,
+                    [{"route_id": route_id, "item_group_id": item_group_id, "route_order": route_order}
+                     for route_id in route_ids for item_group_id, route_order in default_groups])
+
+        # Weekly Lists, shoppers skip some weeks
+        today = datetime.date.today()
+        lists = [{"shop_date": today - datetime.timedelta(weeks=week), "name": "",
+                  "user_id": user_id, "store_id": store_id, "route_id": route_id}
+                 for route_id, (user_id, store_id) in zip(route_ids, user_stores)
+                 for week in range(weeks) if rng.random() < 0.7]
+        list_ids = insert_returning(connection, List.__table__, lists)
+
+        # List Items, each User favours a subset of the vocabulary
+        list_items = 0
+        favourites = {user_id: rng.sample(vocabulary, min(len(vocabulary), 60)) for user_id in user_ids}
+        for i in range(0, len(list_ids), CHUNK_SIZE):
+            rows = []
+            for list_id, list_values in zip(list_ids[i:i + CHUNK_SIZE], lists[i:i + CHUNK_SIZE]):
+                names = favourites[list_values["user_id"]]
+                for name, item_group_id in rng.sample(names, min(len(names), item_count(rng))):
+                    rows.append({"item_name": name, "item_notes": rng.choice(NOTES),
+                                 "item_quantity": rng.randint(1, 4), "list_id": list_id,
+                                 "item_measurement_id": rng.choice(measurement_ids) if measurement_ids else None,
+                                 "item_group_id": item_group_id})
+            insert_many(connection, ListItem.__table__, rows)
+            list_items += len(rows)
+
+    counts.update(user=len(user_ids), store=len(store_ids), user_store=len(user_stores),
+                  route=len(route_ids), list=len(list_ids), list_item=list_items)
+    return counts
@@ -0,0 +1,185 @@
+""" API Unit Tests """
+
+import os
+import json
+import unittest
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from shopping_list import app
+from shopping_list import cache
+from shopping_list.api import fold_changes
+from shopping_list.database import Base, engine, session
+from shopping_list.models import *
+
+
+class TestFoldChanges(unittest.TestCase):
+    """ Change log fold for delta sync
+
+    Cases: changes as (id, entity, entity_id, operation), expected cursor,
+        List changed flag and List Item operations
+    """
+
+    cases = [
+        # No changes keep the cursor
+        ([], 7, False, {}),
+        ([(8, "ListItem", 1, "insert")], 8, False, {1: "insert"}),
+        ([(8, "ListItem", 1, "update")], 8, False, {1: "update"}),
+        ([(8, "ListItem", 1, "delete")], 8, False, {1: "delete"}),
+        # Updates after an insert stay an insert
+        ([(8, "ListItem", 1, "insert"), (9, "ListItem", 1, "update"), (10, "ListItem", 1, "update")],
+         10, False, {1: "insert"}),
+        # Delete after an insert cancels both
+        ([(8, "ListItem", 1, "insert"), (9, "ListItem", 1, "update"), (10, "ListItem", 1, "delete")],
+         10, False, {}),
+        # Delete after an update is a delete
+        ([(8, "ListItem", 1, "update"), (9, "ListItem", 1, "delete")], 9, False, {1: "delete"}),
+        # List changes only set the flag
+        ([(8, "List", 3, "update"), (9, "ListItem", 2, "insert")], 9, True, {2: "insert"}),
+        ([(8, "List", 3, "update")], 8, True, {}),
+        # Items fold independently
+        ([(8, "ListItem", 1, "insert"), (9, "ListItem", 2, "update"), (10, "ListItem", 1, "delete"),
+          (11, "ListItem", 3, "insert"), (12, "ListItem", 2, "update")],
+         12, False, {2: "update", 3: "insert"}),
+    ]
+
+    def test_fold(self):
+        for changes, cursor, list_changed, operations in self.cases:
+            result = fold_changes(changes, since=7)
+            self.assertEqual(result[0], cursor, changes)
+            self.assertEqual(result[1], list_changed, changes)
+            self.assertEqual(dict(result[2]), operations, changes)
+
+    def test_operations_in_first_change_order(self):
+        _, _, operations = fold_changes([(1, "ListItem", 5, "update"), (2, "ListItem", 3, "insert"),
+                                         (3, "ListItem", 5, "update")])
+        self.assertEqual(list(operations), [5, 3])
+
+
+class TestResourceAccess(unittest.TestCase):
+    """ Ownership (404) and reference validation (400) of Store, Route, List and List Item resources
+
+    Current User owns a Store, Route, List and List Item; another User owns a second set
+    """
+
+    def setUp(self):
+        self.client = app.test_client()
+        Base.metadata.create_all(engine)
+
+        self.user = User(name="Owner", email="owner@example.com")
+        self.other_user = User(name="Other", email="other@example.com")
+        self.store = Store(name="Corner Market")
+        self.other_store = Store(name="Other Market")
+        self.item_group = ItemGroup(name="Produce")
+        self.item_measurement = ItemMeasurements(name="pounds", abbreviation="lbs")
+        session.add_all([self.user, self.other_user, self.store, self.other_store,
+                         self.item_group, self.item_measurement])
+        session.flush()
+
+        self.route = Route(name="Full Shop", user_id=self.user.id, store=[self.store])
+        self.other_route = Route(name="Full Shop", user_id=self.other_user.id, store=[self.other_store])
+        session.add_all([UserStore(user_id=self.user.id, store_id=self.store.id),
+                         UserStore(user_id=self.other_user.id, store_id=self.other_store.id),
+                         self.route, self.other_route])
+        session.flush()
+
+        self.list = List(user_id=self.user.id, store_id=self.store.id, route_id=self.route.id)
+        self.other_list = List(user_id=self.other_user.id, store_id=self.other_store.id,
+                               route_id=self.other_route.id)
+        session.add_all([self.list, self.other_list])
+        session.flush()
+
+        self.list_item = ListItem(item_name="Apples", list_id=self.list.id)
+        self.other_list_item = ListItem(item_name="Pears", list_id=self.other_list.id)
+        session.add_all([self.list_item, self.other_list_item])
+        session.commit()
+        cache.invalidate_all()
+
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.user.id)
+            http_session["_fresh"] = True
+
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+    def request(self, method, url, data=None):
+        """ JSON request, return status code and decoded body """
+        response = self.client.open(url, method=method, headers={"Accept": "application/json"},
+                                    data=json.dumps(data) if data is not None else None,
+                                    content_type="application/json")
+        return response.status_code, json.loads(response.data.decode("utf-8"))
+
+    def test_other_users_resources_not_found(self):
+        for method, url, data in [
+                ("GET", "/api/v1/stores/{}".format(self.other_store.id), None),
+                ("PUT", "/api/v1/stores/{}".format(self.other_store.id), {"name": "Mine"}),
+                ("DELETE", "/api/v1/stores/{}".format(self.other_store.id), None),
+                ("POST", "/api/v1/stores/{}/routes".format(self.other_store.id), {"name": "Mine"}),
+                ("GET", "/api/v1/routes/{}".format(self.other_route.id), None),
+                ("PUT", "/api/v1/routes/{}".format(self.other_route.id), {"name": "Mine"}),
+                ("DELETE", "/api/v1/routes/{}".format(self.other_route.id), None),
+                ("POST", "/api/v1/stores/{}/lists".format(self.other_store.id), {"name": "Mine"}),
+                ("GET", "/api/v1/lists/{}".format(self.other_list.id), None),
+                ("PUT", "/api/v1/lists/{}".format(self.other_list.id), {"name": "Mine"}),
+                ("DELETE", "/api/v1/lists/{}".format(self.other_list.id), None),
+                ("POST", "/api/v1/lists/{}/items".format(self.other_list.id), {"item_name": "Mine"}),
+                # Other User's List Item through own List
+                ("PUT", "/api/v1/lists/{}/items/{}".format(self.list.id, self.other_list_item.id),
+                 {"item_name": "Mine"}),
+                ("DELETE", "/api/v1/lists/{}/items/{}".format(self.list.id, self.other_list_item.id), None)]:
+            status, body = self.request(method, url, data)
+            self.assertEqual(status, 404, (method, url))
+            self.assertIn("Could not find", body["message"], (method, url))
+
+        session.expire_all()
+        self.assertEqual(session.query(Store).get(self.other_store.id).name, "Other Market")
+        self.assertEqual(session.query(List).get(self.other_list.id).name, "")
+        self.assertEqual(session.query(ListItem).get(self.other_list_item.id).item_name, "Pears")
+        self.assertEqual(session.query(UserStore).filter_by(store_id=self.other_store.id).count(), 1)
+
+    def test_invalid_references_rejected(self):
+        unknown = 9999
+        for method, url, data in [
+                ("POST", "/api/v1/stores/{}/lists".format(self.store.id), {"route_id": self.other_route.id}),
+                ("PUT", "/api/v1/lists/{}".format(self.list.id), {"route_id": self.other_route.id}),
+                ("PUT", "/api/v1/lists/{}".format(self.list.id), {"route_id": unknown}),
+                ("POST", "/api/v1/routes/{}/routegroups".format(self.route.id), {"item_group_id": unknown}),
+                ("POST", "/api/v1/lists/{}/items".format(self.list.id), {"item_group_id": unknown}),
+                ("PUT", "/api/v1/lists/{}/items/{}".format(self.list.id, self.list_item.id),
+                 {"item_measurement_id": unknown})]:
+            status, body = self.request(method, url, data)
+            self.assertEqual(status, 400, (method, url, data))
+            self.assertIn("Invalid", body["message"], (method, url, data))
+
+        session.expire_all()
+        self.assertEqual(session.query(List).get(self.list.id).route_id, self.route.id)
+        self.assertIsNone(session.query(ListItem).get(self.list_item.id).item_measurement_id)
+        self.assertEqual(session.query(List).filter_by(user_id=self.user.id).count(), 1)
+
+    def test_invalid_values_rejected(self):
+        for method, url, data in [
+                ("PUT", "/api/v1/lists/{}".format(self.list.id), {"shop_date": "tomorrow"}),
+                ("PUT", "/api/v1/lists/{}/items/{}".format(self.list.id, self.list_item.id),
+                 {"item_quantity": "a few"}),
+                ("PUT", "/api/v1/stores/{}".format(self.store.id), ["name"])]:
+            status, _ = self.request(method, url, data)
+            self.assertEqual(status, 422, (method, url, data))
+
+    def test_valid_references_accepted(self):
+        status, body = self.request("PUT", "/api/v1/lists/{}/items/{}".format(self.list.id, self.list_item.id),
+                                    {"item_group_id": self.item_group.id,
+                                     "item_measurement_id": self.item_measurement.id})
+        self.assertEqual(status, 200)
+        self.assertEqual((body["item_group_id"], body["item_measurement_id"]),
+                         (self.item_group.id, self.item_measurement.id))
+
+        status, body = self.request("POST", "/api/v1/stores/{}/lists".format(self.store.id),
+                                    {"route_id": self.route.id, "name": "Weekly"})
+        self.assertEqual(status, 201)
+        self.assertEqual(body["route_id"], self.route.id)
+
+
+if __name__ == "__main__":
+    unittest.main()
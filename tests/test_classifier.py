@@ -0,0 +1,77 @@
+""" Item Group Classifier Unit Tests """
+
+import os
+import unittest
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from shopping_list.classifier import tokenize, GroupIndex, ItemClassifier
+
+
+VEGETABLES, FRUITS, BAKERY = 1, 2, 3
+
+
+class TestTokenize(unittest.TestCase):
+
+    def test_singular_and_plural_match(self):
+        for singular, plural in [("apple", "apples"), ("tomato", "tomatoes"), ("berry", "berries"),
+                                 ("grape", "grapes"), ("peach", "peaches"), ("box", "boxes")]:
+            self.assertEqual(tokenize(singular), tokenize(plural), plural)
+
+    def test_words_ending_in_s_kept(self):
+        self.assertEqual(tokenize("Hummus"), ["hummus"])
+        self.assertEqual(tokenize("Glass Jar"), ["glass", "jar"])
+
+    def test_lowercase_alphanumeric_tokens(self):
+        self.assertEqual(tokenize("Roma Tomatoes, 2-pack"), ["roma", "tomato", "2", "pack"])
+
+
+class TestItemClassifier(unittest.TestCase):
+    """ Classification from a global index filled through learn (no database) """
+
+    def setUp(self):
+        self.classifier = ItemClassifier(max_users=10, max_global_names=100)
+        # Loaded global index, so classify never queries
+        self.classifier._global = GroupIndex(100)
+        for name, item_group_id in [("Apples", FRUITS), ("Apples", FRUITS), ("Roma Tomatoes", VEGETABLES),
+                                    ("Apple Pie", BAKERY)]:
+            self.classifier.learn(name, item_group_id)
+
+    def test_exact_name_across_plural(self):
+        self.assertEqual(self.classifier.classify("apple"), FRUITS)
+        self.assertEqual(self.classifier.classify("Roma Tomato"), VEGETABLES)
+
+    def test_token_match(self):
+        self.assertEqual(self.classifier.classify("cherry tomatoes"), VEGETABLES)
+
+    def test_unknown_name(self):
+        self.assertIsNone(self.classifier.classify("paper towels"))
+        self.assertIsNone(self.classifier.classify(""))
+
+    def test_limited_to_route_item_groups(self):
+        # Best group not on the List's Route: next best on the Route, or none
+        self.assertEqual(self.classifier.classify("apple", item_group_ids={BAKERY, VEGETABLES}), BAKERY)
+        self.assertIsNone(self.classifier.classify("apple", item_group_ids={VEGETABLES}))
+        self.assertIsNone(self.classifier.classify("apple", item_group_ids=set()))
+
+    def test_learn_changes_classification(self):
+        for _ in range(3):
+            self.classifier.learn("apple", BAKERY)
+        self.assertEqual(self.classifier.classify("apples"), BAKERY)
+
+    def test_assign_groups_keeps_given_group(self):
+        items = [{"item_name": "apples", "item_group_id": None},
+                 {"item_name": "apples", "item_group_id": VEGETABLES}]
+        self.classifier.assign_groups(items, item_group_ids={FRUITS, VEGETABLES})
+        self.assertEqual([item["item_group_id"] for item in items], [FRUITS, VEGETABLES])
+
+    def test_global_index_capped(self):
+        index = GroupIndex(max_names=2)
+        for name in ["milk", "eggs", "bread"]:
+            index.add(name, FRUITS)
+        self.assertEqual(sorted(index.names), ["egg", "milk"])
+
+
+if __name__ == "__main__":
+    unittest.main()
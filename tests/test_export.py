@@ -0,0 +1,84 @@
+""" List History Export Integration Tests """
+
+import os
+import datetime
+import unittest
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from shopping_list.database import Base, engine, session
+from shopping_list.export import export_query
+from shopping_list.models import *
+
+
+class TestExportQuery(unittest.TestCase):
+    """ Export row order: shop date, List, Route order, List Item
+
+    List Items without a Route Group on the List's Route follow the routed items, by id
+    """
+
+    def setUp(self):
+        Base.metadata.create_all(engine)
+
+        self.user = User(name="Owner", email="owner@example.com")
+        other_user = User(name="Other", email="other@example.com")
+        store = Store(name="Corner Market")
+        produce, bakery, dairy = [ItemGroup(name=name) for name in ("Produce", "Bakery", "Dairy")]
+        session.add_all([self.user, other_user, store, produce, bakery, dairy])
+        session.flush()
+
+        # Bakery before Produce, Dairy not on the Route
+        route = Route(name="Full Shop", user_id=self.user.id, store=[store])
+        session.add(route)
+        session.flush()
+        session.add_all([RouteGroup(route_id=route.id, item_group_id=produce.id, route_order=20),
+                         RouteGroup(route_id=route.id, item_group_id=bakery.id, route_order=10)])
+
+        # Later List created first
+        self.later = List(user_id=self.user.id, store_id=store.id, route_id=route.id,
+                          shop_date=datetime.date(2015, 3, 8), name="Later")
+        self.earlier = List(user_id=self.user.id, store_id=store.id, route_id=route.id,
+                            shop_date=datetime.date(2015, 3, 1), name="Earlier")
+        self.no_route = List(user_id=self.user.id, store_id=store.id,
+                             shop_date=datetime.date(2015, 3, 1), name="No Route")
+        other_list = List(user_id=other_user.id, store_id=store.id, shop_date=datetime.date(2015, 3, 1))
+        session.add_all([self.later, self.earlier, self.no_route, other_list])
+        session.flush()
+
+        for list, items in [(self.later, [("Apples", produce), ("Milk", dairy), ("Bread", bakery)]),
+                            (self.earlier, [("Ungrouped", None), ("Pears", produce), ("Cheese", dairy),
+                                            ("Rolls", bakery)]),
+                            (self.no_route, [("Butter", dairy), ("Bagels", bakery)]),
+                            (other_list, [("Not mine", produce)])]:
+            for item_name, item_group in items:
+                session.add(ListItem(list_id=list.id, item_name=item_name,
+                                     item_group_id=item_group.id if item_group else None))
+                session.flush()
+        session.commit()
+
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+    def exported(self):
+        """ (List name, item name) in export order """
+        return [(row[2], row[5]) for row in engine.execute(export_query(self.user.id))]
+
+    def test_order(self):
+        # Same shop date: Lists by id
+        self.assertEqual(self.exported(), [
+            ("Earlier", "Rolls"), ("Earlier", "Pears"), ("Earlier", "Ungrouped"), ("Earlier", "Cheese"),
+            ("No Route", "Butter"), ("No Route", "Bagels"),
+            ("Later", "Bread"), ("Later", "Apples"), ("Later", "Milk")])
+
+    def test_names(self):
+        rows = engine.execute(export_query(self.user.id)).fetchall()
+        by_item = {row[5]: row for row in rows}
+        self.assertEqual((by_item["Rolls"][3], by_item["Rolls"][9]), ("Corner Market", "Bakery"))
+        self.assertIsNone(by_item["Ungrouped"][9])
+        self.assertEqual(len(rows), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
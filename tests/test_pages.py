@@ -0,0 +1,89 @@
+""" Page Data Integration Tests """
+
+import os
+import re
+import datetime
+import unittest
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from shopping_list import app
+from shopping_list.database import Base, engine, session
+from shopping_list.models import *
+from shopping_list.pages import load_lists_page, encode_cursor, decode_cursor
+
+
+class TestListsPage(unittest.TestCase):
+    """ Lists sidebar keyset pages: shop date descending, id ascending within a date """
+
+    # Shop dates in creation (id) order, ties spanning page edges at every page size below
+    shop_dates = [datetime.date(2015, 3, day) for day in (8, 1, 8, 8, 15, 1, 8, 1)]
+
+    def setUp(self):
+        self.client = app.test_client()
+        Base.metadata.create_all(engine)
+        self.user = User(name="Owner", email="owner@example.com")
+        other_user = User(name="Other", email="other@example.com")
+        self.store = Store(name="Corner Market")
+        session.add_all([self.user, other_user, self.store])
+        session.flush()
+        session.add(UserStore(user_id=self.user.id, store_id=self.store.id))
+        self.lists = []
+        for shop_date in self.shop_dates:
+            list = List(user_id=self.user.id, store_id=self.store.id, shop_date=shop_date)
+            session.add(list)
+            session.flush()
+            self.lists.append(list)
+        # Other User's List on a shared date
+        session.add(List(user_id=other_user.id, store_id=self.store.id, shop_date=datetime.date(2015, 3, 8)))
+        session.commit()
+        self.expected = [list.id for list in sorted(self.lists, key=lambda list: (-list.shop_date.toordinal(),
+                                                                                  list.id))]
+
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+    def pages(self, limit):
+        """ List ids per page following cursors """
+        pages, cursor = [], None
+        while True:
+            page = load_lists_page(self.user.id, self.store.id, after=cursor, limit=limit)
+            pages.append([list.id for list in page.lists])
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_pages_across_shop_date_ties(self):
+        for limit in range(1, len(self.lists) + 2):
+            pages = self.pages(limit)
+            self.assertEqual(sum(pages, []), self.expected, limit)
+            self.assertTrue(all(len(page) == limit for page in pages[:-1]), limit)
+
+    def test_cursor_is_last_list_of_page(self):
+        page = load_lists_page(self.user.id, self.store.id, limit=3)
+        self.assertEqual(page.next_cursor, encode_cursor(page.lists[-1]))
+        self.assertEqual(decode_cursor(page.next_cursor), (page.lists[-1].shop_date, page.lists[-1].id))
+
+    def test_malformed_cursor(self):
+        for cursor in ["2015-03-08", "2015-03-08.x", "yesterday.4", "2015-03-08.4.1"]:
+            self.assertRaises(ValueError, load_lists_page, self.user.id, self.store.id, after=cursor)
+
+    def test_sidebar_page_keeps_active_list(self):
+        with self.client.session_transaction() as http_session:
+            http_session["user_id"] = str(self.user.id)
+            http_session["_fresh"] = True
+        first = load_lists_page(self.user.id, self.store.id, limit=app.config["LIST_PAGE_SIZE"])
+        active = self.expected[-1]
+        response = self.client.get("/stores/{}/lists/sidebar?after={}&list={}".format(
+            self.store.id, encode_cursor(first.lists[0]), active))
+        self.assertEqual(response.status_code, 200)
+        html = response.data.decode("utf-8")
+        self.assertTrue(re.search(r'class="list-group-item active"\s+href="/stores/{}/lists/{}"'.format(
+            self.store.id, active), html), html)
+        self.assertEqual(html.count(" active"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
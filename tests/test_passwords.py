@@ -0,0 +1,105 @@
+""" Password Hashing and Login Throttle Unit Tests """
+
+import os
+import unittest
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from shopping_list import app
+from shopping_list.passwords import Throttle, needs_rehash, allow_login_attempt, login_succeeded, \
+    account_throttle, ip_throttle
+
+
+class FakeClock(object):
+    """ Settable time for Throttle """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestThrottle(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.throttle = Throttle(limit=3, window=60, clock=self.clock)
+
+    def test_limit_per_key(self):
+        self.assertEqual([self.throttle.allow("a") for _ in range(4)], [True, True, True, False])
+        self.assertTrue(self.throttle.allow("b"))
+
+    def test_window_expiry(self):
+        for seconds in (0, 10, 20):
+            self.clock.now = 1000 + seconds
+            self.assertTrue(self.throttle.allow("a"))
+        self.clock.now = 1059
+        self.assertFalse(self.throttle.allow("a"))
+        # First attempt leaves the window, one attempt allowed
+        self.clock.now = 1060
+        self.assertTrue(self.throttle.allow("a"))
+        self.assertFalse(self.throttle.allow("a"))
+        # All attempts expired, key dropped
+        self.clock.now = 1200
+        self.assertTrue(self.throttle.allow("a"))
+        self.assertEqual(len(self.throttle._attempts["a"]), 1)
+
+    def test_denied_attempts_not_recorded(self):
+        for _ in range(10):
+            self.throttle.allow("a")
+        self.clock.now += 60
+        self.assertTrue(self.throttle.allow("a"))
+
+    def test_reset(self):
+        for _ in range(3):
+            self.throttle.allow("a")
+        self.throttle.reset("a")
+        self.assertTrue(self.throttle.allow("a"))
+
+
+class TestLoginAttempts(unittest.TestCase):
+    """ Account attempts are limited per client IP """
+
+    def setUp(self):
+        for throttle in (ip_throttle, account_throttle):
+            throttle._attempts.clear()
+
+    def test_other_client_not_locked_out(self):
+        for _ in range(app.config["LOGIN_ATTEMPTS_PER_ACCOUNT"]):
+            self.assertTrue(allow_login_attempt("10.0.0.1", "owner@example.com"))
+        self.assertFalse(allow_login_attempt("10.0.0.1", " Owner@Example.com"))
+        self.assertTrue(allow_login_attempt("10.0.0.2", "owner@example.com"))
+
+    def test_success_clears_client_account_attempts(self):
+        for _ in range(app.config["LOGIN_ATTEMPTS_PER_ACCOUNT"]):
+            allow_login_attempt("10.0.0.1", "owner@example.com")
+        login_succeeded("10.0.0.1", "owner@example.com")
+        self.assertTrue(allow_login_attempt("10.0.0.1", "owner@example.com"))
+
+
+class TestNeedsRehash(unittest.TestCase):
+    """ Stored hash method compared with PASSWORD_HASH_METHOD """
+
+    def setUp(self):
+        self.method = app.config["PASSWORD_HASH_METHOD"]
+        self.algorithm, self.hash_name, self.iterations = self.method.split(":")
+
+    def test_current_method(self):
+        self.assertFalse(needs_rehash("{}$salt$hash".format(self.method)))
+
+    def test_outdated_method(self):
+        for method in ["pbkdf2:{}:{}".format(self.hash_name, int(self.iterations) - 1),
+                       "pbkdf2:md5:{}".format(self.iterations),
+                       "pbkdf2:{}".format(self.hash_name),
+                       "sha1"]:
+            self.assertTrue(needs_rehash("{}$salt$hash".format(method)), method)
+
+    def test_missing_or_unsalted(self):
+        for password_hash in [None, "", "plaintext"]:
+            self.assertTrue(needs_rehash(password_hash), password_hash)
+
+
+if __name__ == "__main__":
+    unittest.main()
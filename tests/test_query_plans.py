@@ -0,0 +1,236 @@
+""" Query Plan Regression Tests
+
+Seed the testing database with generated data (generate_data.py), run the registered
+    named queries (hot views) through the test client, capture every SELECT they issue
+    and EXPLAIN it. Fails when a plan sequentially scans a large table, when a statement's
+    estimated cost exceeds its baseline in query_plan_baseline.json by more than the
+    tolerance, or when a query's statements no longer match its baseline. Queries
+    without a recorded baseline skip the cost comparison after the sequential scan check.
+
+PostgreSQL only. Environment:
+    QUERY_PLAN_USERS: Generated Users (default 200)
+    UPDATE_QUERY_PLAN_BASELINE=1: Write current costs as the new baseline
+"""
+
+import os
+import json
+import unittest
+from collections import OrderedDict
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from sqlalchemy import event, text
+
+from shopping_list import app
+from shopping_list import cache
+from shopping_list import loader
+from shopping_list import models
+from shopping_list.database import Base, engine, session
+from shopping_list.instrumentation import fingerprint
+from tests import generate_data
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "query_plan_baseline.json")
+PRELOAD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                            "shopping_list", "preload_data.json")
+
+# Tables smaller than this may be scanned sequentially
+SEQ_SCAN_MIN_ROWS = 1000
+
+# Named queries: name: function(client, sample) issuing the query's requests
+QUERIES = OrderedDict()
+
+
+def query(name):
+    """ Register named query """
+    def decorator(func):
+        QUERIES[name] = func
+        return func
+    return decorator
+
+
+@query("list_get")
+def list_get(client, sample):
+    return client.get("/stores/{store_id}/lists/{list_id}".format(**sample))
+
+
+@query("list_get_sidebar_page")
+def list_get_sidebar_page(client, sample):
+    return client.get("/stores/{store_id}/lists/sidebar?after={cursor}".format(**sample))
+
+
+@query("route_get")
+def route_get(client, sample):
+    return client.get("/stores/{store_id}/routes/{route_id}".format(**sample))
+
+
+@query("route_get_store_default")
+def route_get_store_default(client, sample):
+    return client.get("/stores/{store_id}/routes".format(**sample))
+
+
+@query("list_print_get")
+def list_print_get(client, sample):
+    return client.get("/stores/{store_id}/lists/{list_id}/print".format(**sample))
+
+
+@query("item_name_suggest")
+def item_name_suggest(client, sample):
+    return client.get("/api/v1/suggest?q=to", headers={"Accept": "application/json"})
+
+
+class StatementCapture(object):
+    """ Collect SELECT statements and parameters executed on the engine while active """
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, "before_cursor_execute", self)
+
+
+def plan_nodes(plan):
+    """ All nodes of an EXPLAIN (FORMAT JSON) plan tree """
+    yield plan
+    for child in plan.get("Plans", ()):
+        for node in plan_nodes(child):
+            yield node
+
+
+def explain(statement, parameters):
+    """ Top plan node of statement """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        result = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        connection.close()
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Plan"]
+
+
+def seed():
+    """ Reset testing database with reference and generated data """
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with open(PRELOAD_PATH) as data_file:
+        data = json.load(data_file)
+    for model_name, values_list in sorted(data.items()):
+        loader.BulkLoader(getattr(models, model_name)).load(values_list)
+    cache.invalidate_all()
+    generate_data.generate(users=int(os.environ.get("QUERY_PLAN_USERS", 200)), weeks=104, seed=1)
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+
+
+def sample_params():
+    """ Store, List and Route of the User with the most Lists, newest List first """
+    row = engine.execute(text(
+        "SELECT user_id, store_id FROM list GROUP BY user_id, store_id "
+        "ORDER BY count(*) DESC, user_id, store_id LIMIT 1")).first()
+    lists = engine.execute(text(
+        "SELECT id, shop_date, route_id FROM list WHERE user_id = :user_id AND store_id = :store_id "
+        "ORDER BY shop_date DESC, id LIMIT 2"), user_id=row[0], store_id=row[1]).fetchall()
+    return {"user_id": row[0], "store_id": row[1], "list_id": lists[0][0], "route_id": lists[0][2],
+            "cursor": "{}.{}".format(lists[0][1].isoformat(), lists[0][0])}
+
+
+@unittest.skipUnless(engine.dialect.name == "postgresql", "EXPLAIN (FORMAT JSON) requires PostgreSQL")
+class TestQueryPlans(unittest.TestCase):
+    """ Query plan regression tests for registered named queries """
+
+    @classmethod
+    def setUpClass(cls):
+        seed()
+        cls.sample = sample_params()
+        cls.client = app.test_client()
+        with cls.client.session_transaction() as http_session:
+            http_session["user_id"] = str(cls.sample["user_id"])
+            http_session["_fresh"] = True
+
+        cls.row_counts = {row[0]: row[1] for row in engine.execute(text(
+            "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'"))}
+
+        try:
+            with open(BASELINE_PATH) as baseline_file:
+                cls.baseline = json.load(baseline_file)
+        except (OSError, ValueError):
+            cls.baseline = {}
+        cls.baseline.setdefault("tolerance", 0.25)
+        cls.baseline.setdefault("queries", {})
+        cls.current = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        session.close()
+        if os.environ.get("UPDATE_QUERY_PLAN_BASELINE") == "1":
+            cls.baseline["queries"].update(cls.current)
+            with open(BASELINE_PATH, "w") as baseline_file:
+                json.dump(cls.baseline, baseline_file, indent=2, sort_keys=True)
+                baseline_file.write("\n")
+
+    def check_query(self, name):
+        with StatementCapture() as capture:
+            response = QUERIES[name](self.client, self.sample)
+        self.assertEqual(response.status_code, 200, "{} returned {}".format(name, response.status_code))
+        self.assertTrue(capture.statements, "{} issued no statements".format(name))
+
+        costs = OrderedDict()
+        for statement, parameters in capture.statements:
+            plan = explain(statement, parameters)
+            key = fingerprint(statement)
+            costs[key] = max(costs.get(key, 0), plan["Total Cost"])
+
+            for node in plan_nodes(plan):
+                if node["Node Type"] == "Seq Scan":
+                    relation = node.get("Relation Name")
+                    self.assertLess(self.row_counts.get(relation, 0), SEQ_SCAN_MIN_ROWS,
+                                    "{}: sequential scan on {} in\n{}".format(name, relation, statement))
+        self.current[name] = costs
+
+        if os.environ.get("UPDATE_QUERY_PLAN_BASELINE") == "1":
+            return
+        baseline = self.baseline["queries"].get(name)
+        if not baseline:
+            self.skipTest("{}: no cost baseline in {}, record it with UPDATE_QUERY_PLAN_BASELINE=1"
+                          .format(name, os.path.basename(BASELINE_PATH)))
+        self.assertEqual(sorted(costs), sorted(baseline),
+                         "{}: statements changed, review plans and update baseline".format(name))
+        limit = 1 + self.baseline["tolerance"]
+        for key, cost in costs.items():
+            self.assertLessEqual(cost, baseline[key] * limit,
+                                 "{}: cost {} over baseline {} for\n{}".format(name, cost, baseline[key], key))
+
+    def test_list_get(self):
+        self.check_query("list_get")
+
+    def test_list_get_sidebar_page(self):
+        self.check_query("list_get_sidebar_page")
+
+    def test_route_get(self):
+        self.check_query("route_get")
+
+    def test_route_get_store_default(self):
+        self.check_query("route_get_store_default")
+
+    def test_list_print_get(self):
+        self.check_query("list_print_get")
+
+    def test_item_name_suggest(self):
+        self.check_query("item_name_suggest")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+""" Item Name Autocomplete Unit Tests """
+
+import os
+import unittest
+import datetime
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from shopping_list.suggest import PrefixIndex, Suggester, score, RECENCY_HALF_LIFE
+
+
+TODAY = datetime.date.today()
+
+
+def days_ago(days):
+    return TODAY - datetime.timedelta(days=days)
+
+
+class TestScore(unittest.TestCase):
+    """ Frequency and recency score """
+
+    def test_no_last_use(self):
+        self.assertEqual(score(4, None, TODAY), 4)
+
+    def test_used_today(self):
+        self.assertEqual(score(4, TODAY, TODAY), 4)
+
+    def test_half_life(self):
+        self.assertAlmostEqual(score(4, days_ago(RECENCY_HALF_LIFE), TODAY), 2)
+        self.assertAlmostEqual(score(4, days_ago(2 * RECENCY_HALF_LIFE), TODAY), 1)
+
+    def test_future_date(self):
+        self.assertEqual(score(4, TODAY + datetime.timedelta(days=3), TODAY), 4)
+
+
+class TestPrefixIndex(unittest.TestCase):
+    """ Prefix lookup and ranking
+
+    Cases: history rows as (name, count, last used), prefix, limit, expected names
+    """
+
+    cases = [
+        # More frequent first
+        ([("Tomatoes", 3, TODAY), ("Tortillas", 5, TODAY), ("Milk", 9, TODAY)], "to", 10,
+         ["Tortillas", "Tomatoes"]),
+        # Recent use outranks old frequent use
+        ([("Tomatoes", 2, TODAY), ("Tortillas", 6, days_ago(4 * RECENCY_HALF_LIFE))], "to", 10,
+         ["Tomatoes", "Tortillas"]),
+        # Case insensitive prefix, limit
+        ([("Tomatoes", 3, TODAY), ("tofu", 2, TODAY), ("Toast", 1, TODAY)], "TO", 2,
+         ["Tomatoes", "tofu"]),
+        # Names differing in case are merged, most used spelling shown
+        ([("tomatoes", 1, days_ago(10)), ("Tomatoes", 4, TODAY), ("Tofu", 3, TODAY)], "to", 10,
+         ["Tomatoes", "Tofu"]),
+        # No match, blank names ignored
+        ([("Milk", 1, TODAY), ("  ", 5, TODAY)], "to", 10, []),
+        # Prefix is the whole name
+        ([("Eggs", 1, TODAY), ("Eggplant", 1, days_ago(30))], "eggs", 10, ["Eggs"]),
+    ]
+
+    def test_suggest(self):
+        for rows, prefix, limit, expected in self.cases:
+            self.assertEqual(PrefixIndex(rows).suggest(prefix, limit), expected, (rows, prefix))
+
+    def test_add(self):
+        index = PrefixIndex([("Tortillas", 2, days_ago(1))])
+        index.add("Tofu", TODAY)
+        self.assertEqual(index.suggest("to", 10), ["Tortillas", "Tofu"])
+        index.add("tofu", TODAY)
+        index.add("Tofu ", TODAY)
+        self.assertEqual(index.suggest("to", 10), ["Tofu", "Tortillas"])
+        self.assertEqual(len(index.keys), 2)
+
+
+class FakeSuggester(Suggester):
+    """ Suggester reading User history and List version from dictionaries instead of the database """
+
+    def __init__(self, check_interval=30):
+        Suggester.__init__(self, max_bytes=1024 * 1024, max_names=3, check_interval=check_interval)
+        self.histories = {}
+        self.versions = {}
+        self.loads = 0
+        self.version_checks = 0
+
+    def _version(self, user_id):
+        self.version_checks += 1
+        return self.versions.get(user_id)
+
+    def _rows(self, user_id):
+        self.loads += 1
+        return list(self.histories.get(user_id, []))[:self.max_names + 1]
+
+    def query_suggest(self, user_id, prefix, limit):
+        return ["queried"]
+
+
+class TestSuggesterRefresh(unittest.TestCase):
+    """ Loaded indexes follow writes from other workers through the User's List version """
+
+    def setUp(self):
+        self.suggester = FakeSuggester()
+        self.suggester.histories[1] = [("Tomatoes", 2, TODAY)]
+        self.suggester.versions[1] = (TODAY, 1)
+
+    def expire(self, user_id):
+        """ Age loaded index past the check interval """
+        self.suggester._users[user_id].checked_at -= self.suggester.check_interval
+
+    def test_no_check_within_interval(self):
+        self.assertEqual(self.suggester.suggest(1, "to"), ["Tomatoes"])
+        self.suggester.histories[1].append(("Tofu", 1, TODAY))
+        self.suggester.versions[1] = (TODAY, 2)
+        self.assertEqual(self.suggester.suggest(1, "to"), ["Tomatoes"])
+        self.assertEqual((self.suggester.loads, self.suggester.version_checks), (1, 1))
+
+    def test_unchanged_version_keeps_index(self):
+        self.suggester.suggest(1, "to")
+        self.expire(1)
+        self.suggester.suggest(1, "to")
+        self.assertEqual((self.suggester.loads, self.suggester.version_checks), (1, 2))
+        # Checked again only after another interval
+        self.suggester.suggest(1, "to")
+        self.assertEqual(self.suggester.version_checks, 2)
+
+    def test_changed_version_reloads(self):
+        self.suggester.suggest(1, "to")
+        self.suggester.histories[1].append(("Tofu", 1, TODAY))
+        self.suggester.versions[1] = (TODAY, 2)
+        self.expire(1)
+        self.assertEqual(self.suggester.suggest(1, "to"), ["Tomatoes", "Tofu"])
+        self.assertEqual(self.suggester.loads, 2)
+        self.assertEqual(self.suggester._bytes, self.suggester._users[1].size)
+
+    def test_history_grown_too_large_uses_query(self):
+        self.suggester.suggest(1, "to")
+        self.suggester.histories[1] = [("Item {}".format(i), 1, TODAY) for i in range(5)]
+        self.suggester.versions[1] = (TODAY, 5)
+        self.expire(1)
+        self.assertEqual(self.suggester.suggest(1, "to"), ["queried"])
+        self.assertNotIn(1, self.suggester._users)
+        self.assertEqual(self.suggester._bytes, 0)
+
+    def test_learn_updates_loaded_index_only(self):
+        self.suggester.learn(2, ["Toast"])
+        self.assertNotIn(2, self.suggester._users)
+        self.suggester.suggest(1, "to")
+        self.suggester.learn(1, ["Tofu"])
+        self.assertEqual(self.suggester.suggest(1, "to"), ["Tomatoes", "Tofu"])
+        self.assertEqual(self.suggester.loads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+""" Utility Function Unit Tests """
+
+import os
+import datetime
+import unittest
+from decimal import Decimal
+
+# App configuration for testing environment
+os.environ["CONFIG_PATH"] = "shopping_list.config.TestingConfig"
+
+from shopping_list.database import Base, engine, session
+from shopping_list.models import *
+from shopping_list.utils import parse_item_lines, parse_quantity, parse_form, apply_updates, update_from_form
+
+
+# Measurement token: (Item Measurement id, matches after a quantity above 1), as from measurement_lookup
+MEASUREMENTS = {"lb": (1, True), "lbs": (1, True), "cans": (2, True), "can": (2, False),
+                "cn": (2, True), "cns": (2, True), "ea": (3, True)}
+
+
+class TestParseItemLines(unittest.TestCase):
+    """ Pasted item line parser
+
+    Cases: line, (item_name, item_notes, item_quantity, item_measurement_id)
+    """
+
+    cases = [
+        ("2 lbs flank steak, organic", ("flank steak", "organic", Decimal("2"), 1)),
+        ("1 1/2 lb ground beef", ("ground beef", "", Decimal("1.5"), 1)),
+        ("1/2 lb cheese", ("cheese", "", Decimal("0.5"), 1)),
+        ("1.5 lbs rice", ("rice", "", Decimal("1.5"), 1)),
+        ("12 eggs", ("eggs", "", Decimal("12"), None)),
+        # No quantity: quantity 0, never null
+        ("milk", ("milk", "", Decimal("0"), None)),
+        ("onions, yellow", ("onions", "yellow", Decimal("0"), None)),
+        # Invalid quantity: treated as no quantity
+        ("1/0 eggs", ("eggs", "", Decimal("0"), None)),
+        ("1 1/0 lb beef", ("beef", "", Decimal("0"), 1)),
+        # Measurement only directly after a quantity
+        ("can opener", ("can opener", "", Decimal("0"), None)),
+        # Singular of a plural measurement name only with a quantity up to 1
+        ("2 can openers", ("can openers", "", Decimal("2"), None)),
+        ("1 can tomatoes", ("tomatoes", "", Decimal("1"), 2)),
+        ("2 lb steak", ("steak", "", Decimal("2"), 1)),
+        ("lbs", ("lbs", "", Decimal("0"), None)),
+        # Quantity must be followed by whitespace
+        ("2% milk", ("2% milk", "", Decimal("0"), None)),
+        ("7up", ("7up", "", Decimal("0"), None)),
+        ("2 7up", ("7up", "", Decimal("2"), None)),
+        # List numbering and bullet markers
+        ("3. bananas", ("bananas", "", Decimal("0"), None)),
+        ("3) bananas", ("bananas", "", Decimal("0"), None)),
+        ("2. 3 cans beans", ("beans", "", Decimal("3"), 2)),
+        ("- 2 cans tomatoes", ("tomatoes", "", Decimal("2"), 2)),
+        ("* bread", ("bread", "", Decimal("0"), None)),
+        ("• butter", ("butter", "", Decimal("0"), None)),
+    ]
+
+    def test_lines(self):
+        for line, expected in self.cases:
+            items = parse_item_lines(line, MEASUREMENTS)
+            self.assertEqual(len(items), 1, line)
+            item = items[0]
+            self.assertEqual((item["item_name"], item["item_notes"], item["item_quantity"],
+                              item["item_measurement_id"]), expected, line)
+            self.assertIsNone(item["item_group_id"], line)
+
+    def test_skipped_lines(self):
+        for line in ["", "   ", "-", "3.", "2 lbs , notes only"]:
+            self.assertEqual(parse_item_lines(line, MEASUREMENTS), [], repr(line))
+
+    def test_multiple_lines(self):
+        items = parse_item_lines("1. 2 lbs steak\n\n2. milk\n", MEASUREMENTS)
+        self.assertEqual([item["item_name"] for item in items], ["steak", "milk"])
+
+    def test_truncated_to_column_lengths(self):
+        item = parse_item_lines("{}, {}".format("n" * 80, "x" * 150), MEASUREMENTS)[0]
+        self.assertEqual(len(item["item_name"]), 50)
+        self.assertEqual(len(item["item_notes"]), 100)
+
+    def test_parse_quantity(self):
+        for text, expected in [("2", Decimal("2")), ("1.25", Decimal("1.25")),
+                               ("1/3", Decimal("0.333")), ("2 1/4", Decimal("2.25"))]:
+            self.assertEqual(parse_quantity(text), expected, text)
+        self.assertRaises(ZeroDivisionError, parse_quantity, "1/0")
+
+
+class TestParseForm(unittest.TestCase):
+    """ Form input names in schema Model.ID.Column, values coerced by column type """
+
+    def test_grouped_by_model_and_primary_key(self):
+        updates = parse_form({"List.3.name": "Weekly", "List.3.shop_date": "2015-03-01",
+                              "ListItem.7.item_quantity": "1.5", "ListItem.8.item_notes": "ripe",
+                              "UserStore.1 2.default": "on"})
+        self.assertEqual(updates, {
+            List: {(3,): {"name": "Weekly", "shop_date": datetime.date(2015, 3, 1)}},
+            ListItem: {(7,): {"item_quantity": Decimal("1.5")}, (8,): {"item_notes": "ripe"}},
+            UserStore: {(1, 2): {"default": True}}})
+
+    def test_new_primary_keys(self):
+        updates = parse_form({"ListItem..item_name": "Apples", "ListItem. .item_notes": "green",
+                              "List.3.name": "Weekly"}, ListItem=12)
+        self.assertEqual(updates[ListItem], {(12,): {"item_name": "Apples", "item_notes": "green"}})
+        self.assertEqual(updates[List], {(3,): {"name": "Weekly"}})
+        # No new primary key for model
+        self.assertRaises(KeyError, parse_form, {"ListItem..item_name": "Apples"}, List=3)
+
+    def test_empty_values_null(self):
+        updates = parse_form({"ListItem.7.item_quantity": "", "ListItem.7.item_group_id": ""})
+        self.assertEqual(updates[ListItem][(7,)], {"item_quantity": None, "item_group_id": None})
+
+    def test_malformed_input_name(self):
+        for name in ["ListItem.7", "item_name", "ListItem.x.item_name"]:
+            self.assertRaises(ValueError, parse_form, {name: "Apples"})
+
+    def test_unknown_column(self):
+        self.assertRaises(KeyError, parse_form, {"ListItem.7.item_color": "red"})
+
+    def test_unknown_model(self):
+        self.assertRaises(AttributeError, parse_form, {"Basket.7.name": "Mine"})
+
+    def test_invalid_value(self):
+        self.assertRaises(ValueError, parse_form, {"List.3.shop_date": "tomorrow"})
+
+
+class TestUpdateFromForm(unittest.TestCase):
+    """ Form updates applied in one transaction, nothing written on failure """
+
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        user = User(name="Owner", email="owner@example.com")
+        store = Store(name="Corner Market")
+        session.add_all([user, store])
+        session.flush()
+        self.list = List(user_id=user.id, store_id=store.id, name="Weekly")
+        session.add(self.list)
+        session.flush()
+        self.items = [ListItem(list_id=self.list.id, item_name=name) for name in ("Apples", "Pears")]
+        session.add_all(self.items)
+        session.commit()
+        self.list_id = self.list.id
+        self.item_ids = [item.id for item in self.items]
+
+    def tearDown(self):
+        session.close()
+        Base.metadata.drop_all(engine)
+
+    def item_names(self):
+        session.expire_all()
+        return [session.query(ListItem).get(item_id).item_name for item_id in self.item_ids]
+
+    def test_applied(self):
+        self.assertTrue(update_from_form({"List.{}.name".format(self.list_id): "Weekend",
+                                          "ListItem.{}.item_name".format(self.item_ids[0]): "Limes",
+                                          "ListItem.{}.item_name".format(self.item_ids[1]): "Plums"}))
+        self.assertEqual(self.item_names(), ["Limes", "Plums"])
+        self.assertEqual(session.query(List).get(self.list_id).name, "Weekend")
+
+    def test_new_row_primary_key(self):
+        list_item = ListItem(list_id=self.list_id, item_name="New Item")
+        session.add(list_item)
+        session.commit()
+        self.assertTrue(update_from_form({"ListItem..item_name": "Figs", "ListItem..item_quantity": "3"},
+                                         ListItem=list_item.id))
+        session.expire_all()
+        list_item = session.query(ListItem).get(list_item.id)
+        self.assertEqual((list_item.item_name, list_item.item_quantity), ("Figs", Decimal("3")))
+
+    def test_failure_writes_nothing(self):
+        valid = {"List.{}.name".format(self.list_id): "Weekend",
+                 "ListItem.{}.item_name".format(self.item_ids[0]): "Limes"}
+        for invalid in [{"ListItem.{}.item_name".format(max(self.item_ids) + 100): "Missing row"},
+                        {"ListItem.{}.item_color".format(self.item_ids[1]): "red"},
+                        {"ListItem.{}".format(self.item_ids[1]): "Malformed"},
+                        {"ListItem.{}.item_quantity".format(self.item_ids[1]): "a few"}]:
+            data = dict(valid, **invalid)
+            self.assertFalse(update_from_form(data), invalid)
+            self.assertEqual(self.item_names(), ["Apples", "Pears"], invalid)
+            self.assertEqual(session.query(List).get(self.list_id).name, "Weekly", invalid)
+
+    def test_apply_updates_missing_row(self):
+        updates = parse_form({"ListItem.{}.item_name".format(self.item_ids[0]): "Limes",
+                              "ListItem.{}.item_name".format(max(self.item_ids) + 100): "Missing row"})
+        self.assertRaises(LookupError, apply_updates, updates)
+        session.rollback()
+        self.assertEqual(self.item_names(), ["Apples", "Pears"])
+
+
+if __name__ == "__main__":
+    unittest.main()